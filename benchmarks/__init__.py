@@ -0,0 +1 @@
+# Paquete de benchmarks: generador de aforos sintéticos y medición de las rutas críticas
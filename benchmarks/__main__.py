@@ -0,0 +1,243 @@
+"""
+Benchmarks de las rutas críticas del análisis de aforos
+
+Uso:
+    python -m benchmarks --escalas 10k,1M --formatos csv,xlsx
+
+Para cada escala y formato mide el tiempo y el pico de memoria (tracemalloc) de
+la lectura, la carga de filtros, el filtrado, las tablas de 15 minutos y por hora,
+los tres gráficos y el ZIP completo, y guarda los resultados en JSON.
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.generador import ESCALAS, preparar_archivo
+from conteo import analyzer
+from conteo import config
+from conteo import data_filter
+from conteo import database_reader
+from conteo import df_generator
+from conteo import duckdb_backend
+from conteo import graph_generator
+from conteo import warehouse
+from streamlit_app import utils_streamlit
+
+
+DIRECTORIO_BASE = os.path.dirname(os.path.abspath(__file__))
+
+
+class _ArchivoSubido(io.BytesIO):
+    """Imita el UploadedFile de Streamlit (bytes con nombre y tamaño)"""
+
+    def __init__(self, contenido, nombre):
+        super().__init__(contenido)
+        self.name = nombre
+        self.size = len(contenido)
+
+
+def medir(funcion, repeticiones=1, memoria=True):
+    """
+    Mide una función
+    
+    Args:
+        funcion: Función sin argumentos a medir
+        repeticiones: Veces que se ejecuta para medir el tiempo (se guarda el mínimo)
+        memoria: Si es True, hace una ejecución extra con tracemalloc para el pico de memoria
+        
+    Returns:
+        Tupla (resultado, segundos, pico_memoria_bytes)
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    pico = None
+    if memoria:
+        del resultado
+        gc.collect()
+        tracemalloc.start()
+        resultado = funcion()
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return resultado, min(tiempos), pico
+
+
+def _seleccion_completa(filtros):
+    """Selección equivalente a dejar todos los filtros de la interfaz en 'Todos'"""
+    return {
+        'FECHA': filtros['FECHA'],
+        'HORA_I': filtros['HORA_I'][0] if filtros['HORA_I'] else None,
+        'HORA_F': filtros['HORA_F'][-1] if filtros['HORA_F'] else None,
+        'DIGITADOR': [str(v) for v in filtros['DIGITADOR']],
+        'MOVIMIENTOS': [str(v) for v in filtros['MOVIMIENTOS']],
+        'ID_ESTACION': [str(v) for v in filtros['ID_ESTACION']],
+        'TIPO': [str(v) for v in filtros['TIPO']],
+        'INTERSECCION': [str(v) for v in filtros['INTERSECCION']],
+    }
+
+
+def ejecutar_escala(ruta, escala, formato, repeticiones, memoria):
+    """Ejecuta todas las etapas sobre un archivo y devuelve la lista de mediciones"""
+    mediciones = []
+
+    def registrar(etapa, funcion, filas_entrada=None):
+        resultado, segundos, pico = medir(funcion, repeticiones, memoria)
+        mediciones.append({
+            'escala': escala,
+            'formato': formato,
+            'etapa': etapa,
+            'filas_entrada': filas_entrada,
+            'segundos': segundos,
+            'memoria_pico_bytes': pico,
+        })
+        print(f"  {escala:>4} {formato:<4} {etapa:<32} {segundos:10.3f} s"
+              + (f" {pico / 1024 ** 2:10.1f} MB" if pico is not None else ""))
+        return resultado
+
+    with open(ruta, 'rb') as archivo:
+        contenido = archivo.read()
+
+    if formato == 'csv':
+        # Un CSV sin columnas de filtro no se puede agrupar: leer_csv_agregado tiene que leerlo completo
+        muestra = pd.read_csv(io.BytesIO(contenido), nrows=1000, usecols=lambda c: c not in config.columnas_filtro)
+        leida = database_reader.leer_csv_agregado(io.BytesIO(muestra.to_csv(index=False).encode()))
+        if len(leida) != len(muestra):
+            raise AssertionError(f"leer_csv_agregado sin columnas de filtro deja {len(leida)} filas y no "
+                                 f"{len(muestra)} ({escala}, {formato})")
+
+    # Lectura directa del archivo: Excel con leer_xlsx_columnas; CSV completo o, si supera
+    # config.csv_umbral_agregado_bytes, agregado por bloques con leer_csv_agregado
+    registrar('leer_datos', lambda: database_reader.leer_datos(ruta), ESCALAS[escala])
+
+    # Carga desde Streamlit: sin caché (directorio vacío) y luego desde la caché en Parquet
+    directorio_cache = config.cache_directorio
+    with tempfile.TemporaryDirectory() as directorio_temporal:
+        config.cache_directorio = directorio_temporal
+        try:
+            def cargar_sin_cache():
+                for nombre in os.listdir(directorio_temporal):
+                    os.remove(os.path.join(directorio_temporal, nombre))
+                return utils_streamlit.cargar_archivo_db(_ArchivoSubido(contenido, os.path.basename(ruta)))
+
+            df = registrar('cargar_archivo_db', cargar_sin_cache, ESCALAS[escala])
+            df = registrar('cargar_archivo_db_cache',
+                           lambda: utils_streamlit.cargar_archivo_db(_ArchivoSubido(contenido, os.path.basename(ruta))),
+                           ESCALAS[escala])
+        finally:
+            config.cache_directorio = directorio_cache
+
+    filas = len(df)
+    filtros = registrar('cargar_filtros', lambda: data_filter.cargar_filtros(df), filas)
+    filtros = utils_streamlit.obtener_filtros_disponibles(df)
+    seleccion = _seleccion_completa(filtros)
+
+    df_filtrado, _, _, _, _ = registrar(
+        'aplicar_filtros_seleccionados',
+        lambda: utils_streamlit.aplicar_filtros_seleccionados(df, seleccion), filas)
+
+    df_suma = registrar('crear_tabla_rango_15min',
+                        lambda: df_generator.crear_tabla_rango_15min(df_filtrado), len(df_filtrado))
+    df_rango_hora, hora_pico = registrar('crear_tabla_rango_hora',
+                                         lambda: df_generator.crear_tabla_rango_hora(df_suma), len(df_suma))
+
+    graficos = {
+        'barras': registrar('generar_grafico_barras',
+                            lambda: graph_generator.generar_grafico_barras(df_rango_hora), len(df_rango_hora)),
+        'barras_apiladas': registrar('generar_grafico_barras_apiladas',
+                                     lambda: graph_generator.generar_grafico_barras_apiladas(df_suma), len(df_suma)),
+    }
+    totales = [df_suma[c].sum() for c in ['AUTOS', 'MOTOS', 'MIO', 'TPC', 'CAMIONES', 'MIXTOS', 'BICICLETAS']]
+    graficos['torta'] = registrar('generar_grafico_torta', lambda: graph_generator.generar_grafico_torta(*totales))
+
+    if duckdb_backend.disponible():
+        # El motor DuckDB tiene que dar las mismas tablas que pandas con el mismo archivo (CSV o Excel)
+        _, suma_duckdb, rango_duckdb, _, pico_duckdb = registrar(
+            'analizar_duckdb', lambda: analyzer.analizar(df, seleccion, motor='duckdb'), filas)
+        if not (suma_duckdb.equals(df_suma) and rango_duckdb.equals(df_rango_hora) and pico_duckdb == hora_pico):
+            raise AssertionError(f"El motor DuckDB no coincide con pandas ({escala}, {formato})")
+
+    if {'ID', 'FOLIO'} <= set(df.columns):
+        # Agregar archivos a datos traídos del almacén tiene que quitar los mismos repetidos que
+        # entre archivos, aunque el almacén devuelva los ID como texto
+        primera, segunda = df.iloc[:filas * 3 // 5], df.iloc[filas * 2 // 5:]
+        esperadas = len(database_reader.quitar_duplicados(database_reader.combinar_datos([primera, segunda]))[0])
+        with tempfile.TemporaryDirectory() as directorio_almacen:
+            warehouse.guardar_en_almacen(primera, 'benchmark', directorio_almacen)
+            desde_almacen = database_reader.aplicar_esquema(warehouse.consultar_almacen(directorio=directorio_almacen))
+            combinado, _, _, _ = registrar('anexar_datos_almacen',
+                                           lambda: database_reader.anexar_datos(desde_almacen, segunda), len(segunda))
+        if len(combinado) != esperadas:
+            raise AssertionError(f"Agregar a datos del almacén deja {len(combinado)} filas y no {esperadas} "
+                                 f"({escala}, {formato})")
+
+    registrar('crear_zip_completo',
+              lambda: utils_streamlit.crear_zip_completo(df_filtrado, df_suma, df_rango_hora, graficos,
+                                                         hora_pico, os.path.basename(ruta)),
+              len(df_filtrado))
+
+    return mediciones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--escalas', default='10k', help=f"Escalas separadas por coma ({', '.join(ESCALAS)})")
+    parser.add_argument('--formatos', default='csv,xlsx', help="Formatos separados por coma (csv, xlsx)")
+    parser.add_argument('--semilla', type=int, default=0, help="Semilla del generador de datos")
+    parser.add_argument('--repeticiones', type=int, default=1, help="Repeticiones por etapa (se guarda el mínimo)")
+    parser.add_argument('--sin-memoria', action='store_true', help="No medir el pico de memoria con tracemalloc")
+    parser.add_argument('--datos', default=os.path.join(DIRECTORIO_BASE, 'datos'),
+                        help="Carpeta de los archivos generados (se reutilizan entre ejecuciones)")
+    parser.add_argument('--salida', default=None, help="Archivo JSON de resultados")
+    args = parser.parse_args(argv)
+
+    escalas = [e.strip() for e in args.escalas.split(',') if e.strip()]
+    formatos = [f.strip() for f in args.formatos.split(',') if f.strip()]
+    for escala in escalas:
+        if escala not in ESCALAS:
+            parser.error(f"Escala desconocida: {escala}")
+
+    mediciones = []
+    for escala in escalas:
+        for formato in formatos:
+            print(f"Preparando datos {escala} ({formato})...")
+            ruta = preparar_archivo(escala, formato, args.datos, args.semilla)
+            if ruta is None:
+                print(f"  {escala} no cabe en una hoja de Excel; se omite {formato}")
+                continue
+            mediciones.extend(ejecutar_escala(ruta, escala, formato, args.repeticiones, not args.sin_memoria))
+
+    salida = args.salida or os.path.join(
+        DIRECTORIO_BASE, 'resultados', f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as archivo:
+        json.dump({
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'plataforma': platform.platform(),
+            'semilla': args.semilla,
+            'repeticiones': args.repeticiones,
+            'mediciones': mediciones,
+        }, archivo, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {salida}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Generador de archivos de aforo sintéticos para los benchmarks
+
+Produce registros con las columnas que espera data_filter.cargar_filtros,
+intervalos de 15 minutos en HORA_I/HORA_F y varias estaciones, movimientos y
+días. Con la misma semilla siempre genera los mismos datos.
+"""
+
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from conteo import config
+
+
+# Escalas disponibles (número de filas)
+ESCALAS = {
+    '10k': 10_000,
+    '1M': 1_000_000,
+    '10M': 10_000_000,
+}
+
+# Límite de filas de una hoja de Excel (sin contar el encabezado)
+MAX_FILAS_XLSX = 1_048_575
+
+# Volumen medio por intervalo de cada columna de vehículos
+VOLUMEN_MEDIO = {
+    'AUTOS': 40, 'C_PADRON': 1.5, 'C_ALIMENTADOR': 1.0, 'C_ARTICULADO': 0.8,
+    'MICROBUS': 2.0, 'BUSETA': 2.5, 'BUS': 3.0, 'CAM_2EJ_PQ': 4.0, 'CAM_2EJ_GD': 2.0,
+    'CAM_3EJ': 1.0, 'CAM_4EJ': 0.5, 'CAM_5EJ': 0.3, 'CAM_6EJ': 0.3,
+    'C_CAMION3A4EJES': 0.4, 'C_CAMION5Y6EJES': 0.2, 'MOTOS': 30, 'BICICLETA': 3,
+}
+
+
+def _perfil_diario():
+    """Factor de volumen para cada uno de los 96 intervalos del día (picos AM y PM)"""
+    horas = np.arange(96) / 4
+    return 0.15 + np.exp(-((horas - 7.25) ** 2) / 1.5) + 0.9 * np.exp(-((horas - 17.75) ** 2) / 2.0)
+
+
+def generar_aforo(filas, semilla=0, estaciones=None, movimientos=4, fecha_inicio=date(2024, 3, 1)):
+    """
+    Genera un DataFrame de aforo sintético
+    
+    Args:
+        filas: Número de filas a generar
+        semilla: Semilla del generador aleatorio
+        estaciones: Número de estaciones (por defecto crece con el tamaño)
+        movimientos: Número de movimientos por estación
+        fecha_inicio: Fecha del primer día
+        
+    Returns:
+        DataFrame con las columnas de config.lista_columnas y algunas extra sin uso
+    """
+    rng = np.random.default_rng(semilla)
+    if estaciones is None:
+        estaciones = int(np.clip(filas // 20_000, 3, 40))
+
+    # Cada fila es (día, estación, movimiento, intervalo), recorriendo el día completo
+    fila = np.arange(filas)
+    intervalo = fila % 96
+    grupo = fila // 96
+    movimiento = grupo % movimientos
+    estacion = (grupo // movimientos) % estaciones
+    dia = grupo // (movimientos * estaciones)
+
+    minutos_i = intervalo * 15
+    minutos_f = (minutos_i + 15) % (24 * 60)
+    etiquetas_hora = np.array([f"{m // 60:02d}:{m % 60:02d}:00" for m in range(0, 24 * 60, 15)])
+    fechas = pd.to_datetime(fecha_inicio) + pd.to_timedelta(dia, unit='D')
+
+    nombres_estacion = np.array([f"E{e + 1:03d}" for e in range(estaciones)])
+    intersecciones = np.array([f"CALLE {10 + e} CON CARRERA {20 + 3 * e}" for e in range(estaciones)])
+    digitadores = np.array(['ANA', 'CARLOS', 'DIANA', 'JORGE', 'LUISA'])
+
+    df = pd.DataFrame({
+        'FECHA': fechas,
+        'HORA_RANGO_I': (intervalo // 4).astype(str),
+        'HORA_RANGO_F': ((intervalo // 4 + 1) % 24).astype(str),
+        'DIGITADOR': digitadores[(estacion + dia) % len(digitadores)],
+        'AFORADOR': np.char.add('AFORADOR ', ((estacion * movimientos + movimiento) % 25).astype(str)),
+        'MOVIMIENTOS': movimiento + 1,
+        'ZONA_TRANSITO': np.char.add('ZT', (estacion % 8).astype(str)),
+        'ID_ESTACION': nombres_estacion[estacion],
+        'TIPO': np.where(movimiento == movimientos - 1, 'PEATONAL', 'VEHICULAR'),
+        'MUNICIPIO': 'CALI',
+        'CORREGIMIENTO': '',
+        'VEREDA': '',
+        'UBICACION': 'URBANA',
+        'INTERSECCION': intersecciones[estacion],
+        'ID': fila + 1,
+        'FOLIO': grupo + 1,
+        'HORA_I': etiquetas_hora[intervalo],
+        'HORA_F': etiquetas_hora[minutos_f // 15],
+    })
+
+    # Conteos con un perfil de picos en la mañana y en la tarde
+    perfil = _perfil_diario()[intervalo]
+    for columna in config.columnas_vehiculos:
+        df[columna] = rng.poisson(VOLUMEN_MEDIO[columna] * perfil).astype('int64')
+
+    # Columnas que traen los formularios de campo y que el análisis no usa
+    df['OBSERVACIONES'] = np.where(rng.random(filas) < 0.02, 'LLUVIA', '')
+    df['CLIMA'] = 'SECO'
+    df['VERSION_FORMULARIO'] = 3
+
+    return df
+
+
+def escribir_xlsx(df, ruta):
+    """Escribe el DataFrame como .xlsx fila por fila (modo de solo escritura de openpyxl)"""
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Datos')
+    hoja.append(list(df.columns))
+    for fila in df.itertuples(index=False, name=None):
+        hoja.append(fila)
+    libro.save(ruta)
+
+
+def preparar_archivo(escala, formato, directorio, semilla=0):
+    """
+    Genera (o reutiliza si ya existe) el archivo de aforo de una escala y formato
+    
+    Args:
+        escala: Clave de ESCALAS ('10k', '1M', '10M')
+        formato: 'csv' o 'xlsx'
+        directorio: Carpeta donde se guardan los archivos generados
+        semilla: Semilla del generador
+        
+    Returns:
+        Ruta del archivo, o None si la escala no cabe en el formato
+    """
+    filas = ESCALAS[escala]
+    if formato == 'xlsx' and filas > MAX_FILAS_XLSX:
+        return None
+
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"aforo_{escala}_s{semilla}.{formato}")
+    if os.path.exists(ruta):
+        return ruta
+
+    df = generar_aforo(filas, semilla)
+    ruta_temporal = ruta + '.tmp'
+    if formato == 'csv':
+        df.to_csv(ruta_temporal, index=False)
+    else:
+        escribir_xlsx(df, ruta_temporal)
+    os.replace(ruta_temporal, ruta)
+    return ruta
@@ -0,0 +1,10 @@
+import pandas as pd
+
+# Copy-on-Write: las selecciones de filas y columnas no copian los datos hasta que se
+# modifican, y modificar un resultado nunca cambia el DataFrame del que salió (por
+# ejemplo, el archivo cargado en la sesión). En pandas 3 es el único modo
+if int(pd.__version__.split('.')[0]) < 3:
+    try:
+        pd.set_option('mode.copy_on_write', True)
+    except KeyError:
+        pass  # Versiones de pandas sin la opción
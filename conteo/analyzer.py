@@ -0,0 +1,157 @@
+import pandas as pd
+
+from conteo import config
+from conteo import data_filter
+from conteo import database_reader
+from conteo import df_generator
+from conteo import duckdb_backend
+from conteo import graph_generator
+from conteo import profiler
+
+
+def analizar(df, filtros_seleccionados, indice=None, motor=None):
+    """Aplica los filtros seleccionados y genera las tablas, los gráficos y la hora pico.
+
+    Es la parte del análisis que no depende de la interfaz, para usarla desde
+    Streamlit o desde el procesamiento por lotes (python -m conteo). No modifica
+    el DataFrame recibido ni ningún estado global.
+
+    `motor` ('pandas' o 'duckdb', por defecto config.motor_consultas) elige dónde
+    se filtra y se agrupa; con 'duckdb' se usa analizar_con_duckdb.
+
+    Devuelve la tupla (df_filtrado, df_suma_por_hora, df_rango_hora, graficos, hora_pico).
+    Lanza ValueError si los filtros no dejan ninguna fila.
+    """
+    if (motor or config.motor_consultas) == 'duckdb':
+        return analizar_con_duckdb(df, filtros_seleccionados, indice=indice)
+
+    # Trabajar sobre el esquema compacto: las etiquetas son categorías y FECHA es fecha nativa
+    df = database_reader.aplicar_esquema(df)
+
+    df_filtrado = filtrar_filas(df, filtros_seleccionados, indice)
+
+    # Verificar que no esté vacío
+    if df_filtrado.empty:
+        raise ValueError("Los filtros aplicados no devolvieron ningún resultado")
+
+    # Generar tablas de análisis
+    with profiler.etapa('crear_tabla_rango_15min', len(df_filtrado)) as e:
+        df_suma_por_hora = df_generator.crear_tabla_rango_15min(df_filtrado)
+        e.salida(len(df_suma_por_hora))
+    with profiler.etapa('crear_tabla_rango_hora', len(df_suma_por_hora)) as e:
+        df_rango_hora, hora_pico = df_generator.crear_tabla_rango_hora(df_suma_por_hora)
+        e.salida(len(df_rango_hora))
+
+    # Generar gráficos
+    graficos = generar_graficos(df_suma_por_hora, df_rango_hora)
+
+    return df_filtrado, df_suma_por_hora, df_rango_hora, graficos, hora_pico
+
+
+def filtrar_filas(df, filtros_seleccionados, indice=None):
+    """Devuelve las filas del DataFrame (con el esquema compacto) que cumplen los filtros."""
+    # Calcular una sola máscara con todos los filtros y materializar las filas a lo sumo una vez
+    # (si la selección deja todas las filas se usa el mismo DataFrame: con Copy-on-Write no se puede
+    # modificar el original a través del resultado)
+    with profiler.etapa('filtros', len(df)) as e:
+        mascara = data_filter.calcular_mascara(df, filtros_seleccionados, indice)
+        df_filtrado = df if mascara.all() else df[mascara]
+        e.salida(len(df_filtrado))
+    return df_filtrado
+
+
+def generar_graficos(df_suma_por_hora, df_rango_hora):
+    """Genera los gráficos de barras, barras apiladas y torta a partir de las tablas."""
+    with profiler.etapa('gráfico barras', len(df_rango_hora)):
+        grafico_barras = graph_generator.generar_grafico_barras(df_rango_hora)
+    with profiler.etapa('gráfico barras apiladas', len(df_suma_por_hora)):
+        grafico_barras_apiladas = graph_generator.generar_grafico_barras_apiladas(df_suma_por_hora)
+
+    # Extraer totales para gráfico de torta
+    total_autos = df_suma_por_hora['AUTOS'].sum()
+    total_motos = df_suma_por_hora['MOTOS'].sum()
+    total_mio = df_suma_por_hora['MIO'].sum()
+    total_tpc = df_suma_por_hora['TPC'].sum()
+    total_camiones = df_suma_por_hora['CAMIONES'].sum()
+    total_mixtos = df_suma_por_hora['MIXTOS'].sum()
+    total_bicicletas = df_suma_por_hora['BICICLETAS'].sum()
+
+    with profiler.etapa('gráfico torta', len(df_suma_por_hora)):
+        grafico_torta = graph_generator.generar_grafico_torta(
+            total_autos, total_motos, total_mio, total_tpc, 
+            total_camiones, total_mixtos, total_bicicletas
+        )
+
+    return {
+        'barras': grafico_barras,
+        'barras_apiladas': grafico_barras_apiladas,
+        'torta': grafico_torta
+    }
+
+
+def actualizar_analisis(resultado, nuevas, filtros_seleccionados):
+    """Actualiza un resultado de analizar después de agregar las filas `nuevas` al DataFrame.
+
+    Solo se filtran y suman las filas nuevas: sus tablas de 15 minutos y por hora
+    se suman a las del resultado y la hora pico se busca en la tabla por hora ya
+    sumada. Da lo mismo que volver a llamar analizar con todas las filas, pero el
+    costo depende de las filas nuevas.
+
+    Devuelve la misma tupla que analizar.
+    """
+    df_filtrado, df_suma_por_hora, df_rango_hora, graficos, hora_pico = resultado
+
+    nuevas = database_reader.aplicar_esquema(nuevas)
+    mascara = data_filter.calcular_mascara(nuevas, filtros_seleccionados)
+    nuevas_filtradas = nuevas if mascara.all() else nuevas[mascara]
+    if nuevas_filtradas.empty:
+        return resultado
+
+    df_filtrado = database_reader.combinar_datos([df_filtrado, nuevas_filtradas])
+
+    suma_nueva = df_generator.crear_tabla_rango_15min(nuevas_filtradas)
+    rango_nuevo, _ = df_generator.crear_tabla_rango_hora(suma_nueva)
+    df_suma_por_hora = df_generator.sumar_tablas(df_suma_por_hora, suma_nueva)
+    df_rango_hora = df_generator.sumar_tablas(df_rango_hora, rango_nuevo)
+    hora_pico = df_generator.describir_hora_pico(df_rango_hora)
+
+    graficos = generar_graficos(df_suma_por_hora, df_rango_hora)
+
+    return df_filtrado, df_suma_por_hora, df_rango_hora, graficos, hora_pico
+
+
+def analizar_con_duckdb(origen, filtros_seleccionados, incluir_filas=True, indice=None):
+    """Igual que analizar, pero los filtros y las sumas por minuto se calculan en DuckDB.
+
+    `origen` es un DataFrame o una ruta (o lista de rutas) de archivos Parquet con
+    el esquema compacto. DuckDB recorre el origen una sola vez y a pandas solo
+    vuelven las sumas por minuto del día para las tablas y los gráficos.
+
+    Las filas filtradas de un DataFrame se toman de él mismo (con `indice`, como en
+    analizar); las de archivos Parquet se traen de DuckDB. Con incluir_filas=False
+    no se traen (df_filtrado es None), así se puede analizar un estudio más grande
+    que la memoria; duckdb_backend.filtrar con un límite sirve para una vista previa.
+    """
+    with profiler.etapa('sumas por minuto (duckdb)') as e:
+        conteos, filas = duckdb_backend.sumas_por_minuto(origen, filtros_seleccionados)
+        e.salida(filas)
+    if filas == 0:
+        raise ValueError("Los filtros aplicados no devolvieron ningún resultado")
+
+    if not incluir_filas:
+        df_filtrado = None
+    elif isinstance(origen, pd.DataFrame):
+        df_filtrado = filtrar_filas(database_reader.aplicar_esquema(origen), filtros_seleccionados, indice)
+    else:
+        with profiler.etapa('filtros (duckdb)') as e:
+            df_filtrado = duckdb_backend.filtrar(origen, filtros_seleccionados)
+            e.salida(len(df_filtrado))
+    with profiler.etapa('crear_tabla_rango_15min', len(conteos)) as e:
+        df_suma_por_hora = df_generator.tabla_rango_15min_desde_conteos(conteos)
+        e.salida(len(df_suma_por_hora))
+    with profiler.etapa('crear_tabla_rango_hora', len(df_suma_por_hora)) as e:
+        df_rango_hora, hora_pico = df_generator.crear_tabla_rango_hora(df_suma_por_hora)
+        e.salida(len(df_rango_hora))
+    graficos = generar_graficos(df_suma_por_hora, df_rango_hora)
+
+    return df_filtrado, df_suma_por_hora, df_rango_hora, graficos, hora_pico
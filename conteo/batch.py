@@ -0,0 +1,207 @@
+"""
+Procesamiento por lotes de archivos de aforo, sin la interfaz de Streamlit
+
+Uso:
+    python -m conteo ESTUDIO/ "otros/*.xlsx" --filtros filtros.json --procesos 8 --salida reportes/
+
+Cada archivo se analiza en un proceso del pool con los mismos filtros y se
+escribe su paquete de reporte (el mismo ZIP que se descarga desde la página).
+Al final se escribe un índice (indice.json e indice.csv) con el estado, la
+hora pico y los tiempos de cada archivo.
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from conteo import analyzer
+from conteo import database_reader
+from conteo import exporter
+
+
+EXTENSIONES = ('.xlsx', '.csv')
+
+
+def buscar_archivos(entradas, recursivo=False):
+    """Expande carpetas y patrones glob en la lista ordenada de archivos de aforo."""
+    archivos = []
+    for entrada in entradas:
+        entrada = database_reader.ajustar_direccion(entrada)
+        if os.path.isdir(entrada):
+            patron = os.path.join(entrada, '**', '*') if recursivo else os.path.join(entrada, '*')
+            candidatos = glob.glob(patron, recursive=recursivo)
+        elif glob.has_magic(entrada):
+            candidatos = glob.glob(entrada, recursive=True)
+        else:
+            candidatos = [entrada]
+        archivos.extend(c for c in candidatos if c.lower().endswith(EXTENSIONES) and os.path.isfile(c))
+
+    # Sin duplicados, conservando el orden
+    return list(dict.fromkeys(os.path.abspath(a) for a in archivos))
+
+
+def leer_filtros(ruta_json=None, filtros=None):
+    """Arma el diccionario de filtros a partir de un JSON y de argumentos COLUMNA=v1,v2."""
+    filtros_seleccionados = {}
+    if ruta_json:
+        with open(ruta_json, encoding='utf-8') as archivo:
+            filtros_seleccionados.update(json.load(archivo))
+
+    for filtro in filtros or []:
+        columna, _, valores = filtro.partition('=')
+        columna = columna.strip().upper()
+        if columna in ('HORA_I', 'HORA_F'):
+            filtros_seleccionados[columna] = valores.strip()
+        else:
+            filtros_seleccionados[columna] = [v.strip() for v in valores.split(',') if v.strip()]
+
+    return filtros_seleccionados
+
+
+def _predicados_lectura(filtros_seleccionados):
+    """Filtros que se pueden aplicar mientras se lee un Excel: rango de FECHA y estaciones.
+
+    El rango va del mínimo al máximo de las fechas elegidas; el filtro exacto lo
+    sigue haciendo analyzer.analizar, así que esto solo descarta filas antes.
+    """
+    predicados = {}
+    fechas = filtros_seleccionados.get('FECHA')
+    if fechas:
+        fechas = pd.to_datetime(pd.Series(fechas if isinstance(fechas, list) else [fechas]), errors='coerce').dropna()
+        if len(fechas):
+            predicados['fechas'] = (fechas.min(), fechas.max())
+    estaciones = filtros_seleccionados.get('ID_ESTACION')
+    if estaciones:
+        predicados['estaciones'] = estaciones if isinstance(estaciones, list) else [estaciones]
+    return predicados
+
+
+def procesar_archivo(ruta, filtros_seleccionados, ruta_reporte):
+    """Analiza un archivo y escribe su ZIP de reporte. Devuelve el resumen para el índice."""
+    resumen = {'archivo': ruta, 'reporte': None, 'estado': 'ok', 'error': None,
+               'filas': None, 'filas_filtradas': None, 'hora_pico': None, 'tiempos': {}}
+    inicio = time.perf_counter()
+    try:
+        df = database_reader.aplicar_esquema(database_reader.leer_datos(
+            ruta, **_predicados_lectura(filtros_seleccionados)))
+        resumen['filas'] = len(df)
+        resumen['tiempos']['lectura'] = time.perf_counter() - inicio
+
+        marca = time.perf_counter()
+        df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico = analyzer.analizar(df, filtros_seleccionados)
+        resumen['filas_filtradas'] = len(df_filtrado)
+        resumen['hora_pico'] = hora_pico
+        resumen['tiempos']['analisis'] = time.perf_counter() - marca
+
+        marca = time.perf_counter()
+        # El ZIP se escribe directo en el archivo de salida, sin armarlo antes en memoria
+        with open(ruta_reporte, 'wb') as archivo:
+            exporter.escribir_zip_completo(df_filtrado, df_suma_hora, df_rango_hora, graficos,
+                                           hora_pico, os.path.basename(ruta), archivo)
+        resumen['reporte'] = ruta_reporte
+        resumen['tiempos']['exportacion'] = time.perf_counter() - marca
+    except Exception as e:
+        resumen['estado'] = 'error'
+        resumen['error'] = f"{type(e).__name__}: {e}"
+
+    resumen['tiempos']['total'] = time.perf_counter() - inicio
+    return resumen
+
+
+def _rutas_reporte(archivos, salida):
+    """Una ruta de ZIP por archivo; si dos archivos tienen el mismo nombre se numeran."""
+    rutas, usados = {}, set()
+    for archivo in archivos:
+        base = os.path.splitext(os.path.basename(archivo))[0]
+        nombre, n = f"Analisis-{base}.zip", 1
+        while nombre in usados:
+            n += 1
+            nombre = f"Analisis-{base}-{n}.zip"
+        usados.add(nombre)
+        rutas[archivo] = os.path.join(salida, nombre)
+    return rutas
+
+
+def escribir_indice(resumenes, salida, filtros_seleccionados, tiempo_total):
+    """Escribe el índice del lote en indice.json e indice.csv."""
+    with open(os.path.join(salida, 'indice.json'), 'w', encoding='utf-8') as archivo:
+        json.dump({'filtros': filtros_seleccionados, 'tiempo_total': tiempo_total, 'archivos': resumenes},
+                  archivo, indent=2, ensure_ascii=False, default=str)
+
+    filas = []
+    for resumen in resumenes:
+        fila = {k: v for k, v in resumen.items() if k != 'tiempos'}
+        fila.update({f"segundos_{etapa}": valor for etapa, valor in resumen['tiempos'].items()})
+        filas.append(fila)
+    pd.DataFrame(filas).to_csv(os.path.join(salida, 'indice.csv'), index=False)
+
+
+def procesar_lote(archivos, filtros_seleccionados, salida, procesos=None):
+    """
+    Procesa los archivos en paralelo y escribe un reporte por archivo más el índice
+    
+    Args:
+        archivos: Lista de rutas de archivos de aforo
+        filtros_seleccionados: Diccionario de filtros (mismo formato que la página)
+        salida: Carpeta donde se escriben los reportes y el índice
+        procesos: Número de procesos (por defecto, todos los núcleos)
+        
+    Returns:
+        Lista de resúmenes, en el mismo orden de `archivos`
+    """
+    os.makedirs(salida, exist_ok=True)
+    rutas = _rutas_reporte(archivos, salida)
+    procesos = procesos or os.cpu_count() or 1
+    inicio = time.perf_counter()
+
+    resumenes = {}
+    if procesos == 1:
+        for archivo in archivos:
+            resumenes[archivo] = procesar_archivo(archivo, filtros_seleccionados, rutas[archivo])
+            _informar(resumenes[archivo], len(resumenes), len(archivos))
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            tareas = {pool.submit(procesar_archivo, archivo, filtros_seleccionados, rutas[archivo]): archivo
+                      for archivo in archivos}
+            for tarea in as_completed(tareas):
+                resumenes[tareas[tarea]] = tarea.result()
+                _informar(resumenes[tareas[tarea]], len(resumenes), len(archivos))
+
+    resumenes = [resumenes[archivo] for archivo in archivos]
+    escribir_indice(resumenes, salida, filtros_seleccionados, time.perf_counter() - inicio)
+    return resumenes
+
+
+def _informar(resumen, hechos, total):
+    estado = 'OK' if resumen['estado'] == 'ok' else f"ERROR ({resumen['error']})"
+    print(f"[{hechos}/{total}] {os.path.basename(resumen['archivo'])}: {estado} "
+          f"en {resumen['tiempos']['total']:.1f} s", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m conteo', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('entradas', nargs='+', help="Carpetas, archivos o patrones glob (.xlsx/.csv)")
+    parser.add_argument('--filtros', help="Archivo JSON con los filtros (mismas claves que la página)")
+    parser.add_argument('--filtro', action='append', metavar='COLUMNA=V1,V2',
+                        help="Filtro adicional, por ejemplo ID_ESTACION=E001,E002 o HORA_I=06:00:00")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo (por defecto, todos los núcleos)")
+    parser.add_argument('--salida', default='reportes', help="Carpeta de salida de los reportes")
+    parser.add_argument('--recursivo', action='store_true', help="Buscar archivos también en subcarpetas")
+    args = parser.parse_args(argv)
+
+    archivos = buscar_archivos(args.entradas, args.recursivo)
+    if not archivos:
+        parser.error("No se encontraron archivos .xlsx o .csv")
+
+    filtros_seleccionados = leer_filtros(args.filtros, args.filtro)
+    resumenes = procesar_lote(archivos, filtros_seleccionados, args.salida, args.procesos)
+
+    errores = sum(1 for r in resumenes if r['estado'] != 'ok')
+    print(f"{len(resumenes) - errores} reportes generados, {errores} con error. Índice en {args.salida}")
+    return 1 if errores else 0
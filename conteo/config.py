@@ -1,2 +1,92 @@
 # config.py
-hora_pico_global = ""
+import os
+import tempfile
+
+# Registro de clases de vehículo: cada columna de conteo que trae el archivo y la clase
+# a la que pertenece. Define qué columnas de conteo se leen y cómo se agrupan
+clases_vehiculos = {
+    'AUTOS': 'AUTOS',
+    'C_PADRON': 'MIO', 'C_ALIMENTADOR': 'MIO', 'C_ARTICULADO': 'MIO',
+    'MICROBUS': 'TPC', 'BUSETA': 'TPC', 'BUS': 'TPC',
+    'CAM_2EJ_PQ': 'CAMIONES', 'CAM_2EJ_GD': 'CAMIONES', 'CAM_3EJ': 'CAMIONES', 'CAM_4EJ': 'CAMIONES',
+    'CAM_5EJ': 'CAMIONES', 'CAM_6EJ': 'CAMIONES', 'C_CAMION3A4EJES': 'CAMIONES', 'C_CAMION5Y6EJES': 'CAMIONES',
+    'MOTOS': 'MOTOS',
+    'BICICLETA': 'BICICLETAS',
+}
+
+# Columnas de la tabla de sumas (en el orden en que se presentan) y las clases que suma cada una
+grupos_vehiculos = {
+    'AUTOS': ['AUTOS'],
+    'MOTOS': ['MOTOS'],
+    'MIO': ['MIO'],
+    'TPC': ['TPC'],
+    'CAMIONES': ['CAMIONES'],
+    'MIXTOS': ['AUTOS', 'MIO', 'TPC', 'CAMIONES', 'MOTOS'],
+    'BICICLETAS': ['BICICLETAS'],
+}
+
+# Factores de vehículo equivalente por columna de conteo, para las tablas ponderadas
+# (las columnas que no aparecen cuentan 1). Vacío: se cuentan vehículos sin ponderar
+factores_equivalencia = {}
+
+# Columnas de vehículos (conteos) que trae cada registro de aforo
+columnas_vehiculos = list(clases_vehiculos)
+
+# Columnas que se conservan de los archivos cargados
+lista_columnas = ['FECHA', 'HORA_RANGO_I', 'HORA_RANGO_F','DIGITADOR' ,'AFORADOR' ,'MOVIMIENTOS' ,
+                'ZONA_TRANSITO' , 'ID_ESTACION','TIPO','MUNICIPIO','CORREGIMIENTO','VEREDA','UBICACION',
+                'INTERSECCION','ID','FOLIO','HORA_I','HORA_F'] + columnas_vehiculos
+
+# Columnas sobre las que se pueden aplicar filtros
+columnas_filtro = ['FECHA', 'HORA_I', 'HORA_F', 'DIGITADOR', 'MOVIMIENTOS', 'ID_ESTACION', 'TIPO', 'INTERSECCION']
+
+# Columnas de filtro por valor que se indexan con sus códigos al cargar el archivo
+columnas_indice = ['DIGITADOR', 'MOVIMIENTOS', 'ID_ESTACION', 'TIPO', 'INTERSECCION', 'FECHA']
+
+# Columnas de texto que se guardan como categorías al cargar el archivo. Las de filtro
+# se comparan como texto (igual que en la interfaz), el resto conserva su valor original
+columnas_etiqueta_filtro = ['DIGITADOR', 'MOVIMIENTOS', 'ID_ESTACION', 'TIPO', 'INTERSECCION']
+columnas_etiqueta = ['HORA_RANGO_I', 'HORA_RANGO_F', 'AFORADOR', 'ZONA_TRANSITO', 'MUNICIPIO',
+                'CORREGIMIENTO', 'VEREDA', 'UBICACION']
+
+# Columnas de minuto del día (int16) que se calculan de HORA_I y HORA_F al cargar el archivo.
+# Los filtros de hora y las agrupaciones usan estos enteros; las horas en texto quedan para mostrar
+columnas_minuto = {'HORA_I': 'MINUTO_I', 'HORA_F': 'MINUTO_F'}
+
+# Los CSV más grandes que este tamaño se leen por bloques y se agregan mientras se leen
+csv_umbral_agregado_bytes = int(os.environ.get('GVCONTEO_CSV_UMBRAL_AGREGADO', 256 * 1024 ** 2))  # 256 MB
+csv_tamano_bloque = 200_000
+
+# Procesos que leen a la vez los .xlsx cuando se cargan varios archivos de un mismo estudio
+carga_procesos = int(os.environ.get('GVCONTEO_CARGA_PROCESOS', min(4, os.cpu_count() or 1)))
+
+# Caché en disco de los archivos cargados (Parquet, direccionado por el hash del contenido)
+cache_directorio = os.environ.get('GVCONTEO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'gvconteo_cache'))
+cache_max_bytes = int(os.environ.get('GVCONTEO_CACHE_MAX_BYTES', 2 * 1024 ** 3))  # 2 GB
+
+# Almacén histórico: dataset de Parquet particionado por año, mes y estación (ver conteo/warehouse.py).
+# Cada archivo se escribe en grupos de hasta almacen_filas_grupo filas, la unidad mínima que se lee
+almacen_directorio = os.environ.get('GVCONTEO_ALMACEN_DIR', os.path.join(os.path.expanduser('~'), 'gvconteo_almacen'))
+almacen_filas_grupo = int(os.environ.get('GVCONTEO_ALMACEN_FILAS_GRUPO', 50_000))
+
+# Caché en memoria de resultados de análisis (por archivo y selección de filtros)
+cache_resultados_max_bytes = int(os.environ.get('GVCONTEO_CACHE_RESULTADOS_MAX_BYTES', 512 * 1024 ** 2))  # 512 MB
+
+# Caché en memoria de los archivos de descarga ya generados (Excel, HTML, ZIP)
+cache_artefactos_max_bytes = int(os.environ.get('GVCONTEO_CACHE_ARTEFACTOS_MAX_BYTES', 256 * 1024 ** 2))  # 256 MB
+
+# Presupuesto de memoria de los datos y resultados que guarda cada sesión de Streamlit, y de todas
+# las sesiones juntas. Al superarlo, lo usado hace más tiempo pasa a disco (Parquet o pickle) y se
+# vuelve a cargar al usarlo. Las sesiones sin uso por más de sesion_inactiva_segundos se borran
+sesion_max_bytes = int(os.environ.get('GVCONTEO_SESION_MAX_BYTES', 512 * 1024 ** 2))  # 512 MB
+sesiones_max_bytes = int(os.environ.get('GVCONTEO_SESIONES_MAX_BYTES', 2 * 1024 ** 3))  # 2 GB
+sesion_directorio = os.environ.get('GVCONTEO_SESION_DIR', os.path.join(tempfile.gettempdir(), 'gvconteo_sesiones'))
+sesion_inactiva_segundos = int(os.environ.get('GVCONTEO_SESION_INACTIVA_SEGUNDOS', 2 * 3600))
+
+# Motor de consultas del análisis: 'pandas' (por defecto) o 'duckdb' (opcional, pip install duckdb).
+# Con DuckDB los filtros y las sumas por minuto se resuelven como consultas en columnas, en varios
+# hilos y con paso a disco (duckdb_directorio) si no caben en duckdb_memoria (p. ej. '4GB')
+motor_consultas = os.environ.get('GVCONTEO_MOTOR', 'pandas')
+duckdb_hilos = int(os.environ.get('GVCONTEO_DUCKDB_HILOS', os.cpu_count() or 1))
+duckdb_memoria = os.environ.get('GVCONTEO_DUCKDB_MEMORIA')
+duckdb_directorio = os.environ.get('GVCONTEO_DUCKDB_DIR', os.path.join(tempfile.gettempdir(), 'gvconteo_duckdb'))
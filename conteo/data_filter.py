@@ -1,29 +1,312 @@
+import operator
+
+import numpy as np
 import pandas as pd
-from conteo.database_reader import (convertir_fecha, convertir_hora, agregar_vehiculos)
+from conteo import config
+from conteo import profiler
+from conteo.database_reader import aplicar_esquema
 
 def cargar_filtros (df):
     
-    df = convertir_fecha(df, ['FECHA'])
-    df = convertir_hora(df, ['HORA_I'])
-    df = convertir_hora(df, ['HORA_F'])
-    lista_columnas = ['FECHA', 'HORA_RANGO_I', 'HORA_RANGO_F','DIGITADOR' ,'AFORADOR' ,'MOVIMIENTOS' ,
-                'ZONA_TRANSITO' , 'ID_ESTACION','TIPO','MUNICIPIO','CORREGIMIENTO','VEREDA','UBICACION',
-                'INTERSECCION','ID','FOLIO','HORA_I','HORA_F','AUTOS', 'C_PADRON', 'C_ALIMENTADOR', 'C_ARTICULADO',
-                'MICROBUS', 'BUSETA', 'BUS','CAM_2EJ_PQ', 'CAM_2EJ_GD', 'CAM_3EJ', 'CAM_4EJ', 'CAM_5EJ',
-                'CAM_6EJ', 'C_CAMION3A4EJES', 'C_CAMION5Y6EJES', 'MOTOS', 'BICICLETA']
-    
-    df = agregar_vehiculos(df, lista_columnas)
+    # Trabajar sobre el esquema compacto (no hace nada si el DataFrame ya lo tiene)
+    df = aplicar_esquema(df)
 
-    filtros = ['FECHA', 'HORA_I', 'HORA_F', 'DIGITADOR', 'MOVIMIENTOS', 'ID_ESTACION', 'TIPO', 'INTERSECCION']
+    filtros = config.columnas_filtro
 
     # Diccionario para almacenar las opciones únicas de cada filtro
     opciones_unicas = {}
 
     # Por cada filtro, obtener las opciones únicas y almacenarlas en el diccionario
     for f in filtros:
-        opciones = df[f].unique()  # Obtener opciones únicas de la columna
-        opciones_unicas[f] = opciones.tolist()  # Convertir a lista y agregar al diccionario
+        if f not in df.columns:
+            continue
+        serie = df[f]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # Las categorías ya son los valores distintos (en orden de aparición): no hace falta recorrer las filas
+            opciones = serie.cat.categories.tolist()
+            if (serie.cat.codes.to_numpy() < 0).any():
+                opciones.append(np.nan)
+        else:
+            opciones = serie.unique().tolist()  # Obtener opciones únicas de la columna
+        opciones_unicas[f] = opciones  # Agregar al diccionario
 
     return opciones_unicas  # Devolver el diccionario con todas las opciones únicas
 
-   
\ No newline at end of file
+
+def unir_filtros(filtros, nuevos):
+    """Une dos catálogos de cargar_filtros: a las opciones de `filtros` se agregan,
+    en orden, las de `nuevos` que no estaban. El valor faltante (NaN) queda al final."""
+    unidos = {}
+    for columna in list(filtros) + [c for c in nuevos if c not in filtros]:
+        anteriores, agregadas = filtros.get(columna, []), nuevos.get(columna, [])
+        opciones = [o for o in anteriores if not pd.isna(o)]
+        vistas = set(opciones)
+        for opcion in agregadas:
+            if not pd.isna(opcion) and opcion not in vistas:
+                opciones.append(opcion)
+                vistas.add(opcion)
+        unidos[columna] = opciones + [o for o in anteriores + agregadas if pd.isna(o)][:1]
+    return unidos
+
+def actualizar_filtros(filtros, nuevas):
+    """Catálogo de filtros después de agregar las filas `nuevas`, sin recorrer las filas anteriores."""
+    return unir_filtros(filtros, cargar_filtros(nuevas))
+
+def _codigos_y_etiquetas(columna, serie):
+    """Códigos enteros por fila (-1 si falta el valor) y la etiqueta de texto de cada código,
+    igual a como se muestra en la interfaz (FECHA como 'AAAA-MM-DD')."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos, valores = serie.cat.codes.to_numpy(), serie.cat.categories
+    else:
+        codigos, valores = pd.factorize(serie)
+    if columna == 'FECHA':
+        etiquetas = pd.DatetimeIndex(valores).strftime('%Y-%m-%d').tolist()
+    else:
+        etiquetas = [str(valor) for valor in valores]
+    return codigos, np.asarray(etiquetas, dtype=object)
+
+def construir_facetas(df):
+    """Construye el índice de facetas de las columnas de config.columnas_indice.
+
+    Guarda cada combinación distinta de valores (como códigos) con su número de
+    filas, así contar_facetas trabaja sobre las combinaciones y no sobre las filas.
+    También guarda la última máscara calculada por columna, igual que
+    construir_indice_filtros, para que cambiar un filtro no recalcule los demás.
+    """
+    df = aplicar_esquema(df)
+    columnas = [col for col in config.columnas_indice if col in df.columns]
+
+    codigos, etiquetas = {}, {}
+    for columna in columnas:
+        codigos[columna], etiquetas[columna] = _codigos_y_etiquetas(columna, df[columna])
+
+    combinaciones = pd.DataFrame(codigos).value_counts(sort=False, dropna=False)
+    facetas = {
+        'columnas': columnas,
+        'etiquetas': etiquetas,
+        'combinaciones': {col: combinaciones.index.get_level_values(col).to_numpy() for col in columnas},
+        'conteos': combinaciones.to_numpy(),
+        'mascaras': {},
+    }
+    return facetas
+
+
+def actualizar_facetas(facetas, nuevas):
+    """Índice de facetas después de agregar las filas `nuevas` al DataFrame.
+
+    Las etiquetas nuevas se agregan al final (los códigos anteriores no cambian) y
+    las combinaciones de las filas nuevas se suman a las que ya había, así el costo
+    depende de las filas nuevas y no del DataFrame completo.
+    """
+    nuevas = aplicar_esquema(nuevas)
+    columnas = facetas['columnas']
+    if not columnas or nuevas.empty:
+        return facetas
+
+    codigos, etiquetas = {}, {}
+    for columna in columnas:
+        anteriores = facetas['etiquetas'][columna]
+        if columna in nuevas.columns:
+            codigos_nuevos, etiquetas_nuevas = _codigos_y_etiquetas(columna, nuevas[columna])
+        else:
+            codigos_nuevos, etiquetas_nuevas = np.full(len(nuevas), -1), np.asarray([], dtype=object)
+        agregadas = pd.Index(etiquetas_nuevas).difference(pd.Index(anteriores), sort=False)
+        etiquetas[columna] = np.concatenate([anteriores, agregadas.to_numpy(dtype=object)])
+        # Pasar los códigos de las filas nuevas a los del índice (-1 sigue siendo valor faltante)
+        traduccion = np.append(pd.Index(etiquetas[columna]).get_indexer(etiquetas_nuevas), -1)
+        codigos[columna] = traduccion[codigos_nuevos]
+
+    anteriores = pd.Series(facetas['conteos'], index=pd.MultiIndex.from_arrays(
+        [facetas['combinaciones'][col] for col in columnas], names=columnas))
+    nuevas_combinaciones = pd.DataFrame(codigos).value_counts(sort=False, dropna=False)
+    combinaciones = pd.concat([anteriores, nuevas_combinaciones]).groupby(level=columnas, sort=False).sum()
+    return {
+        'columnas': columnas,
+        'etiquetas': etiquetas,
+        'combinaciones': {col: combinaciones.index.get_level_values(col).to_numpy() for col in columnas},
+        'conteos': combinaciones.to_numpy(),
+        'mascaras': {},
+    }
+
+
+def _seleccion_como_etiquetas(columna, seleccion):
+    if columna == 'FECHA':
+        return frozenset(pd.to_datetime(pd.Series(list(seleccion)), errors='coerce').dropna().dt.strftime('%Y-%m-%d'))
+    return frozenset(str(valor) for valor in seleccion)
+
+def contar_facetas(facetas, filtros_seleccionados):
+    """Cuenta las filas de cada opción de cada columna, dada una selección parcial.
+
+    Para cada columna se aplican los filtros de las demás columnas (no el suyo,
+    así se ve qué más se puede elegir en ella). Los filtros vacíos o None no se
+    aplican, igual que en calcular_mascara.
+
+    Devuelve {columna: {etiqueta: filas}} solo con las opciones que tienen filas.
+    """
+    combinaciones = facetas['combinaciones']
+    mascaras = {}
+    for columna in facetas['columnas']:
+        if not filtros_seleccionados.get(columna):
+            continue
+        seleccion = _seleccion_como_etiquetas(columna, filtros_seleccionados[columna])
+        guardada = facetas['mascaras'].get(columna)
+        if guardada is None or guardada[0] != seleccion:
+            elegidos = np.flatnonzero(np.isin(facetas['etiquetas'][columna], list(seleccion)))
+            facetas['mascaras'][columna] = (seleccion, np.isin(combinaciones[columna], elegidos))
+        mascaras[columna] = facetas['mascaras'][columna][1]
+
+    conteos = {}
+    for columna in facetas['columnas']:
+        otras = [mascara for otra, mascara in mascaras.items() if otra != columna]
+        validas = np.logical_and.reduce(otras) if otras else slice(None)
+        etiquetas = facetas['etiquetas'][columna]
+        # El código -1 (valor faltante) va a la primera casilla y se descarta
+        filas = np.bincount(combinaciones[columna][validas] + 1, weights=facetas['conteos'][validas],
+                            minlength=len(etiquetas) + 1)[1:]
+        conteos[columna] = {etiquetas[i]: int(filas[i]) for i in np.flatnonzero(filas)}
+    return conteos
+
+
+def _normalizar_seleccion(columna, seleccion):
+    """Lleva los valores seleccionados al mismo tipo de las claves del índice."""
+    if columna == 'FECHA':
+        return frozenset(pd.to_datetime(pd.Series(list(seleccion)), errors='coerce').dropna())
+    return frozenset(str(valor) for valor in seleccion)
+
+def _tipo_codigos(cantidad):
+    """Entero con signo más chico que guarda los códigos 0..cantidad-1 y el -1 de los faltantes."""
+    for tipo in (np.int8, np.int16, np.int32):
+        if cantidad < np.iinfo(tipo).max:
+            return tipo
+    return np.int64
+
+def _codigos_columna(columna, serie):
+    """Código entero de cada fila (-1 si falta el valor) y la clave del índice de cada código."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Los códigos del Categorical (una vista, sin copiar); serie.cat.codes los copia
+        codigos = serie.array.codes
+        valores = serie.cat.categories
+    else:
+        codigos, valores = pd.factorize(serie)
+
+    claves = [pd.Timestamp(v) for v in valores] if columna == 'FECHA' else [str(v) for v in valores]
+    return codigos.astype(_tipo_codigos(len(claves)), copy=False), claves
+
+def construir_indice_filtros(df):
+    """Construye el índice de filtros para las columnas de config.columnas_indice.
+
+    Para cada columna guarda el código entero de cada fila (int8/int16; en las
+    columnas categóricas son los mismos códigos del DataFrame, sin copiarlos) y la
+    clave de cada código. También guarda la última máscara calculada por columna,
+    para que al cambiar un solo filtro no se recalculen los demás.
+    """
+    df = aplicar_esquema(df)
+    indice = {'filas': len(df), 'codigos': {}, 'claves': {}, 'mascaras': {}}
+
+    for columna in config.columnas_indice:
+        if columna not in df.columns:
+            continue
+        indice['codigos'][columna], indice['claves'][columna] = _codigos_columna(columna, df[columna])
+
+    return indice
+
+
+def actualizar_indice_filtros(indice, nuevas):
+    """Índice de filtros después de agregar las filas `nuevas` al final del DataFrame.
+
+    Los códigos de las filas nuevas se traducen a los del índice (los valores que
+    no estaban reciben un código nuevo) y se agregan al final, sin volver a
+    codificar las filas anteriores. Las máscaras guardadas se descartan.
+    """
+    nuevas = aplicar_esquema(nuevas)
+    actualizado = {'filas': indice['filas'] + len(nuevas), 'codigos': {}, 'claves': {}, 'mascaras': {}}
+
+    for columna, anteriores in indice['codigos'].items():
+        claves = list(indice['claves'][columna])
+        if columna in nuevas.columns:
+            codigos, claves_nuevas = _codigos_columna(columna, nuevas[columna])
+            posiciones = {}
+            for i, clave in enumerate(claves):
+                posiciones.setdefault(clave, i)
+            # El último lugar de la traducción corresponde al -1 (valor faltante)
+            traduccion = np.full(len(claves_nuevas) + 1, -1, dtype=np.int64)
+            for i, clave in enumerate(claves_nuevas):
+                if clave not in posiciones:
+                    posiciones[clave] = len(claves)
+                    claves.append(clave)
+                traduccion[i] = posiciones[clave]
+            codigos = traduccion[codigos]
+        else:
+            codigos = np.full(len(nuevas), -1)
+
+        tipo = _tipo_codigos(len(claves))
+        actualizado['codigos'][columna] = np.concatenate([anteriores.astype(tipo, copy=False), codigos.astype(tipo)])
+        actualizado['claves'][columna] = claves
+
+    return actualizado
+
+def mascara_minutos(minutos, hora, comparar):
+    """Compara una columna de minutos del día (config.columnas_minuto) contra una hora 'HH:MM:SS'.
+
+    La comparación se hace entre enteros; las filas sin hora válida (-1) nunca cumplen.
+    """
+    hora = pd.to_datetime(hora, format='%H:%M:%S')
+    segundos = hora.hour * 3600 + hora.minute * 60 + hora.second
+    minutos = np.asarray(minutos)
+    return comparar(minutos.astype('int32') * 60, segundos) & (minutos >= 0)
+
+def _mascara_con_indice(indice, filtros_seleccionados):
+    """Marca las filas cuyos códigos están entre los elegidos en cada columna y cruza (AND) las columnas."""
+    mascara = None
+    for columna, codigos in indice['codigos'].items():
+        if not filtros_seleccionados.get(columna):
+            continue
+
+        with profiler.etapa(f"filtro {columna}", indice['filas']) as e:
+            seleccion = _normalizar_seleccion(columna, filtros_seleccionados[columna])
+            guardada = indice['mascaras'].get(columna)
+            if guardada is None or guardada[0] != seleccion:
+                # Tabla código -> elegido; el último lugar es el del -1 (valor faltante)
+                claves = indice['claves'][columna]
+                elegidos = np.zeros(len(claves) + 1, dtype=bool)
+                elegidos[[i for i, clave in enumerate(claves) if clave in seleccion]] = True
+                indice['mascaras'][columna] = (seleccion, np.packbits(elegidos[codigos]))
+            else:
+                e.anotar('cache', True)
+
+            union = indice['mascaras'][columna][1]
+            mascara = union if mascara is None else mascara & union
+            if profiler.activo():
+                e.salida_mascara(np.unpackbits(mascara, count=indice['filas']))
+
+    if mascara is None:
+        return np.ones(indice['filas'], dtype=bool)
+    return np.unpackbits(mascara, count=indice['filas']).astype(bool)
+
+def calcular_mascara(df, filtros_seleccionados, indice=None):
+    """Calcula la máscara de filas que cumplen todos los filtros seleccionados.
+
+    Si se entrega el índice de construir_indice_filtros (y corresponde a este
+    DataFrame), los filtros por valor se resuelven con sus códigos. Los
+    filtros vacíos no se aplican.
+    """
+    if indice is not None and indice['filas'] == len(df):
+        mascara = _mascara_con_indice(indice, filtros_seleccionados)
+    else:
+        mascara = np.ones(len(df), dtype=bool)
+        for columna in config.columnas_indice:
+            if filtros_seleccionados.get(columna) and columna in df.columns:
+                with profiler.etapa(f"filtro {columna}", len(df)) as e:
+                    seleccion = list(_normalizar_seleccion(columna, filtros_seleccionados[columna]))
+                    mascara &= df[columna].isin(seleccion).to_numpy()
+                    e.salida_mascara(mascara)
+
+    minutos = config.columnas_minuto
+    for hora, comparar in (('HORA_I', operator.ge), ('HORA_F', operator.le)):
+        if filtros_seleccionados.get(hora):
+            with profiler.etapa(f"filtro {hora}", len(df)) as e:
+                mascara &= mascara_minutos(df[minutos[hora]], filtros_seleccionados[hora], comparar)
+                e.salida_mascara(mascara)
+
+    return mascara
+
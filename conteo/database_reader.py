@@ -1,8 +1,84 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from conteo import config
+
+def leer_datos(db_direccion, fechas=None, estaciones=None):
+    """Carga datos de un archivo de Excel o CSV en un DataFrame.
+
+    Los Excel se leen con leer_xlsx_columnas (solo las columnas usadas, y si se
+    entregan `fechas` o `estaciones`, solo las filas que las cumplen). Los CSV
+    más grandes que config.csv_umbral_agregado_bytes se leen con
+    leer_csv_agregado para no tener todas las filas en memoria.
+    """
+    if str(db_direccion).lower().endswith('.csv'):
+        if os.path.getsize(db_direccion) > config.csv_umbral_agregado_bytes:
+            return leer_csv_agregado(db_direccion)
+        return pd.read_csv(db_direccion)
+    return leer_xlsx_columnas(db_direccion, fechas=fechas, estaciones=estaciones)
+
+def _predicado_fecha(fechas):
+    """Devuelve una función valor -> bool para el rango (inicio, fin) de fechas, inclusive."""
+    inicio, fin = (pd.Timestamp(f).normalize() if f is not None else None for f in fechas)
+    resultados = {}  # Las fechas se repiten mucho: convertir cada valor distinto una sola vez
+
+    def cumple(valor):
+        if valor not in resultados:
+            fecha = pd.to_datetime(valor, errors='coerce')
+            if pd.isna(fecha):
+                resultados[valor] = False
+            else:
+                fecha = fecha.normalize()
+                resultados[valor] = (inicio is None or fecha >= inicio) and (fin is None or fecha <= fin)
+        return resultados[valor]
+
+    return cumple
+
+def leer_xlsx_columnas(origen, columnas=None, fechas=None, estaciones=None):
+    """Lee la primera hoja de un .xlsx fila por fila con openpyxl en modo de solo lectura.
+
+    Solo conserva las columnas del encabezado que están en `columnas` (por defecto
+    config.lista_columnas). Los filtros simples se aplican dentro del ciclo de filas,
+    antes de guardar nada:
+    - fechas: tupla (inicio, fin) de FECHA, inclusive; cualquiera de los dos puede ser None
+    - estaciones: valores de ID_ESTACION a conservar (se comparan como texto)
+    """
+    from openpyxl import load_workbook
 
-def leer_datos(db_direccion):
-    """Carga datos de un archivo de Excel en un DataFrame."""
-    return pd.read_excel(db_direccion)
+    if columnas is None:
+        columnas = config.lista_columnas
+    columnas = set(columnas)
+
+    libro = load_workbook(origen, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezado = list(next(filas, None) or [])
+        posiciones = [(i, nombre) for i, nombre in enumerate(encabezado) if nombre in columnas]
+        datos = {nombre: [] for _, nombre in posiciones}
+
+        # Predicados que se evalúan sobre la fila cruda
+        predicados = []
+        if fechas is not None and 'FECHA' in encabezado:
+            predicados.append((encabezado.index('FECHA'), _predicado_fecha(fechas)))
+        if estaciones is not None and 'ID_ESTACION' in encabezado:
+            estaciones = {str(e) for e in estaciones}
+            predicados.append((encabezado.index('ID_ESTACION'), lambda valor: str(valor) in estaciones))
+
+        for fila in filas:
+            if all(valor is None for valor in fila):
+                continue  # Filas vacías (por ejemplo, al final de la hoja)
+            if not all(i < len(fila) and cumple(fila[i]) for i, cumple in predicados):
+                continue
+            for i, nombre in posiciones:
+                datos[nombre].append(fila[i] if i < len(fila) else None)
+    finally:
+        libro.close()
+
+    return pd.DataFrame(datos)
 
 def ajustar_direccion(ruta):
     """Ajusta una ruta de archivo cambiando las comillas dobles por comillas simples
@@ -31,5 +107,343 @@ def agregar_vehiculos(df,lista_columnas):
     
     return df[columnas_coincidentes]
 
+def leer_csv_agregado(origen, tamano_bloque=None):
+    """Lee un CSV grande por bloques y lo reduce mientras lo lee.
+
+    Solo conserva las columnas de config.lista_columnas y suma los vehículos de
+    todas las filas que comparten la misma combinación de filtros (fecha, intervalo
+    de 15 minutos, digitador, movimiento, estación, tipo e intersección). El
+    resultado sirve como entrada para cargar_filtros y crear_tabla_rango_15min, y
+    la memoria usada depende del número de combinaciones, no del tamaño del archivo.
+
+    Si el archivo no trae ninguna columna de filtro (o ningún conteo de vehículos)
+    no hay nada que agrupar y se lee completo, como un CSV pequeño.
+    """
+    if tamano_bloque is None:
+        tamano_bloque = config.csv_tamano_bloque
+
+    encabezado = pd.read_csv(origen, nrows=0).columns
+    if hasattr(origen, 'seek'):
+        origen.seek(0)
+    claves = [c for c in config.columnas_filtro if c in encabezado]
+    vehiculos = [c for c in config.columnas_vehiculos if c in encabezado]
+    if not claves or not vehiculos:
+        return pd.read_csv(origen, usecols=lambda c: c in config.lista_columnas)
+
+    acumulado = None
+    bloques = pd.read_csv(origen, usecols=lambda c: c in config.lista_columnas,
+                          dtype={c: str for c in config.columnas_filtro}, chunksize=tamano_bloque)
+    for bloque in bloques:
+        # Sumar el bloque y plegarlo sobre lo acumulado hasta ahora
+        parcial = bloque.groupby(claves, dropna=False, sort=False)[vehiculos].sum()
+        if acumulado is not None:
+            parcial = pd.concat([acumulado, parcial]).groupby(level=claves, dropna=False, sort=False).sum()
+        acumulado = parcial
+
+    if acumulado is None:
+        return pd.DataFrame(columns=config.columnas_filtro + config.columnas_vehiculos)
+
+    return acumulado.reset_index()
+
+def _a_categoria(serie, convertir):
+    """Convierte una serie a categoría aplicando `convertir` solo a sus valores distintos."""
+    codigos, valores = pd.factorize(serie, use_na_sentinel=False)
+    textos = pd.Index(convertir(valores), dtype=object)
+    categorias = textos.dropna().unique()
+    codigos = categorias.get_indexer(textos)[codigos]  # -1 para los valores faltantes
+    return pd.Series(pd.Categorical.from_codes(codigos, categorias), index=serie.index, name=serie.name)
+
+def _como_texto(valores):
+    return [str(valor) for valor in valores]
+
+def _como_hora(valores):
+    horas = pd.to_datetime(pd.Index(valores).astype(str), format='%H:%M:%S', errors='coerce')
+    return horas.strftime('%H:%M:%S')
+
+def minutos_del_dia(serie):
+    """Minutos desde la medianoche (int16) de una columna de horas 'HH:MM:SS'; -1 si no es válida."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos, valores = serie.cat.codes.to_numpy(), serie.cat.categories
+    else:
+        codigos, valores = pd.factorize(serie)
+
+    # Convertir solo los valores distintos y repartirlos a las filas con sus códigos
+    horas = pd.to_datetime(pd.Index(valores).astype(str), format='%H:%M:%S', errors='coerce')
+    minutos = (horas.hour * 60 + horas.minute).to_series().fillna(-1).to_numpy(dtype='int16')
+    return np.append(minutos, np.int16(-1))[codigos]
+
+def _convertir_columna(columna, serie):
+    """Devuelve la columna con el tipo compacto, o None si ya lo tiene."""
+    if columna == 'FECHA':
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            return None
+        return pd.to_datetime(serie, errors='coerce').dt.normalize()
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return None
+    if columna in ('HORA_I', 'HORA_F'):
+        return _a_categoria(serie, _como_hora)
+    if columna in config.columnas_etiqueta_filtro:
+        return _a_categoria(serie, _como_texto)
+    if columna in config.columnas_etiqueta:
+        return _a_categoria(serie, lambda valores: valores)
+    if columna in config.columnas_vehiculos and serie.dtype.kind != 'u':
+        # Solo se reduce si todos los valores son enteros no negativos
+        return pd.to_numeric(pd.to_numeric(serie, errors='coerce'), downcast='unsigned')
+    return None
+
+def aplicar_esquema(df):
+    """Convierte el DataFrame cargado a un esquema compacto.
+
+    - FECHA como fecha nativa (datetime64, sin hora)
+    - HORA_I y HORA_F como categorías de texto 'HH:MM:SS', más sus minutos del día
+      en las columnas int16 de config.columnas_minuto (MINUTO_I y MINUTO_F)
+    - Columnas de etiqueta como categorías (las de filtro, con su valor como texto)
+    - Conteos de vehículos como el entero sin signo más pequeño que los contenga
+
+    Solo conserva las columnas de config.lista_columnas. No modifica el DataFrame
+    recibido y, si ya tiene el esquema, lo devuelve sin copiarlo.
+    """
+    minutos = config.columnas_minuto
+    conservadas = [col for col in df.columns if col in config.lista_columnas or col in minutos.values()]
+    convertidas = {}
+    for columna in conservadas:
+        serie = _convertir_columna(columna, df[columna])
+        if serie is not None:
+            convertidas[columna] = serie
+
+    # Las horas se interpretan una sola vez aquí; después se filtra y agrupa sobre los enteros
+    for hora, minuto in minutos.items():
+        if hora not in conservadas:
+            continue
+        if hora in convertidas or minuto not in df.columns or df[minuto].dtype != np.int16:
+            convertidas[minuto] = minutos_del_dia(convertidas.get(hora, df[hora]))
+
+    if not convertidas and len(conservadas) == len(df.columns):
+        return df
+
+    return df[conservadas].assign(**convertidas)
+
+def quitar_columnas_minuto(df):
+    """Devuelve el DataFrame sin las columnas auxiliares de config.columnas_minuto.
+
+    Los minutos del día solo sirven para filtrar y agrupar: no se muestran ni se exportan.
+    """
+    auxiliares = [col for col in config.columnas_minuto.values() if col in df.columns]
+    return df.drop(columns=auxiliares) if auxiliares else df
+
+def leer_contenido(nombre, contenido):
+    """Lee los bytes de un archivo .xlsx o .csv y le aplica el esquema compacto.
+
+    Es una función de módulo para que se pueda ejecutar en otro proceso (leer_archivos).
+    """
+    if nombre.lower().endswith('.xlsx'):
+        df = leer_xlsx_columnas(io.BytesIO(contenido))
+    elif nombre.lower().endswith('.csv'):
+        if len(contenido) > config.csv_umbral_agregado_bytes:
+            df = leer_csv_agregado(io.BytesIO(contenido))
+        else:
+            df = pd.read_csv(io.BytesIO(contenido))
+    else:
+        raise ValueError(f"Formato de archivo no soportado: {nombre}")
+    return aplicar_esquema(df)
+
+def leer_archivos(archivos, procesos=None):
+    """Lee varios archivos a la vez y devuelve sus DataFrames en el mismo orden.
+
+    `archivos` es una lista de tuplas (nombre, contenido en bytes). Los .xlsx se
+    interpretan en un grupo de procesos (openpyxl usa la CPU y no libera el GIL) con
+    hasta `procesos` trabajadores (config.carga_procesos por defecto); los .csv, que
+    pandas lee en C, en hilos del proceso actual.
+    """
+    if procesos is None:
+        procesos = config.carga_procesos
+
+    excel = [i for i, (nombre, _) in enumerate(archivos) if nombre.lower().endswith('.xlsx')]
+    resto = [i for i, (nombre, _) in enumerate(archivos) if not nombre.lower().endswith('.xlsx')]
+    partes = [None] * len(archivos)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(resto), procesos))) as hilos:
+        futuros = {i: hilos.submit(leer_contenido, *archivos[i]) for i in resto}
+        if len(excel) > 1 and procesos > 1:
+            with ProcessPoolExecutor(max_workers=min(len(excel), procesos)) as grupo:
+                for i, df in zip(excel, grupo.map(leer_contenido, *zip(*(archivos[i] for i in excel)))):
+                    partes[i] = df
+        else:
+            for i in excel:
+                partes[i] = leer_contenido(*archivos[i])
+        for i, futuro in futuros.items():
+            partes[i] = futuro.result()
+
+    return partes
+
+def _columna_vacia(columna, referencia, filas):
+    """Columna sin datos para un archivo que no la trae, con el mismo tipo que en los demás."""
+    if isinstance(referencia.dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(np.full(filas, -1), referencia.cat.categories[:0])
+    if columna == 'FECHA':
+        return pd.Series(pd.NaT, index=range(filas), dtype=referencia.dtype)
+    if columna in config.columnas_minuto.values():
+        return np.full(filas, -1, dtype=np.int16)
+    if columna in config.columnas_vehiculos:
+        return np.zeros(filas, dtype=referencia.dtype if referencia.dtype.kind in 'iu' else np.float64)
+    return pd.Series(None, index=range(filas), dtype=object)
+
+def _unir_columna(columna, series):
+    """Une la misma columna de varios archivos; las categorías quedan como la unión de todas."""
+    if all(isinstance(s.dtype, pd.CategoricalDtype) for s in series):
+        try:
+            return pd.Series(union_categoricals(series, ignore_order=True), name=columna)
+        except TypeError:
+            # Categorías de distinto tipo (por ejemplo, números en un archivo y texto en otro)
+            unida = pd.concat([s.astype(object) for s in series], ignore_index=True)
+            convertir = _como_texto if columna in config.columnas_etiqueta_filtro else (lambda valores: valores)
+            return _a_categoria(unida, _como_hora if columna in ('HORA_I', 'HORA_F') else convertir)
+    return pd.concat(series, ignore_index=True).rename(columna)
+
+def combinar_datos(partes):
+    """Une los DataFrames de varios archivos (ya con aplicar_esquema) en uno solo.
+
+    Las columnas se alinean al orden de config.lista_columnas (más las de minuto del
+    día). Si un archivo no trae una columna que sí traen otros, se completa vacía con
+    el mismo tipo: categoría sin valor, NaT en FECHA, -1 en los minutos y 0 en los conteos.
+    """
+    partes = [df for df in partes if df is not None]
+    if len(partes) == 1:
+        return partes[0]
+
+    orden = config.lista_columnas + list(config.columnas_minuto.values())
+    presentes = set().union(*(df.columns for df in partes))
+    columnas = [col for col in orden if col in presentes]
+
+    combinado = {}
+    for columna in columnas:
+        referencia = next(df[columna] for df in partes if columna in df.columns)
+        series = [df[columna].reset_index(drop=True) if columna in df.columns
+                  else pd.Series(_columna_vacia(columna, referencia, len(df))) for df in partes]
+        combinado[columna] = _unir_columna(columna, series)
+
+    return aplicar_esquema(pd.DataFrame(combinado))
+
+def _valores_clave(serie):
+    """Lleva una columna clave a un tipo único, para que el mismo valor tenga el mismo hash.
+
+    Un archivo trae los ID como enteros (o decimales, si hay vacíos) y el almacén los
+    devuelve como texto; las fechas pueden venir en distintas unidades. Los números
+    enteros quedan como int64, los textos que son todos números se leen como números
+    y las fechas quedan en segundos. El valor que toman los faltantes no importa: las
+    filas sin ID o sin FOLIO nunca se comparan.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.as_unit('s')
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Convertir solo las categorías y repartirlas con los códigos (-1 sigue siendo faltante)
+        codigos, unicos = pd.factorize(_valores_clave(pd.Series(serie.cat.categories)))
+        codigos = np.append(codigos, -1)[serie.cat.codes.to_numpy()]
+        return pd.Series(pd.Categorical.from_codes(codigos, unicos), index=serie.index)
+    if serie.dtype.kind not in 'iuf':
+        numeros = pd.to_numeric(serie, errors='coerce')
+        if numeros.count() < serie.count():
+            return serie.astype(str)
+        serie = numeros
+    if serie.dtype.kind in 'iu':
+        return serie.astype(np.int64)
+    if serie.dtype.kind == 'f' and (serie.dropna() % 1 == 0).all():
+        return serie.fillna(-1).astype(np.int64)
+    return serie
+
+def _hashes_claves(df, claves):
+    """Hash de 64 bits por fila de las columnas `claves` (iguales valores, igual hash).
+
+    Los valores se comparan por lo que son y no por su tipo (ver _valores_clave): el
+    mismo registro tiene el mismo hash si viene de un archivo o del almacén.
+    """
+    return pd.util.hash_pandas_object(
+        pd.DataFrame({columna: _valores_clave(df[columna]) for columna in claves}), index=False)
+
+def _con_id_y_folio(df):
+    return df['ID'].notna() & df['FOLIO'].notna()
+
+def _sin_filas(df, repetidas):
+    """Quita las filas marcadas y las categorías que quedan sin uso."""
+    df = df[~repetidas].reset_index(drop=True)
+    categoricas = {col: df[col].cat.remove_unused_categories()
+                   for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    return df.assign(**categoricas)
+
+def quitar_duplicados(df, claves=('ID', 'FOLIO', 'FECHA', 'HORA_I')):
+    """Quita los registros repetidos entre archivos que se solapan.
+
+    Dos filas son el mismo registro si coinciden en todas las `claves`; se conserva
+    la primera. La comparación usa un índice de hashes de 64 bits de las claves, sin
+    armar tuplas fila por fila. Las filas sin ID o sin FOLIO nunca se consideran
+    repetidas (por ejemplo, las de un CSV agregado). Devuelve (df, filas quitadas).
+    """
+    claves = [c for c in claves if c in df.columns]
+    if not {'ID', 'FOLIO'} <= set(claves) or df.empty:
+        return df, 0
+
+    hashes = _hashes_claves(df, claves)
+    repetidas = (hashes.duplicated(keep='first') & _con_id_y_folio(df)).to_numpy()
+
+    quitadas = int(repetidas.sum())
+    if quitadas == 0:
+        return df, 0
+    return _sin_filas(df, repetidas), quitadas
+
+def _bloque_registros(df, claves):
+    """Hashes ordenados de las filas con ID y FOLIO (las únicas que pueden repetirse)."""
+    if not {'ID', 'FOLIO'} <= set(claves) or df.empty:
+        return np.empty(0, dtype=np.uint64)
+    hashes = _hashes_claves(df, claves).to_numpy()
+    return np.sort(hashes[_con_id_y_folio(df).to_numpy()])
+
+def indice_registros(df, claves=('ID', 'FOLIO', 'FECHA', 'HORA_I')):
+    """Índice de los registros de un conjunto cargado, para anexar_datos.
+
+    Es una lista de bloques de hashes ordenados de las `claves`: el del conjunto y
+    uno por cada grupo de filas agregado después, así agregar filas no obliga a
+    volver a calcular los hashes del conjunto.
+    """
+    return [_bloque_registros(df, [c for c in claves if c in df.columns])]
+
+def _en_indice(registros, hashes):
+    """Marca los hashes que ya están en alguno de los bloques del índice (búsqueda binaria)."""
+    encontrados = np.zeros(len(hashes), dtype=bool)
+    for bloque in registros:
+        if len(bloque):
+            posiciones = np.minimum(np.searchsorted(bloque, hashes), len(bloque) - 1)
+            encontrados |= bloque[posiciones] == hashes
+    return encontrados
+
+def anexar_datos(df, nuevas, claves=('ID', 'FOLIO', 'FECHA', 'HORA_I'), registros=None):
+    """Agrega filas nuevas (por ejemplo, un día más de conteos) a un conjunto ya cargado.
+
+    Solo se revisan las filas nuevas: las que repiten un registro del conjunto (o
+    de las mismas filas nuevas) por `claves` se descartan, igual que en
+    quitar_duplicados. Las filas del conjunto no se tocan. `registros` es el
+    índice de indice_registros del conjunto (o de la llamada anterior); con él
+    las filas nuevas se buscan sin volver a calcular los hashes del conjunto.
+
+    Devuelve (df combinado, filas nuevas que se agregaron, filas repetidas que se
+    quitaron, índice de registros del conjunto combinado). Las filas agregadas
+    sirven para actualizar los filtros, los índices y el análisis sin volver a
+    recorrer todo el conjunto.
+    """
+    nuevas = aplicar_esquema(nuevas)
+    claves = [c for c in claves if c in df.columns and c in nuevas.columns]
+    if registros is None:
+        registros = indice_registros(df, claves)
 
+    quitadas = 0
+    if {'ID', 'FOLIO'} <= set(claves) and not nuevas.empty:
+        hashes = _hashes_claves(nuevas, claves)
+        repetidas = _en_indice(registros, hashes.to_numpy()) | hashes.duplicated(keep='first').to_numpy()
+        repetidas &= _con_id_y_folio(nuevas).to_numpy()
+        quitadas = int(repetidas.sum())
+        if quitadas:
+            nuevas = _sin_filas(nuevas, repetidas)
 
+    if nuevas.empty:
+        return df, nuevas, quitadas, registros
+    registros = registros + [_bloque_registros(nuevas, claves)]
+    return combinar_datos([df, nuevas]), nuevas, quitadas, registros
@@ -1,73 +1,186 @@
+from datetime import time
+
+import numpy as np
 import pandas as pd
 from conteo import config
-
-def crear_tabla_rango_15min(df_filtrado_fechas):
-    #  4.13 Seleccionar solo las columnas deseadas y cambiarles el nombre
-    df_suma = df_filtrado_fechas[['HORA_I']].rename(columns={'HORA_I': 'rango_15_min'})
-
-    #  5) Dataframe de SUMA
-    #  5.1) Sumar las cantidades de cada tipo de vehículo
-    df_suma['AUTOS'] = df_filtrado_fechas['AUTOS']
-    df_suma['MOTOS'] = df_filtrado_fechas['MOTOS']
-    df_suma['MIO'] = df_filtrado_fechas.get('C_PADRON',  0) + df_filtrado_fechas.get('C_ALIMENTADOR',  0) + df_filtrado_fechas.get('C_ARTICULADO',  0)
-    df_suma['TPC'] = df_filtrado_fechas.get('MICROBUS',  0) + df_filtrado_fechas.get('BUSETA',  0) + df_filtrado_fechas.get('BUS',  0)
-    df_suma['CAMIONES'] = df_filtrado_fechas.get('CAM_2EJ_PQ',  0)+ df_filtrado_fechas.get('CAM_2EJ_GD',  0) + df_filtrado_fechas.get('CAM_3EJ',  0) + df_filtrado_fechas.get('CAM_4EJ',  0) + df_filtrado_fechas.get('CAM_5EJ',0) + df_filtrado_fechas.get('CAM_6EJ',  0) + df_filtrado_fechas.get('C_CAMION3A4EJES',  0) + df_filtrado_fechas.get('C_CAMION5Y6EJES',  0)
-    df_suma['MIXTOS'] = df_suma['AUTOS'] + df_suma['MIO']  + df_suma['TPC'] + df_suma['CAMIONES'] + df_suma['MOTOS']
-    df_suma['BICICLETAS'] = df_filtrado_fechas['BICICLETA']
-
-    #  5.2) Convertir la columna 'rango_15_min' a tipo datetime
-    df_suma['rango_15_min'] = pd.to_datetime(df_suma['rango_15_min'], format='%H:%M:%S', errors='coerce')
-
-    #  5.3) Agrupar por hora y sumar las cantidades
-    df_suma_por_hora = df_suma.groupby(df_suma['rango_15_min'].dt.time).agg({
-        'AUTOS': 'sum',
-        'MOTOS': 'sum',
-        'MIO' : 'sum',
-        'TPC': 'sum',
-        'CAMIONES': 'sum',
-        'MIXTOS': 'sum',
-        'BICICLETAS': 'sum'
-    }).reset_index()
-
-    return df_suma_por_hora
+from conteo.database_reader import minutos_del_dia
+
+# Columnas de la tabla de sumas, en el orden en que se presentan
+columnas_suma = list(config.grupos_vehiculos)
+
+def matriz_clases(columnas, pesos=None):
+    """Matriz (columnas de conteo x columnas_suma) que lleva los conteos a la tabla de sumas.
+
+    Cada celda es el peso con que la columna de conteo entra en la categoría: 1, o el
+    factor de `pesos` (por ejemplo config.factores_equivalencia) si se entrega.
+    """
+    matriz = np.zeros((len(columnas), len(columnas_suma)))
+    for i, columna in enumerate(columnas):
+        clase = config.clases_vehiculos.get(columna)
+        peso = 1 if pesos is None else pesos.get(columna, 1)
+        for j, grupo in enumerate(columnas_suma):
+            if clase in config.grupos_vehiculos[grupo]:
+                matriz[i, j] = peso
+    return matriz
+
+def _conteos(df):
+    """Columnas de conteo del registro de clases que trae el DataFrame."""
+    return df[[col for col in config.columnas_vehiculos if col in df.columns]]
+
+def _sumar_categorias(conteos, pesos=None):
+    """Agrupa un bloque de conteos (columnas originales) en las categorías de la tabla de sumas
+    con un solo producto de matrices. Conserva el índice del bloque."""
+    sumas = conteos.to_numpy(dtype='float64') @ matriz_clases(conteos.columns, pesos)
+    if pesos is None and all(dtype.kind in 'iub' for dtype in conteos.dtypes):
+        sumas = sumas.astype('int64')
+    return pd.DataFrame(sumas, index=conteos.index, columns=columnas_suma)
+
+def _minutos_inicio(df):
+    """Minutos del día de HORA_I: la columna entera del esquema si existe, si no se calculan."""
+    columna = config.columnas_minuto['HORA_I']
+    if columna in df.columns:
+        return df[columna].to_numpy()
+    return minutos_del_dia(df['HORA_I'])
+
+def _etiquetas_hora(minutos):
+    """Etiquetas de hora (solo para mostrar) a partir de minutos del día."""
+    return [time(m // 60, m % 60) for m in minutos]
+
+def crear_tabla_rango_15min(df_filtrado_fechas, pesos=None):
+    #  5.2) Ubicar cada fila por el minuto del día de su hora de inicio (las que no tienen hora válida se descartan)
+    minutos = _minutos_inicio(df_filtrado_fechas)
+    validas = minutos >= 0
+
+    #  5.3) Agrupar los conteos por minuto (entero) y sumarlos (sin copiar filas si todas tienen hora)
+    conteos = _conteos(df_filtrado_fechas)
+    if not validas.all():
+        conteos, minutos = conteos[validas], minutos[validas]
+    conteos = conteos.groupby(minutos).sum()
+
+    return tabla_rango_15min_desde_conteos(conteos, pesos)
+
+def tabla_rango_15min_desde_conteos(conteos, pesos=None):
+    """Tabla de crear_tabla_rango_15min a partir de los conteos ya sumados por minuto del día
+    (índice entero, columnas de conteo originales), por ejemplo los que calcula un motor SQL."""
+    #  4.13 Sumar las categorías de vehículos sobre las filas ya agrupadas (opcionalmente ponderadas por `pesos`)
+    df_suma_por_hora = _sumar_categorias(conteos, pesos)
+    df_suma_por_hora.insert(0, 'rango_15_min', _etiquetas_hora(df_suma_por_hora.index))
+
+    return df_suma_por_hora.reset_index(drop=True)
 
 def crear_tabla_rango_hora(df):
-    # Crear un DataFrame vacío para almacenar los resultados
-    df_nuevo = pd.DataFrame(columns=df.columns[1:])  # Excluir la primera columna
+    """Suma la tabla de 15 minutos por hora de reloj.
 
-    # Iterar sobre las filas de df
-    for i in range(0, len(df), 4):  # Avanzar de 4 en 4
-        # Seleccionar las filas disponibles a partir de la fila actual
-        filas_disponibles = df.iloc[i:i + 4]  # Seleccionar 4 filas
+    Devuelve una tupla (df_rango_hora, hora_pico) con la tabla por hora y el
+    texto de la hora pico. No modifica ningún estado global, por lo que se puede
+    usar desde varios hilos o procesos a la vez.
+    """
+    columnas = df.columns[1:]  # Excluir la primera columna (rango_15_min)
 
-        # Sumar las columnas seleccionadas
-        suma_filas = filas_disponibles.iloc[:, 1:].sum()
+    # Ubicar cada intervalo en su casilla de 15 minutos del día (0 a 95)
+    minutos = minutos_del_dia(df.iloc[:, 0].astype(str))
+    validas = minutos >= 0
+    casillas = minutos[validas].astype('int64') // 15
+    valores = df[columnas].to_numpy()[validas]
 
-        # Crear un nuevo DataFrame con la suma en la primera fila
-        df_suma = pd.DataFrame(columns=suma_filas.index)
-        df_suma.loc[filas_disponibles.iloc[0, 0]] = suma_filas
+    # Llenar la grilla completa de 96 casillas, así un intervalo faltante no corre las horas siguientes
+    grilla = np.zeros((96, len(columnas)), dtype=valores.dtype)
+    np.add.at(grilla, casillas, valores)
+    presentes = np.bincount(casillas, minlength=96).reshape(24, 4).sum(axis=1) > 0
 
-        # Agregar el resultado al DataFrame final
-        df_nuevo = pd.concat([df_nuevo, df_suma])
+    # Sumar las 4 casillas de cada hora de reloj y conservar solo las horas con datos
+    sumas = grilla.reshape(24, 4, len(columnas)).sum(axis=1)[presentes]
+    df_nuevo = pd.DataFrame(sumas, columns=columnas)
+    df_nuevo.insert(0, 'rango_15_min', _etiquetas_hora(np.flatnonzero(presentes) * 60))
 
-    # Restablecer el índice y renombrar la columna del índice
-    df_nuevo = df_nuevo.reset_index()
-    df_nuevo = df_nuevo.rename(columns={'index': 'rango_15_min'})
+    return df_nuevo, describir_hora_pico(df_nuevo)
 
-    # Si df_nuevo está vacío, no intentes encontrar el índice máximo
-    if not df_nuevo.empty:
-        # Encontrar el índice del valor máximo en la columna "MIXTOS"
-        indice_max = df_nuevo["MIXTOS"].idxmax()
-        fila_max = df_nuevo.iloc[indice_max]  # Acceder al valor de la primera columna en el índice máximo
 
-        # Obtener el valor máximo de la columna "MIXTOS"
-        valor_max = df_nuevo["MIXTOS"].max()
+def sumar_tablas(tabla, nueva):
+    """Suma dos tablas de crear_tabla_rango_15min (o dos de crear_tabla_rango_hora) intervalo
+    por intervalo, por ejemplo la de los datos ya cargados y la de unas filas nuevas.
 
-        hora_pico = fila_max["rango_15_min"]
-        
-        config.hora_pico_global = 'La hora pico es ' + str(hora_pico) + ' con ' + str(valor_max) + ' vehículos'
+    El resultado es el mismo que se obtendría al crear la tabla con todas las filas juntas.
+    """
+    if nueva.empty:
+        return tabla
+    if tabla.empty:
+        return nueva
+    columna = tabla.columns[0]  # rango_15_min
+    return pd.concat([tabla, nueva], ignore_index=True).groupby(columna, sort=True).sum().reset_index()
 
-    return df_nuevo
+
+def describir_hora_pico(df_rango_hora):
+    """Devuelve el texto de la hora pico (la hora con más vehículos MIXTOS).
+
+    Si la tabla está vacía devuelve un texto vacío.
+    """
+    # Si la tabla está vacía, no intentes encontrar el índice máximo
+    if df_rango_hora.empty:
+        return ''
+
+    # Encontrar el índice del valor máximo en la columna "MIXTOS"
+    indice_max = df_rango_hora["MIXTOS"].idxmax()
+    fila_max = df_rango_hora.loc[indice_max]  # Acceder a la fila con el valor máximo
+
+    # Obtener el valor máximo de la columna "MIXTOS"
+    valor_max = df_rango_hora["MIXTOS"].max()
+
+    hora_pico = fila_max["rango_15_min"]
+
+    return _texto_hora_pico(hora_pico, valor_max)
+
+def _texto_hora_pico(hora_pico, valor_max):
+    return 'La hora pico es ' + str(hora_pico) + ' con ' + str(valor_max) + ' vehículos'
+
+
+def crear_tablas_por_grupo(df, dimensiones=('ID_ESTACION', 'MOVIMIENTOS', 'FECHA'), pesos=None):
+    """Crea las tablas de 15 minutos y por hora de todos los grupos en una sola pasada.
+
+    Equivale a llamar crear_tabla_rango_15min y crear_tabla_rango_hora una vez por
+    cada combinación de `dimensiones`, pero recorre el DataFrame una sola vez.
+
+    Con `pesos` (por ejemplo config.factores_equivalencia) las sumas se ponderan
+    como vehículos equivalentes.
+
+    Devuelve una tupla (df_15min, df_hora, df_horas_pico) en formato largo: cada
+    tabla tiene las columnas de `dimensiones`, 'rango_15_min' y las sumas; la de
+    horas pico tiene una fila por grupo con su hora pico, el valor de MIXTOS y el
+    texto de describir_hora_pico en 'hora_pico'.
+    """
+    dimensiones = list(dimensiones)
+
+    # Minuto del día de cada intervalo; los que no tienen hora válida se descartan
+    minutos = _minutos_inicio(df).astype('int64')
+    validas = minutos >= 0
+    conteos = _conteos(df)[validas]
+    claves = [df.loc[validas, d] for d in dimensiones]
+    minutos = pd.Series(minutos[validas], index=conteos.index, name='rango_15_min')
+
+    # Sumas de los conteos por intervalo de 15 minutos y por hora de reloj de cada grupo;
+    # las categorías se calculan después, sobre las filas ya agrupadas
+    por_intervalo = conteos.groupby(claves + [minutos], observed=True, dropna=False).sum()
+    por_hora = conteos.groupby(claves + [minutos // 60 * 60], observed=True, dropna=False).sum()
+    df_15min = _sumar_categorias(por_intervalo, pesos).reset_index()
+    df_hora = _sumar_categorias(por_hora, pesos).reset_index()
+
+    # Hora pico de cada grupo: la hora con más vehículos MIXTOS
+    if df_hora.empty:
+        df_horas_pico = df_hora[dimensiones + ['rango_15_min', 'MIXTOS']].assign(hora_pico='')
+    else:
+        indices_pico = df_hora.groupby(dimensiones, observed=True, dropna=False, sort=False)['MIXTOS'].idxmax()
+        df_horas_pico = df_hora.loc[indices_pico.to_numpy(), dimensiones + ['rango_15_min', 'MIXTOS']]
+
+    # Etiquetas de hora (solo para mostrar) a partir de los minutos
+    for tabla in (df_15min, df_hora, df_horas_pico):
+        tabla['rango_15_min'] = _etiquetas_hora(tabla['rango_15_min'])
+
+    df_horas_pico = df_horas_pico.reset_index(drop=True)
+    df_horas_pico['hora_pico'] = [
+        _texto_hora_pico(hora, valor) for hora, valor in zip(df_horas_pico['rango_15_min'], df_horas_pico['MIXTOS'])
+    ]
+
+    return df_15min, df_hora, df_horas_pico
 
 
 """
@@ -0,0 +1,163 @@
+"""Motor de consultas opcional con DuckDB para los filtros y las tablas del análisis.
+
+Los filtros y las sumas por minuto del día se ejecutan como una sola consulta en
+columnas, en varios hilos, sobre un DataFrame (que DuckDB lee en su lugar, sin
+copiarlo) o sobre archivos Parquet (por ejemplo, los de la caché de archivos
+cargados) sin cargarlos completos en memoria. A pandas solo vuelven las sumas
+agrupadas (a lo sumo una fila por minuto del día) con el número de filas y, si se
+piden, las filas filtradas (filtrar, con un límite opcional). DuckDB es opcional:
+si no está instalado, disponible() es False y el análisis usa pandas.
+"""
+import os
+
+import pandas as pd
+from conteo import config
+from conteo import database_reader
+from conteo import df_generator
+
+try:
+    import duckdb
+except ImportError:  # Dependencia opcional
+    duckdb = None
+
+
+def disponible():
+    """True si DuckDB está instalado."""
+    return duckdb is not None
+
+def _conexion():
+    if duckdb is None:
+        raise ImportError("El motor 'duckdb' necesita el paquete duckdb (pip install duckdb)")
+    con = duckdb.connect()
+    con.execute(f"SET threads TO {int(config.duckdb_hilos)}")
+    os.makedirs(config.duckdb_directorio, exist_ok=True)
+    con.execute("SET temp_directory = ?", [config.duckdb_directorio])
+    if config.duckdb_memoria:
+        con.execute("SET memory_limit = ?", [config.duckdb_memoria])
+    return con
+
+def _para_duckdb(df):
+    """DataFrame con el esquema compacto que DuckDB puede leer en su lugar.
+
+    DuckDB lee las columnas de pandas sin copiarlas, pero no las categóricas cuyas
+    categorías son objetos que no son texto (por ejemplo HORA_RANGO_I con enteros,
+    como la deja un CSV). A esas solo se les cambian las categorías por su texto,
+    con los mismos códigos; si dos categorías quedan con el mismo texto, la columna
+    se pasa entera a texto.
+    """
+    df = database_reader.aplicar_esquema(df)
+    cambiadas = {}
+    for columna in df.columns:
+        serie = df[columna]
+        if not isinstance(serie.dtype, pd.CategoricalDtype) or serie.cat.categories.dtype != object:
+            continue
+        if all(isinstance(valor, str) for valor in serie.cat.categories):
+            continue
+        texto = pd.Index([str(valor) for valor in serie.cat.categories])
+        if texto.is_unique:
+            cambiadas[columna] = pd.Categorical.from_codes(serie.array.codes, texto, validate=False)
+        else:
+            cambiadas[columna] = serie.astype('string')
+    return df.assign(**cambiadas) if cambiadas else df
+
+def _registrar(con, origen):
+    """Deja el origen como la vista 'datos' y devuelve sus columnas.
+
+    `origen` es un DataFrame (DuckDB lo lee en su lugar, ver _para_duckdb) o una
+    ruta o lista de rutas de archivos Parquet con el esquema de
+    database_reader.aplicar_esquema.
+    """
+    if isinstance(origen, pd.DataFrame):
+        con.register('datos', _para_duckdb(origen))
+    else:
+        rutas = [origen] if isinstance(origen, (str, os.PathLike)) else list(origen)
+        con.read_parquet([str(ruta) for ruta in rutas]).create_view('datos')
+    return [fila[0] for fila in con.execute("DESCRIBE datos").fetchall()]
+
+def _columna(nombre):
+    return '"' + nombre.replace('"', '""') + '"'
+
+def condiciones_sql(filtros_seleccionados, columnas):
+    """Traduce los filtros seleccionados a una condición SQL con sus parámetros.
+
+    Sigue las mismas reglas que data_filter.calcular_mascara: OR dentro de cada
+    columna, AND entre columnas, los filtros vacíos no se aplican, los valores se
+    comparan como texto (FECHA como fecha) y las horas sobre los minutos del día.
+    """
+    condiciones, parametros = [], []
+    for columna in config.columnas_indice:
+        seleccion = filtros_seleccionados.get(columna)
+        if not seleccion or columna not in columnas:
+            continue
+        if columna == 'FECHA':
+            valores = pd.to_datetime(pd.Series(list(seleccion)), errors='coerce').dropna().dt.date.unique().tolist()
+            expresion = f"CAST({_columna(columna)} AS DATE)"
+        else:
+            valores = sorted({str(valor) for valor in seleccion})
+            expresion = f"CAST({_columna(columna)} AS VARCHAR)"
+        if not valores:
+            condiciones.append("FALSE")
+            continue
+        condiciones.append(f"{expresion} IN ({', '.join('?' for _ in valores)})")
+        parametros.extend(valores)
+
+    for hora, comparacion in (('HORA_I', '>='), ('HORA_F', '<=')):
+        if filtros_seleccionados.get(hora):
+            minuto = _columna(config.columnas_minuto[hora])
+            valor = pd.to_datetime(filtros_seleccionados[hora], format='%H:%M:%S')
+            condiciones.append(f"{minuto} >= 0 AND CAST({minuto} AS INTEGER) * 60 {comparacion} ?")
+            parametros.append(valor.hour * 3600 + valor.minute * 60 + valor.second)
+
+    return ' AND '.join(f"({c})" for c in condiciones) or 'TRUE', parametros
+
+def filtrar(origen, filtros_seleccionados, limite=None):
+    """Filas del origen que cumplen los filtros, como DataFrame con el esquema compacto.
+
+    Con `limite` solo se traen las primeras filas (por ejemplo, para una vista previa).
+    """
+    con = _conexion()
+    try:
+        columnas = _registrar(con, origen)
+        condicion, parametros = condiciones_sql(filtros_seleccionados, columnas)
+        consulta = f"SELECT * FROM datos WHERE {condicion}"
+        if limite is not None:
+            consulta += " LIMIT ?"
+            parametros = parametros + [int(limite)]
+        df = con.execute(consulta, parametros).df()
+    finally:
+        con.close()
+    return database_reader.aplicar_esquema(df)
+
+def sumas_por_minuto(origen, filtros_seleccionados=None):
+    """Suma de cada columna de conteo por minuto del día de HORA_I, con los filtros aplicados.
+
+    Devuelve (conteos, filas): un DataFrame con índice entero (minuto del día) y una
+    columna por conteo, y el número de filas que cumplen los filtros. Las dos cosas
+    salen de la misma consulta (un solo recorrido del origen): el número de filas
+    incluye el grupo de las filas sin hora válida, que no entra en las sumas.
+    """
+    con = _conexion()
+    try:
+        columnas = _registrar(con, origen)
+        condicion, parametros = condiciones_sql(filtros_seleccionados or {}, columnas)
+        minuto = _columna(config.columnas_minuto['HORA_I'])
+        vehiculos = [col for col in config.columnas_vehiculos if col in columnas]
+        sumas = ', '.join(f"CAST(SUM({_columna(col)}) AS BIGINT) AS {_columna(col)}" for col in vehiculos)
+
+        grupos = con.execute(
+            f"SELECT {minuto} AS minuto, COUNT(*) AS __filas, {sumas} FROM datos "
+            f"WHERE {condicion} GROUP BY minuto",
+            parametros,
+        ).df()
+    finally:
+        con.close()
+
+    filas = int(grupos['__filas'].sum())
+    conteos = grupos[grupos['minuto'] >= 0].drop(columns='__filas').sort_values('minuto').set_index('minuto')
+    conteos.index = conteos.index.astype('int64').rename(None)
+    return conteos, filas
+
+def tabla_rango_15min(origen, filtros_seleccionados=None, pesos=None):
+    """Igual que df_generator.crear_tabla_rango_15min sobre las filas filtradas, calculada en DuckDB."""
+    conteos, _ = sumas_por_minuto(origen, filtros_seleccionados)
+    return df_generator.tabla_rango_15min_desde_conteos(conteos, pesos)
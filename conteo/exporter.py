@@ -0,0 +1,310 @@
+import functools
+import io
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+from conteo.database_reader import quitar_columnas_minuto
+
+# Nombre del archivo de plotly.js que acompaña a los gráficos dentro del ZIP
+PLOTLYJS_ZIP = 'plotly.min.js'
+
+
+def _valores_excel(serie):
+    """Valores de una columna como objetos de Python, con None en los faltantes (celda vacía)."""
+    if pd.api.types.infer_dtype(serie, skipna=True) == 'time':
+        serie = serie.astype(str).where(serie.notna())  # Las horas se escriben como texto, igual que pandas
+    valores = serie.astype(object).to_numpy(copy=True)
+    valores[serie.isna().to_numpy()] = None
+    return valores.tolist()
+
+def _filas_excel(df, tamano_bloque=10_000):
+    """Recorre las filas del DataFrame por bloques, para no convertir toda la tabla de una vez."""
+    for inicio in range(0, len(df), tamano_bloque):
+        bloque = df.iloc[inicio:inicio + tamano_bloque]
+        yield from zip(*(_valores_excel(bloque.iloc[:, i]) for i in range(bloque.shape[1])))
+
+def escribir_excel(hojas, destino):
+    """
+    Escribe uno o varios DataFrames en un libro de Excel, una hoja por DataFrame
+    
+    Usa el modo de solo escritura de openpyxl: las filas se escriben a medida que
+    se recorren, así el tiempo crece en forma lineal y la memoria no depende del
+    tamaño de la tabla. Todos los encabezados usan un mismo estilo con nombre.
+    Las columnas auxiliares de minutos del día no se exportan.
+    
+    Args:
+        hojas: Diccionario {nombre de hoja: DataFrame}
+        destino: Ruta o archivo binario abierto donde se guarda el libro
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+
+    libro = Workbook(write_only=True)
+    borde = Side(style='thin')
+    estilo = NamedStyle(name='encabezado', font=Font(bold=True),
+                        border=Border(left=borde, right=borde, top=borde, bottom=borde),
+                        alignment=Alignment(horizontal='center', vertical='top'))
+    libro.add_named_style(estilo)
+
+    for nombre_hoja, df in hojas.items():
+        df = quitar_columnas_minuto(df)
+        hoja = libro.create_sheet(title=nombre_hoja)
+        encabezado = []
+        for columna in df.columns:
+            celda = WriteOnlyCell(hoja, value=str(columna))
+            celda.style = 'encabezado'
+            encabezado.append(celda)
+        hoja.append(encabezado)
+        for fila in _filas_excel(df):
+            hoja.append(fila)
+
+    libro.save(destino)
+
+
+def exportar_libro_excel(hojas):
+    """
+    Convierte varios DataFrames a bytes de un solo Excel, una hoja por DataFrame
+    
+    El libro se arma en memoria, porque la descarga necesita sus bytes; para
+    escribirlo directo en disco está escribir_excel.
+    
+    Args:
+        hojas: Diccionario {nombre de hoja: DataFrame}
+        
+    Returns:
+        Bytes del archivo Excel
+    """
+    salida = io.BytesIO()
+    escribir_excel(hojas, salida)
+    return salida.getvalue()
+
+
+def exportar_a_excel(df, nombre_archivo="dataframe"):
+    """
+    Convierte un DataFrame a bytes de Excel para descarga
+    
+    Args:
+        df: DataFrame a exportar
+        nombre_archivo: Nombre base del archivo
+        
+    Returns:
+        Bytes del archivo Excel
+    """
+    return exportar_libro_excel({'Datos': df})
+
+
+def exportar_grafico_html(fig, nombre_archivo="grafico", plotlyjs='cdn'):
+    """
+    Convierte un gráfico de Plotly a HTML para descarga
+    
+    Args:
+        fig: Figura de Plotly
+        nombre_archivo: Nombre base del archivo
+        plotlyjs: De dónde carga plotly.js el HTML: 'cdn' (requiere internet) o la
+            ruta relativa de un archivo .js que va junto al HTML (ver PLOTLYJS_ZIP)
+        
+    Returns:
+        Bytes del archivo HTML
+    """
+    html_string = fig.to_html(include_plotlyjs=plotlyjs)
+    return html_string.encode('utf-8')
+
+
+@functools.lru_cache(maxsize=1)
+def obtener_plotlyjs():
+    """
+    Devuelve el plotly.js de la versión instalada, para usar los gráficos sin internet
+    
+    Returns:
+        Bytes de plotly.min.js (se genera una sola vez por proceso)
+    """
+    from plotly.offline import get_plotlyjs
+    return get_plotlyjs().encode('utf-8')
+
+
+def exportar_grafico_png(fig):
+    """
+    Convierte un gráfico de Plotly a PNG para descarga
+    Requiere kaleido instalado
+    
+    Args:
+        fig: Figura de Plotly
+        
+    Returns:
+        Bytes del archivo PNG
+    """
+    try:
+        return fig.to_image(format="png", width=1200, height=800)
+    except Exception as e:
+        # Si falla (por falta de kaleido), retornar None
+        return None
+
+
+# Archivos de descarga que se generan a partir de los resultados de un análisis
+ARTEFACTOS = {
+    'excel_filtrado': lambda r: exportar_a_excel(r['df_filtrado'], "datos_filtrados"),
+    'excel_suma': lambda r: exportar_a_excel(r['df_suma_hora'], "suma_15min"),
+    'excel_rango': lambda r: exportar_a_excel(r['df_rango_hora'], "rango_hora"),
+    'excel_tablas': lambda r: exportar_libro_excel({
+        'Datos filtrados': r['df_filtrado'],
+        'Suma 15 min': r['df_suma_hora'],
+        'Rango hora': r['df_rango_hora'],
+    }),
+    'html_barras': lambda r: exportar_grafico_html(r['graficos']['barras'], "grafico_barras"),
+    'html_barras_apiladas': lambda r: exportar_grafico_html(r['graficos']['barras_apiladas'], "grafico_barras_apiladas"),
+    'html_torta': lambda r: exportar_grafico_html(r['graficos']['torta'], "grafico_torta"),
+    # Versiones para el ZIP: cargan plotly.js desde el archivo que va dentro del mismo ZIP
+    'html_barras_zip': lambda r: exportar_grafico_html(r['graficos']['barras'], "grafico_barras", PLOTLYJS_ZIP),
+    'html_barras_apiladas_zip': lambda r: exportar_grafico_html(
+        r['graficos']['barras_apiladas'], "grafico_barras_apiladas", PLOTLYJS_ZIP),
+    'html_torta_zip': lambda r: exportar_grafico_html(r['graficos']['torta'], "grafico_torta", PLOTLYJS_ZIP),
+}
+
+
+# Formatos que ya vienen comprimidos: se guardan en el ZIP sin volver a comprimirlos
+EXTENSIONES_COMPRIMIDAS = ('.xlsx', '.png', '.zip')
+
+
+def _tipo_compresion(nombre_miembro):
+    if nombre_miembro.lower().endswith(EXTENSIONES_COMPRIMIDAS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def escribir_zip_completo(df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico, nombre_archivo,
+                          destino, obtener_artefacto=None):
+    """
+    Escribe el ZIP con todos los resultados del análisis en un archivo
+    
+    Los archivos del ZIP se generan uno por uno y se escriben apenas están
+    listos, así en memoria solo está el que se está agregando. Los Excel ya son
+    archivos comprimidos, así que se guardan sin volver a comprimir; HTML, JS y
+    TXT se comprimen.
+    
+    Args:
+        df_filtrado: DataFrame con datos filtrados
+        df_suma_hora: DataFrame con suma por 15 min
+        df_rango_hora: DataFrame con rango por hora
+        graficos: Diccionario con las figuras de Plotly
+        hora_pico: String con información de hora pico
+        nombre_archivo: Nombre base del archivo original
+        destino: Ruta o archivo binario abierto donde se escribe el ZIP
+        obtener_artefacto: Función opcional (nombre, construir) -> bytes para
+            reutilizar los Excel y HTML ya generados (por ejemplo, desde una caché)
+    """
+    resultados = {
+        'df_filtrado': df_filtrado,
+        'df_suma_hora': df_suma_hora,
+        'df_rango_hora': df_rango_hora,
+        'graficos': graficos
+    }
+    
+    def artefacto(nombre):
+        # Función que genera (o toma de la caché) el artefacto al momento de agregarlo
+        construir = lambda: ARTEFACTOS[nombre](resultados)
+        return lambda: construir() if obtener_artefacto is None else obtener_artefacto(nombre, construir)
+    
+    readme_content = f"""
+╔════════════════════════════════════════════════════════════╗
+║          ANÁLISIS DE AFOROS VEHICULARES - GRUPOVIAL        ║
+╚════════════════════════════════════════════════════════════╝
+
+📅 Fecha de generación: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+📁 Archivo original: {nombre_archivo}
+🕐 {hora_pico}
+
+═══════════════════════════════════════════════════════════════
+
+📋 CONTENIDO DEL ARCHIVO:
+
+1. 📊 DATOS Y TABLAS (Excel):
+   ├─ 01_datos_filtrados.xlsx      - Datos completos después de filtros
+   ├─ 02_suma_15min.xlsx            - Resumen cada 15 minutos
+   └─ 03_rango_hora.xlsx            - Resumen por hora
+
+2. 📈 GRÁFICOS INTERACTIVOS (HTML):
+   ├─ 04_grafico_hora_pico.html     - Gráfico de barras con hora pico
+   ├─ 05_grafico_barras_apiladas.html - Distribución por tipo de vehículo
+   ├─ 06_grafico_composicion.html   - Composición vehicular (torta)
+   └─ {PLOTLYJS_ZIP}                 - Librería de gráficos (la usan los tres HTML)
+
+3. 📝 INFORMACIÓN:
+   └─ 00_HORA_PICO.txt              - Información de hora pico
+
+═══════════════════════════════════════════════════════════════
+
+💡 CÓMO USAR LOS GRÁFICOS HTML:
+
+1. Descomprime el ZIP completo y abre los archivos .html en cualquier navegador web.
+   No necesitan internet, pero {PLOTLYJS_ZIP} debe quedar en la misma carpeta
+2. Los gráficos son INTERACTIVOS:
+   - Haz zoom con el mouse
+   - Pasa el cursor para ver detalles
+   - Usa los botones en la esquina superior derecha para:
+     * Descargar como PNG
+     * Hacer zoom
+     * Pan
+     * Resetear vista
+
+═══════════════════════════════════════════════════════════════
+
+📊 RESUMEN DEL ANÁLISIS:
+
+Total de registros filtrados: {len(df_filtrado):,}
+Periodo analizado: Ver archivos de datos
+{hora_pico}
+
+═══════════════════════════════════════════════════════════════
+
+🚗 GRUPOVIALAPP v2.0 - Powered by Streamlit
+    """
+    
+    # Archivos del ZIP, en el orden en que se agregan
+    miembros = [
+        # 1. DataFrames como Excel
+        ("01_datos_filtrados.xlsx", artefacto('excel_filtrado')),
+        ("02_suma_15min.xlsx", artefacto('excel_suma')),
+        ("03_rango_hora.xlsx", artefacto('excel_rango')),
+        # 2. Gráficos como HTML, con un solo plotly.js compartido para abrirlos sin internet
+        ("04_grafico_hora_pico.html", artefacto('html_barras_zip')),
+        ("05_grafico_barras_apiladas.html", artefacto('html_barras_apiladas_zip')),
+        ("06_grafico_composicion.html", artefacto('html_torta_zip')),
+        (PLOTLYJS_ZIP, obtener_plotlyjs),
+        # 3. Hora pico como TXT
+        ("00_HORA_PICO.txt", lambda: hora_pico.encode('utf-8')),
+        # 4. README con información
+        ("LEEME.txt", lambda: readme_content.encode('utf-8')),
+    ]
+    
+    with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for nombre, generar in miembros:
+            zip_file.writestr(nombre, generar(), compress_type=_tipo_compresion(nombre))
+
+
+def crear_zip_completo(df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico, nombre_archivo,
+                       obtener_artefacto=None):
+    """
+    Crea un archivo ZIP con todos los resultados del análisis
+    
+    El ZIP se arma en memoria, porque la descarga necesita sus bytes; para
+    escribirlo directo en disco está escribir_zip_completo.
+    
+    Args:
+        df_filtrado: DataFrame con datos filtrados
+        df_suma_hora: DataFrame con suma por 15 min
+        df_rango_hora: DataFrame con rango por hora
+        graficos: Diccionario con las figuras de Plotly
+        hora_pico: String con información de hora pico
+        nombre_archivo: Nombre base del archivo original
+        obtener_artefacto: Función opcional (nombre, construir) -> bytes para
+            reutilizar los Excel y HTML ya generados (por ejemplo, desde una caché)
+        
+    Returns:
+        Bytes del archivo ZIP
+    """
+    salida = io.BytesIO()
+    escribir_zip_completo(df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico, nombre_archivo,
+                          salida, obtener_artefacto)
+    return salida.getvalue()
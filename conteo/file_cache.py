@@ -0,0 +1,85 @@
+import hashlib
+import os
+import tempfile
+
+import pandas as pd
+from conteo import config
+
+
+def calcular_hash(contenido):
+    """Calcula el hash SHA-256 de los bytes de un archivo."""
+    return hashlib.sha256(contenido).hexdigest()
+
+def _ruta_cache(clave):
+    return os.path.join(config.cache_directorio, f'{clave}.parquet')
+
+def leer_cache(clave):
+    """Devuelve el DataFrame guardado para la clave, o None si no está en la caché."""
+    ruta = _ruta_cache(clave)
+    try:
+        df = pd.read_parquet(ruta)
+    except Exception:
+        # No existe o está dañado: se vuelve a leer el archivo original
+        return None
+
+    # Marcar la entrada como usada recientemente para la expulsión LRU
+    try:
+        os.utime(ruta, None)
+    except OSError:
+        pass
+    return df
+
+def ruta_cache(clave):
+    """Devuelve la ruta del Parquet guardado para la clave, o None si no está en la caché.
+
+    Sirve para leer la entrada sin cargarla en pandas (por ejemplo, con DuckDB).
+    """
+    ruta = _ruta_cache(clave)
+    try:
+        os.utime(ruta, None)
+    except OSError:
+        return None
+    return ruta
+
+def guardar_cache(clave, df):
+    """Guarda el DataFrame como Parquet bajo la clave y aplica el límite de tamaño.
+
+    Devuelve True si se pudo guardar. La caché es opcional: si pyarrow no puede
+    convertir alguna columna (por ejemplo, tipos mezclados) simplemente no se guarda.
+    """
+    os.makedirs(config.cache_directorio, exist_ok=True)
+    descriptor, ruta_temporal = tempfile.mkstemp(suffix='.tmp', dir=config.cache_directorio)
+    os.close(descriptor)
+    try:
+        df.to_parquet(ruta_temporal, index=False)
+        # Escritura atómica para que otra sesión nunca lea un archivo a medias
+        os.replace(ruta_temporal, _ruta_cache(clave))
+    except Exception:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        return False
+
+    aplicar_limite_cache()
+    return True
+
+def aplicar_limite_cache(max_bytes=None):
+    """Elimina las entradas usadas hace más tiempo hasta quedar bajo el límite."""
+    if max_bytes is None:
+        max_bytes = config.cache_max_bytes
+
+    entradas = []
+    with os.scandir(config.cache_directorio) as archivos:
+        for archivo in archivos:
+            if archivo.name.endswith('.parquet'):
+                info = archivo.stat()
+                entradas.append((info.st_mtime, info.st_size, archivo.path))
+
+    total = sum(tamano for _, tamano, _ in entradas)
+    for _, tamano, ruta in sorted(entradas):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(ruta)
+            total -= tamano
+        except OSError:
+            pass
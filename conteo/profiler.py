@@ -0,0 +1,167 @@
+"""Perfil de las etapas del análisis: tiempo, filas y pico de memoria de cada etapa.
+
+El código del análisis marca sus etapas con `with profiler.etapa(nombre, filas):`.
+Mientras no haya un perfil activo (perfilar), etapa devuelve un objeto que no
+hace nada, así que marcar las etapas no cuesta más que una llamada. Dentro de
+`with profiler.perfilar() as etapas:` cada etapa agrega a la lista un registro
+con su nombre, nivel de anidación, segundos, filas de entrada y de salida y, si
+se mide la memoria, el pico de memoria que asignó Python durante la etapa
+(tracemalloc; medirla hace más lento el análisis).
+
+El perfil activo se guarda en una variable de contexto: cada hilo (cada sesión
+de Streamlit) tiene el suyo y las etapas que corren en otros hilos o procesos
+(las lecturas en paralelo, los archivos del ZIP) no se registran por separado.
+"""
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+_perfil_actual = contextvars.ContextVar('perfil_actual', default=None)
+
+# tracemalloc es global al proceso: se inicia con el primer perfil que mide memoria y se
+# detiene con el último (si ya estaba activo por otro motivo, no se detiene)
+_memoria = {'perfiles': 0, 'iniciada': False, 'lock': threading.Lock()}
+
+
+class _EtapaInactiva:
+    """Etapa sin perfil activo: no mide nada."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        return False
+
+    def salida(self, filas):
+        pass
+
+    def salida_mascara(self, mascara):
+        pass
+
+    def anotar(self, clave, valor):
+        pass
+
+
+_INACTIVA = _EtapaInactiva()
+
+
+class _Etapa:
+    """Etapa de un perfil activo: agrega su registro al entrar y lo completa al salir."""
+
+    def __init__(self, perfil, nombre, filas_entrada):
+        self.perfil = perfil
+        self.registro = {
+            'etapa': nombre,
+            'nivel': len(perfil['pila']),
+            'segundos': None,
+            'filas_entrada': None if filas_entrada is None else int(filas_entrada),
+            'filas_salida': None,
+            'memoria_pico_bytes': None,
+        }
+
+    def __enter__(self):
+        perfil = self.perfil
+        perfil['etapas'].append(self.registro)
+        if perfil['memoria']:
+            actual, pico = tracemalloc.get_traced_memory()
+            if perfil['pila']:
+                # Lo que llevaba la etapa de afuera cuenta para su pico antes de reiniciarlo
+                padre = perfil['pila'][-1]
+                padre.pico = max(padre.pico, pico)
+            tracemalloc.reset_peak()
+            self.base = self.pico = actual
+        perfil['pila'].append(self)
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.registro['segundos'] = time.perf_counter() - self.inicio
+        perfil = self.perfil
+        perfil['pila'].pop()
+        if perfil['memoria']:
+            self.pico = max(self.pico, tracemalloc.get_traced_memory()[1])
+            self.registro['memoria_pico_bytes'] = self.pico - self.base
+            if perfil['pila']:
+                padre = perfil['pila'][-1]
+                padre.pico = max(padre.pico, self.pico)
+            tracemalloc.reset_peak()
+        if tipo is not None:
+            self.registro['error'] = tipo.__name__
+        return False
+
+    def salida(self, filas):
+        """Registra las filas que deja la etapa."""
+        self.registro['filas_salida'] = int(filas)
+
+    def salida_mascara(self, mascara):
+        """Registra como filas de salida las filas marcadas en una máscara booleana."""
+        self.registro['filas_salida'] = int(np.count_nonzero(mascara))
+
+    def anotar(self, clave, valor):
+        """Agrega un dato al registro de la etapa (por ejemplo, si vino de la caché)."""
+        self.registro[clave] = valor
+
+
+def etapa(nombre, filas_entrada=None):
+    """Marca una etapa del análisis; usar como `with etapa(nombre, filas) as e:`.
+
+    Dentro del bloque, e.salida(filas) registra las filas que deja la etapa. Sin un
+    perfil activo no se mide nada.
+    """
+    perfil = _perfil_actual.get()
+    if perfil is None:
+        return _INACTIVA
+    return _Etapa(perfil, nombre, filas_entrada)
+
+
+def activo():
+    """Indica si hay un perfil activo en este hilo."""
+    return _perfil_actual.get() is not None
+
+
+def _iniciar_memoria():
+    with _memoria['lock']:
+        if _memoria['perfiles'] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _memoria['iniciada'] = True
+        _memoria['perfiles'] += 1
+
+
+def _detener_memoria():
+    with _memoria['lock']:
+        _memoria['perfiles'] -= 1
+        if _memoria['perfiles'] == 0 and _memoria['iniciada']:
+            tracemalloc.stop()
+            _memoria['iniciada'] = False
+
+
+@contextmanager
+def perfilar(memoria=True):
+    """Registra las etapas que corren dentro del bloque y entrega la lista de registros.
+
+    Con memoria=True también se mide el pico de memoria de cada etapa con tracemalloc
+    (si hay varias sesiones perfilando a la vez, los picos pueden incluir memoria de
+    las otras).
+    """
+    perfil = {'etapas': [], 'pila': [], 'memoria': memoria}
+    token = _perfil_actual.set(perfil)
+    if memoria:
+        _iniciar_memoria()
+    try:
+        yield perfil['etapas']
+    finally:
+        _perfil_actual.reset(token)
+        if memoria:
+            _detener_memoria()
+
+
+def a_json(etapas):
+    """Serializa los registros de un perfil a JSON (texto)."""
+    total = sum(registro['segundos'] or 0 for registro in etapas if registro['nivel'] == 0)
+    return json.dumps({'total_segundos': total, 'etapas': etapas}, ensure_ascii=False, indent=2)
@@ -0,0 +1,196 @@
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from conteo import config
+from conteo.database_reader import aplicar_esquema
+
+# Objetos guardados por cada sesión: {id_sesion: {'objetos': OrderedDict(clave -> entrada), 'usada': tiempo}}
+# Cada entrada es {'valor', 'tamano', 'ruta', 'tipos'}; 'valor' es None mientras el objeto está solo en
+# disco y 'tipos' guarda los tipos de fecha de un DataFrame bajado a Parquet, que no los conserva.
+# 'externos' son los bytes de las cachés compartidas entre sesiones ({nombre: bytes}), que
+# cuentan en el presupuesto de todas las sesiones aunque no se puedan bajar a disco
+_estado = {'sesiones': {}, 'externos': {}, 'lock': threading.RLock()}
+
+# Propiedades de las trazas de Plotly que llevan los datos de un gráfico
+_PROPIEDADES_TRAZA = ('x', 'y', 'z', 'values', 'labels', 'text', 'hovertext', 'customdata')
+
+
+def _tamano_figura(figura):
+    """Bytes de los datos de las trazas de una figura de Plotly, sin serializarla."""
+    return sum(tamano_objeto(traza[propiedad])
+               for traza in figura.data for propiedad in _PROPIEDADES_TRAZA if propiedad in traza)
+
+def tamano_objeto(valor):
+    """Estima los bytes que ocupa un objeto guardado en la sesión (o en una caché)."""
+    if valor is None:
+        return 0
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, np.ndarray):
+        # Los códigos y máscaras del índice de filtros pueden ser vistas: getsizeof no cuenta sus datos
+        return int(valor.nbytes)
+    if isinstance(valor, (bytes, bytearray, str)):
+        return len(valor)
+    if isinstance(valor, dict):
+        return sum(tamano_objeto(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sum(tamano_objeto(v) for v in valor)
+    if hasattr(valor, 'to_plotly_json'):
+        # Figuras de Plotly: los arreglos de sus trazas
+        return _tamano_figura(valor)
+    return sys.getsizeof(valor)
+
+def _directorio_sesion(id_sesion):
+    return os.path.join(config.sesion_directorio, id_sesion)
+
+def _bajar_a_disco(id_sesion, clave, entrada):
+    """Escribe el objeto en disco (si no estaba ya) y libera la memoria que ocupaba."""
+    if entrada['ruta'] is None:
+        os.makedirs(_directorio_sesion(id_sesion), exist_ok=True)
+        base = os.path.join(_directorio_sesion(id_sesion), clave)
+        valor = entrada['valor']
+        try:
+            if not isinstance(valor, pd.DataFrame):
+                raise TypeError
+            valor.to_parquet(base + '.parquet')
+            entrada['ruta'] = base + '.parquet'
+            # Parquet no tiene fechas en segundos: FECHA (datetime64[s]) volvería en milisegundos
+            entrada['tipos'] = {col: tipo for col, tipo in valor.dtypes.items()
+                                if pd.api.types.is_datetime64_any_dtype(tipo)}
+        except Exception:
+            # Lo que no es un DataFrame, o no se puede guardar como Parquet, va con pickle
+            if os.path.exists(base + '.parquet'):
+                os.remove(base + '.parquet')
+            with open(base + '.pkl', 'wb') as archivo:
+                pickle.dump(valor, archivo, protocol=pickle.HIGHEST_PROTOCOL)
+            entrada['ruta'] = base + '.pkl'
+    # El archivo se conserva: los objetos no se modifican, así que volver a bajarlo no cuesta nada
+    entrada['valor'] = None
+
+def _leer_de_disco(entrada):
+    if entrada['ruta'].endswith('.parquet'):
+        df = pd.read_parquet(entrada['ruta'])
+        if entrada.get('tipos'):
+            df = df.astype(entrada['tipos'])
+        if set(df.columns) <= set(config.lista_columnas) | set(config.columnas_minuto.values()):
+            # Los datos cargados vuelven con el esquema compacto (no copia si ya lo tienen)
+            df = aplicar_esquema(df)
+        return df
+    with open(entrada['ruta'], 'rb') as archivo:
+        return pickle.load(archivo)
+
+def _en_memoria(sesion):
+    return sum(e['tamano'] for e in sesion['objetos'].values() if e['valor'] is not None)
+
+def _aplicar_limites(id_sesion, clave_actual):
+    """Baja a disco los objetos usados hace más tiempo hasta cumplir los dos presupuestos.
+
+    Primero el de la sesión (config.sesion_max_bytes), después el de todas las
+    sesiones juntas (config.sesiones_max_bytes). El objeto que se acaba de usar
+    nunca se baja, aunque por sí solo supere el presupuesto.
+    """
+    sesion = _estado['sesiones'][id_sesion]
+    for clave, entrada in list(sesion['objetos'].items()):
+        if _en_memoria(sesion) <= config.sesion_max_bytes:
+            break
+        if clave != clave_actual and entrada['valor'] is not None:
+            _bajar_a_disco(id_sesion, clave, entrada)
+
+    _aplicar_limite_global((id_sesion, clave_actual))
+
+def _aplicar_limite_global(protegido=None):
+    """Baja a disco objetos de las sesiones hasta que ellas y las cachés compartidas
+    quepan en config.sesiones_max_bytes; `protegido` es (id_sesion, clave) a conservar."""
+    sesiones = _estado['sesiones']
+    # Candidatos de todas las sesiones: primero las sesiones usadas hace más tiempo
+    total = sum(_en_memoria(s) for s in sesiones.values()) + sum(_estado['externos'].values())
+    for otra_id, otra in sorted(sesiones.items(), key=lambda item: item[1]['usada']):
+        for clave, entrada in list(otra['objetos'].items()):
+            if total <= config.sesiones_max_bytes:
+                return
+            if (otra_id, clave) != protegido and entrada['valor'] is not None:
+                total -= entrada['tamano']
+                _bajar_a_disco(otra_id, clave, entrada)
+
+def _cerrar_sesiones_inactivas():
+    limite = time.monotonic() - config.sesion_inactiva_segundos
+    for id_sesion, sesion in list(_estado['sesiones'].items()):
+        if sesion['usada'] < limite:
+            cerrar_sesion(id_sesion)
+
+def _sesion(id_sesion):
+    sesion = _estado['sesiones'].setdefault(id_sesion, {'objetos': OrderedDict(), 'usada': 0})
+    sesion['usada'] = time.monotonic()
+    return sesion
+
+def guardar(id_sesion, clave, valor):
+    """Guarda un objeto de la sesión (reemplaza el anterior con la misma clave) y aplica los presupuestos."""
+    with _estado['lock']:
+        _cerrar_sesiones_inactivas()
+        eliminar(id_sesion, clave)
+        if valor is None:
+            return
+        sesion = _sesion(id_sesion)
+        sesion['objetos'][clave] = {'valor': valor, 'tamano': tamano_objeto(valor), 'ruta': None}
+        _aplicar_limites(id_sesion, clave)
+
+def obtener(id_sesion, clave, defecto=None):
+    """Devuelve un objeto de la sesión; si estaba en disco lo vuelve a cargar en memoria."""
+    with _estado['lock']:
+        sesion = _sesion(id_sesion)
+        entrada = sesion['objetos'].get(clave)
+        if entrada is None:
+            return defecto
+        sesion['objetos'].move_to_end(clave)
+        if entrada['valor'] is None:
+            entrada['valor'] = _leer_de_disco(entrada)
+            _aplicar_limites(id_sesion, clave)
+        return entrada['valor']
+
+def eliminar(id_sesion, clave):
+    """Quita un objeto de la sesión, de memoria y de disco."""
+    with _estado['lock']:
+        sesion = _estado['sesiones'].get(id_sesion)
+        entrada = sesion['objetos'].pop(clave, None) if sesion else None
+        if entrada and entrada['ruta'] and os.path.exists(entrada['ruta']):
+            os.remove(entrada['ruta'])
+
+def cerrar_sesion(id_sesion):
+    """Quita todos los objetos de la sesión y borra sus archivos."""
+    with _estado['lock']:
+        _estado['sesiones'].pop(id_sesion, None)
+        shutil.rmtree(_directorio_sesion(id_sesion), ignore_errors=True)
+
+def registrar_uso_externo(nombre, tamano):
+    """Informa los bytes que ocupa una caché compartida entre sesiones (por ejemplo, la de resultados).
+
+    Cuentan en el presupuesto de todas las sesiones: si con ellos se supera, se bajan
+    a disco los objetos de las sesiones usados hace más tiempo.
+    """
+    with _estado['lock']:
+        _estado['externos'][nombre] = tamano
+        _aplicar_limite_global()
+
+def uso(id_sesion):
+    """Bytes en memoria y en disco de la sesión y de todas las sesiones, con sus presupuestos."""
+    with _estado['lock']:
+        sesion = _estado['sesiones'].get(id_sesion, {'objetos': {}})
+        objetos = sesion['objetos'].values()
+        return {
+            'memoria': sum(e['tamano'] for e in objetos if e['valor'] is not None),
+            'disco': sum(e['tamano'] for e in objetos if e['valor'] is None),
+            'objetos': len(objetos),
+            'memoria_global': sum(_en_memoria(s) for s in _estado['sesiones'].values())
+                              + sum(_estado['externos'].values()),
+            'caches': sum(_estado['externos'].values()),
+            'sesiones': len(_estado['sesiones']),
+            'max_sesion': config.sesion_max_bytes,
+            'max_global': config.sesiones_max_bytes,
+        }
@@ -0,0 +1,239 @@
+"""Almacén histórico de aforos en Parquet, particionado por año, mes y estación.
+
+Los datos cargados se escriben como un dataset de Parquet con particiones al estilo
+Hive (ANIO=2024/MES=3/ID_ESTACION=E01/...). Dentro de cada archivo las filas van
+ordenadas por FECHA y minuto del día, así las estadísticas de cada grupo de filas
+permiten descartar los que no cumplen los filtros. Una consulta con el diccionario
+de filtros de la página solo abre las particiones de los meses y estaciones pedidos
+y, dentro de ellas, solo los grupos de filas con las fechas y horas pedidas.
+"""
+import math
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from conteo import config
+from conteo.database_reader import aplicar_esquema
+
+# Columnas de partición, en el orden de las carpetas
+PARTICIONES = pa.schema([('ANIO', pa.int16()), ('MES', pa.int8()), ('ID_ESTACION', pa.string())])
+
+# Columnas que identifican un registro, como en database_reader.quitar_duplicados
+CLAVES_REGISTRO = ['ID', 'FOLIO', 'FECHA', 'HORA_I']
+
+
+def _particionado():
+    return ds.partitioning(PARTICIONES, flavor='hive')
+
+def _directorio(directorio):
+    return config.almacen_directorio if directorio is None else directorio
+
+def _esquema():
+    """Esquema fijo de los archivos del almacén (el mismo para todas las cargas)."""
+    campos = []
+    for columna in config.lista_columnas + list(config.columnas_minuto.values()):
+        if columna == 'FECHA':
+            campos.append((columna, pa.timestamp('us')))
+        elif columna in config.columnas_minuto.values():
+            campos.append((columna, pa.int16()))
+        elif columna in config.columnas_vehiculos:
+            campos.append((columna, pa.int32()))
+        else:
+            campos.append((columna, pa.string()))
+    return pa.schema(campos)
+
+def _como_texto(serie):
+    """Columna de texto de Arrow (los valores faltantes quedan nulos)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Convertir solo las categorías y repartirlas con los códigos
+        codigos = serie.cat.codes.to_numpy()
+        categorias = pa.array([str(valor) for valor in serie.cat.categories], pa.string())
+        return pa.DictionaryArray.from_arrays(pa.array(codigos, mask=codigos < 0), categorias).cast(pa.string())
+    if serie.dtype.kind == 'f' and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype('Int64')  # Identificadores enteros leídos como decimales por tener vacíos
+    return pa.array(serie.astype('string'), pa.string())
+
+def _tabla(df):
+    """Convierte el DataFrame al esquema del almacén, con las columnas de partición."""
+    df = aplicar_esquema(df)
+    columnas = {}
+    for campo in _esquema():
+        if campo.name not in df.columns:
+            # Igual que al combinar archivos: un conteo que el archivo no trae cuenta 0
+            relleno = 0 if campo.name in config.columnas_vehiculos else None
+            columnas[campo.name] = pa.nulls(len(df), campo.type) if relleno is None else pa.array(
+                [relleno] * len(df), campo.type)
+        elif campo.type == pa.string():
+            columnas[campo.name] = _como_texto(df[campo.name])
+        else:
+            columnas[campo.name] = pa.array(df[campo.name], campo.type, from_pandas=True)
+
+    fechas = columnas['FECHA']
+    columnas['ANIO'] = pc.year(fechas).cast(pa.int16())
+    columnas['MES'] = pc.month(fechas).cast(pa.int8())
+    return pa.table(columnas)
+
+def _hashes_registros(tabla):
+    """Hash de 64 bits por fila de CLAVES_REGISTRO (la tabla tiene el esquema del almacén)."""
+    return pd.util.hash_pandas_object(tabla.select(CLAVES_REGISTRO).to_pandas(), index=False)
+
+def _quitar_registros_guardados(tabla, prefijo, directorio):
+    """Quita de la tabla los registros que ya están en las particiones que toca.
+
+    Se comparan las CLAVES_REGISTRO contra los archivos de esas particiones que no
+    son de esta misma carga (los de la carga se reemplazan al escribir). Las filas
+    sin ID o sin FOLIO nunca se consideran repetidas, como en quitar_duplicados.
+    """
+    if tabla.num_rows == 0 or not os.path.isdir(directorio):
+        return tabla
+
+    estaciones = pc.unique(tabla['ID_ESTACION'])
+    expresion = (ds.field('ANIO').isin(pc.unique(tabla['ANIO'])) & ds.field('MES').isin(pc.unique(tabla['MES']))
+                 & (ds.field('ID_ESTACION').isin(estaciones.drop_null()) | ds.field('ID_ESTACION').is_null()))
+    rutas = [fragmento.path for fragmento in _dataset(directorio).get_fragments(filter=expresion)
+             if not os.path.basename(fragmento.path).startswith(prefijo)]
+    if not rutas:
+        return tabla
+
+    guardadas = ds.dataset(rutas, format='parquet', schema=_esquema()).to_table(columns=CLAVES_REGISTRO)
+    repetidas = _hashes_registros(tabla).isin(_hashes_registros(guardadas)).to_numpy()
+    con_id_y_folio = pc.and_(pc.is_valid(tabla['ID']), pc.is_valid(tabla['FOLIO'])).to_numpy(zero_copy_only=False)
+    return tabla.filter(pa.array(~(repetidas & con_id_y_folio)))
+
+def guardar_en_almacen(df, clave=None, directorio=None):
+    """Agrega el DataFrame al almacén, repartido en sus particiones de año, mes y estación.
+
+    `clave` identifica la carga (por ejemplo, el hash del archivo): los archivos se
+    nombran con ella, así guardar dos veces la misma carga reemplaza sus archivos.
+    Además, los registros (ID, FOLIO, FECHA, HORA_I) que ya están en el almacén por
+    otra carga no se vuelven a escribir: por ejemplo, al guardar un estudio al que se
+    le agregaron archivos, o datos que se cargaron del mismo almacén. Devuelve el
+    número de filas guardadas.
+    """
+    prefijo = f"{clave or uuid.uuid4().hex}-"
+    tabla = _quitar_registros_guardados(_tabla(df), prefijo, _directorio(directorio))
+    if tabla.num_rows == 0:
+        return 0
+    # Ordenar para que las estadísticas de cada grupo de filas cubran rangos de fecha y hora estrechos
+    tabla = tabla.sort_by([('ID_ESTACION', 'ascending'), ('FECHA', 'ascending'),
+                           (config.columnas_minuto['HORA_I'], 'ascending')])
+    ds.write_dataset(
+        tabla, _directorio(directorio), format='parquet', partitioning=_particionado(),
+        basename_template=prefijo + "{i}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        max_rows_per_group=config.almacen_filas_grupo,
+        min_rows_per_group=min(config.almacen_filas_grupo, max(len(tabla), 1)),
+    )
+    return tabla.num_rows
+
+def _dataset(directorio=None):
+    return ds.dataset(_directorio(directorio), format='parquet', partitioning=_particionado(),
+                      schema=pa.unify_schemas([_esquema(), PARTICIONES]))
+
+def _meses_del_rango(inicio, fin):
+    return {(fecha.year, fecha.month) for fecha in pd.period_range(inicio, fin, freq='M')}
+
+def expresion_filtros(filtros_seleccionados=None, fechas=None):
+    """Traduce los filtros de la página a una expresión de pyarrow.dataset (o None si no hay filtros).
+
+    Sigue las mismas reglas que data_filter.calcular_mascara (los filtros vacíos no
+    se aplican). `fechas` es un rango (inicio, fin) inclusive, como en
+    database_reader.leer_xlsx_columnas; cualquiera de los dos puede ser None. Los
+    meses pedidos se traducen a las particiones ANIO/MES para no abrir las demás.
+    """
+    filtros_seleccionados = filtros_seleccionados or {}
+    condiciones = []
+    meses = None
+
+    if filtros_seleccionados.get('FECHA'):
+        dias = pd.to_datetime(pd.Series(list(filtros_seleccionados['FECHA'])), errors='coerce').dropna().dt.normalize()
+        meses = {(dia.year, dia.month) for dia in dias}
+        condiciones.append(ds.field('FECHA').isin(pa.array(dias.unique(), pa.timestamp('us'))))
+    if fechas is not None:
+        inicio, fin = (pd.Timestamp(f).normalize() if f is not None else None for f in fechas)
+        if inicio is not None:
+            condiciones.append(ds.field('FECHA') >= pa.scalar(inicio, pa.timestamp('us')))
+        if fin is not None:
+            condiciones.append(ds.field('FECHA') <= pa.scalar(fin, pa.timestamp('us')))
+        if inicio is not None and fin is not None:
+            rango = _meses_del_rango(inicio, fin)
+            meses = rango if meses is None else meses & rango
+
+    if meses is not None:
+        por_mes = [(ds.field('ANIO') == anio) & (ds.field('MES') == mes) for anio, mes in sorted(meses)]
+        condiciones.append(_unir(por_mes, '|') if por_mes else ds.scalar(False))
+
+    for columna in config.columnas_indice:
+        if columna != 'FECHA' and filtros_seleccionados.get(columna):
+            condiciones.append(ds.field(columna).isin([str(valor) for valor in filtros_seleccionados[columna]]))
+
+    # Horas: minutos * 60 contra los segundos de la hora elegida, igual que data_filter.mascara_minutos
+    for hora, limite in (('HORA_I', 'desde'), ('HORA_F', 'hasta')):
+        if filtros_seleccionados.get(hora):
+            valor = pd.to_datetime(filtros_seleccionados[hora], format='%H:%M:%S')
+            segundos = valor.hour * 3600 + valor.minute * 60 + valor.second
+            minuto = ds.field(config.columnas_minuto[hora])
+            if limite == 'desde':
+                condiciones.append(minuto >= max(math.ceil(segundos / 60), 0))
+            else:
+                condiciones.append((minuto >= 0) & (minuto <= segundos // 60))
+
+    return _unir(condiciones, '&') if condiciones else None
+
+def _unir(expresiones, operador):
+    resultado = expresiones[0]
+    for expresion in expresiones[1:]:
+        resultado = resultado & expresion if operador == '&' else resultado | expresion
+    return resultado
+
+def consultar_almacen(filtros_seleccionados=None, fechas=None, directorio=None):
+    """Lee del almacén solo las filas que cumplen los filtros, con el esquema compacto.
+
+    Devuelve un DataFrame con las columnas de config.lista_columnas (más los minutos
+    del día), listo para el análisis como si viniera de un archivo cargado.
+    """
+    dataset = _dataset(directorio)
+    tabla = dataset.to_table(columns=_esquema().names, filter=expresion_filtros(filtros_seleccionados, fechas))
+    return aplicar_esquema(tabla.to_pandas())
+
+def plan_consulta(filtros_seleccionados=None, fechas=None, directorio=None):
+    """Dice qué leería consultar_almacen, sin leer los datos.
+
+    Devuelve un diccionario con los archivos y grupos de filas que se leerían y sus
+    bytes en disco, frente al total del almacén, y una 'firma' que cambia si cambian
+    los archivos consultados (sirve para identificar el resultado en las cachés).
+    """
+    dataset = _dataset(directorio)
+    expresion = expresion_filtros(filtros_seleccionados, fechas)
+    todos = list(dataset.get_fragments())
+    elegidos = list(dataset.get_fragments(filter=expresion)) if expresion is not None else todos
+
+    plan = {'archivos': len(elegidos), 'archivos_total': len(todos), 'grupos': 0, 'bytes': 0,
+            'bytes_total': sum(os.path.getsize(f.path) for f in todos), 'firma': []}
+    for fragmento in elegidos:
+        info = os.stat(fragmento.path)
+        plan['firma'].append((fragmento.path, info.st_size, info.st_mtime_ns))
+        grupos = fragmento.split_by_row_group(expresion, schema=dataset.schema) if expresion is not None else [fragmento]
+        metadatos = fragmento.metadata
+        for grupo in grupos:
+            for id_grupo in (g.id for g in grupo.row_groups):
+                plan['grupos'] += 1
+                fila = metadatos.row_group(id_grupo)
+                plan['bytes'] += sum(fila.column(i).total_compressed_size for i in range(fila.num_columns))
+    plan['firma'] = repr(sorted(plan['firma']))
+    return plan
+
+def estaciones_almacen(directorio=None):
+    """Estaciones que tiene el almacén, leídas de los nombres de las particiones."""
+    if not os.path.isdir(_directorio(directorio)):
+        return []
+    dataset = _dataset(directorio)
+    estaciones = set()
+    for fragmento in dataset.get_fragments():
+        valores = ds.get_partition_keys(fragmento.partition_expression)
+        if valores.get('ID_ESTACION') is not None:
+            estaciones.add(valores['ID_ESTACION'])
+    return sorted(estaciones)
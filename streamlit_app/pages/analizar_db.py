@@ -7,6 +7,7 @@ import streamlit as st
 import pandas as pd
 import sys
 import os
+import uuid
 
 # Agregar path
 current_path = os.path.dirname(os.path.abspath(__file__))
@@ -14,13 +15,34 @@ parent_path = os.path.dirname(os.path.dirname(current_path))
 sys.path.append(parent_path)
 
 from streamlit_app.utils_streamlit import (
-    cargar_archivo_db,
+    calcular_hash_archivos,
+    cargar_archivos_db,
+    calcular_hash_anexo,
+    anexar_archivos_db,
+    obtener_indice_registros,
+    guardar_en_almacen,
+    obtener_estaciones_almacen,
+    cargar_desde_almacen,
     obtener_filtros_disponibles,
-    aplicar_filtros_seleccionados,
-    exportar_a_excel,
-    exportar_grafico_html,
-    exportar_grafico_png,
-    crear_zip_completo
+    obtener_indice_filtros,
+    obtener_facetas,
+    contar_opciones_filtros,
+    actualizar_filtros_disponibles,
+    actualizar_indice_filtros,
+    actualizar_facetas,
+    guardar_en_sesion,
+    obtener_de_sesion,
+    uso_memoria_sesion,
+    aplicar_filtros_con_cache,
+    actualizar_analisis_con_cache,
+    estadisticas_cache_resultados,
+    huella_analisis,
+    obtener_artefacto,
+    artefacto_en_cache,
+    perfilar_ejecucion,
+    perfil_a_json,
+    columnas_visibles,
+    exportar_grafico_png
 )
 
 
@@ -54,20 +76,258 @@ def safe_download_button(**kwargs):
         return None
 
 
+# Claves de session_state de cada filtro por valor: (casilla "Todos", multiselect)
+CLAVES_FILTROS = {
+    'FECHA': ('fechas', 'fechas_seleccion'),
+    'DIGITADOR': ('digitadores', 'digitadores_seleccion'),
+    'MOVIMIENTOS': ('movimientos', 'movimientos_seleccion'),
+    'ID_ESTACION': ('estaciones', 'estaciones_seleccion'),
+    'TIPO': ('tipos', 'tipos_seleccion'),
+    'INTERSECCION': ('intersecciones', 'intersecciones_seleccion'),
+}
+
+# Claves del resultado del análisis guardado en la sesión, en el orden de aplicar_filtros_con_cache
+CLAVES_RESULTADO = ('df_filtrado', 'df_suma_hora', 'df_rango_hora', 'graficos', 'hora_pico')
+
+
+def seleccion_en_sesion():
+    """Lee de session_state la selección actual de cada filtro (None si está marcado "Todos")."""
+    seleccion = {}
+    for columna, (clave_todos, clave_seleccion) in CLAVES_FILTROS.items():
+        if st.session_state.get(clave_todos, True):
+            seleccion[columna] = None
+        else:
+            seleccion[columna] = st.session_state.get(clave_seleccion, [])
+    return seleccion
+
+
+def opciones_en_cascada(facetas):
+    """Cuenta las opciones válidas de cada filtro y quita de la selección las que ya no tienen filas.
+
+    Se ejecuta antes de dibujar los filtros, así las opciones de cada uno dependen
+    de lo elegido en los demás. Quitar una opción puede dejar sin filas a otras,
+    por eso se repite hasta que la selección no cambie.
+    """
+    if facetas is None:
+        return {}
+    while True:
+        seleccion = seleccion_en_sesion()
+        conteos = contar_opciones_filtros(facetas, seleccion)
+        cambio = False
+        for columna, (_, clave_seleccion) in CLAVES_FILTROS.items():
+            elegidas = seleccion[columna]
+            if not elegidas or columna not in conteos:
+                continue
+            validas = [opcion for opcion in elegidas if opcion in conteos[columna]]
+            if len(validas) != len(elegidas):
+                st.session_state[clave_seleccion] = validas
+                cambio = True
+        if not cambio:
+            return conteos
+
+
+def multiselect_filtro(columna, etiqueta, texto_todos, opciones, conteos):
+    """Muestra la casilla "Todos" y el multiselect de un filtro, con las filas de cada opción.
+
+    Solo se ofrecen las opciones que tienen filas con lo elegido en los demás filtros.
+    Devuelve los valores seleccionados (todas las opciones si está marcado "Todos").
+    """
+    clave_todos, clave_seleccion = CLAVES_FILTROS[columna]
+    if st.checkbox(texto_todos, value=True, key=clave_todos):
+        return opciones
+
+    filas = conteos.get(columna)
+    if filas is not None:
+        opciones = [opcion for opcion in opciones if opcion in filas]
+    return st.multiselect(
+        etiqueta,
+        options=opciones,
+        format_func=lambda opcion: f"{opcion} ({filas[opcion]:,} filas)" if filas else str(opcion),
+        key=clave_seleccion,
+        label_visibility="collapsed",
+        placeholder="Selecciona opciones"
+    )
+
+
+def mostrar_uso_memoria(id_sesion):
+    """Muestra en la barra lateral la memoria que usan los datos de la sesión."""
+    uso = uso_memoria_sesion(id_sesion)
+    mb = 1024 ** 2
+    with st.sidebar:
+        st.markdown("**Memoria de la sesión**")
+        st.progress(min(uso['memoria'] / uso['max_sesion'], 1.0))
+        st.caption(
+            f"{uso['memoria'] / mb:.1f} MB en memoria de {uso['max_sesion'] / mb:.0f} MB"
+            f" · {uso['disco'] / mb:.1f} MB en disco"
+        )
+        st.caption(
+            f"Servidor: {uso['memoria_global'] / mb:.1f} MB de {uso['max_global'] / mb:.0f} MB"
+            f" ({uso['sesiones']} sesiones, {uso['caches'] / mb:.1f} MB en cachés compartidas)"
+        )
+
+
+def registrar_datos(id_sesion, df, nombre, archivo_hash, desde_almacen=False):
+    """Deja el conjunto recién cargado como los datos de la sesión, con sus filtros e índices."""
+    guardar_en_sesion(id_sesion, 'df_original', df)
+    guardar_en_sesion(id_sesion, 'resultados', None)
+    st.session_state.archivo_nombre = nombre
+    st.session_state.archivo_hash = archivo_hash
+    # Los datos que vienen del almacén ya están en él: no se ofrece volver a guardarlos
+    st.session_state.datos_del_almacen = desde_almacen
+    
+    # Obtener filtros disponibles
+    guardar_en_sesion(id_sesion, 'filtros_disponibles', obtener_filtros_disponibles(df))
+    
+    # Índice de códigos por fila para filtrar sin recorrer todo el DataFrame
+    guardar_en_sesion(id_sesion, 'indice_filtros', obtener_indice_filtros(df))
+    
+    # Combinaciones de valores de los filtros, para ofrecer solo opciones con filas
+    guardar_en_sesion(id_sesion, 'facetas', obtener_facetas(df))
+    
+    # Hashes de los registros, para agregar archivos sin volver a recorrer el conjunto
+    guardar_en_sesion(id_sesion, 'indice_registros', obtener_indice_registros(df))
+
+
+def consulta_almacen(id_sesion):
+    """Carga del almacén histórico las filas de unas estaciones, fechas y horas, o guarda en él el estudio cargado."""
+    estaciones = obtener_estaciones_almacen()
+    df_actual = obtener_de_sesion(id_sesion, 'df_original')
+    
+    puede_guardar = df_actual is not None and not st.session_state.get('datos_del_almacen', False)
+    if puede_guardar and st.button("Guardar el estudio cargado en el almacén", use_container_width=True):
+        with st.spinner('Guardando en el almacén...'):
+            filas = guardar_en_almacen(df_actual, st.session_state.archivo_hash)
+        st.success(f"✅ Filas guardadas en el almacén: **{filas:,}**")
+        estaciones = obtener_estaciones_almacen()
+    
+    if not estaciones:
+        st.caption("El almacén está vacío: carga un estudio y guárdalo para consultarlo después")
+        return
+    
+    horas = [f"{m // 60:02d}:{m % 60:02d}:00" for m in range(0, 24 * 60, 15)]
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        estaciones_almacen = st.multiselect("Estaciones:", estaciones, key='almacen_estaciones')
+    with col2:
+        desde = st.date_input("Desde:", value=None, key='almacen_desde')
+        hasta = st.date_input("Hasta:", value=None, key='almacen_hasta')
+    with col3:
+        hora_inicio = st.selectbox("Hora de inicio:", ['Todas'] + horas, key='almacen_hora_inicio')
+        hora_fin = st.selectbox("Hora de fin:", ['Todas'] + horas, key='almacen_hora_fin')
+    
+    if not st.button("Cargar desde el almacén", use_container_width=True):
+        return
+    
+    filtros_almacen = {
+        'ID_ESTACION': estaciones_almacen,
+        'HORA_I': None if hora_inicio == 'Todas' else hora_inicio,
+        'HORA_F': None if hora_fin == 'Todas' else hora_fin,
+    }
+    with st.spinner('Consultando el almacén...'):
+        df, plan, consulta_hash = cargar_desde_almacen(filtros_almacen, (desde, hasta))
+    if df.empty:
+        st.warning("⚠️ El almacén no tiene filas con esa consulta")
+        return
+    
+    registrar_datos(id_sesion, df, "almacen_historico", consulta_hash, desde_almacen=True)
+    st.success(f"✅ Filas cargadas del almacén: **{len(df):,}**")
+    st.caption(
+        f"Leídos {plan['archivos']} de {plan['archivos_total']} archivos, {plan['grupos']} grupos de filas "
+        f"({plan['bytes'] / 1024 ** 2:.1f} MB de {plan['bytes_total'] / 1024 ** 2:.1f} MB)"
+    )
+
+
+def boton_descarga_diferida(resultados, artefacto, label, file_name, mime):
+    """Muestra el botón de descarga de un archivo del análisis.
+
+    El archivo solo se genera cuando el usuario lo pide; después queda en caché
+    para el mismo análisis y los siguientes reruns muestran directamente la descarga.
+    """
+    nombre_archivo = st.session_state.archivo_nombre
+    datos = artefacto_en_cache(resultados, artefacto, nombre_archivo)
+
+    if datos is None:
+        if not st.button(f"Preparar {label}", key=f"preparar_{artefacto}", use_container_width=True):
+            return None
+        with st.spinner(f'Generando {label}...'):
+            datos = obtener_artefacto(resultados, artefacto, nombre_archivo)
+
+    return safe_download_button(
+        label=label,
+        data=datos,
+        file_name=file_name,
+        mime=mime,
+        use_container_width=True
+    )
+
+
+def mostrar_perfil(etapas):
+    """Muestra el tiempo, las filas y la memoria de cada etapa de la última ejecución."""
+    with st.expander("Perfil de etapas", expanded=False):
+        if not etapas:
+            st.caption("Esta ejecución no pasó por ninguna etapa del análisis.")
+            return
+        mb = 1024 ** 2
+        tabla = pd.DataFrame({
+            'Etapa': ["\u2003" * e['nivel'] + e['etapa'] + (" (caché)" if e.get('cache') else "") for e in etapas],
+            'Segundos': [e['segundos'] for e in etapas],
+            'Filas entrada': [e['filas_entrada'] for e in etapas],
+            'Filas salida': [e['filas_salida'] for e in etapas],
+            'Memoria pico (MB)': [None if e['memoria_pico_bytes'] is None else e['memoria_pico_bytes'] / mb
+                                  for e in etapas],
+        })
+        st.dataframe(tabla.astype({'Filas entrada': 'Int64', 'Filas salida': 'Int64'}),
+                     use_container_width=True, hide_index=True)
+        total = sum(e['segundos'] for e in etapas if e['nivel'] == 0)
+        st.caption(f"{total:.3f} s en las etapas de primer nivel")
+        safe_download_button(
+            label="Descargar perfil (JSON)",
+            data=perfil_a_json(etapas),
+            file_name="perfil_etapas.json",
+            mime="application/json",
+            use_container_width=True
+        )
+
 
 def show():
     """Función principal que muestra la página de análisis"""
     
+    # El perfil se mide solo si se pide: sin él, las etapas marcadas no miden nada
+    perfilar = st.sidebar.checkbox(
+        "Perfilar etapas del análisis", key='perfilar',
+        help="Mide el tiempo, las filas y el pico de memoria de cada etapa (el análisis se vuelve más lento)"
+    )
+    if not perfilar:
+        mostrar_analisis()
+        return
+    
+    with perfilar_ejecucion() as etapas:
+        mostrar_analisis()
+    mostrar_perfil(etapas)
+
+
+def mostrar_analisis():
+    """Muestra las secciones de carga, filtros, análisis y resultados"""
+    
     st.header("Análisis de Base de Datos de Aforos")
     st.markdown("---")
     
-    # Inicializar estado de sesión
-    if 'df_original' not in st.session_state:
-        st.session_state.df_original = None
-    if 'filtros_disponibles' not in st.session_state:
-        st.session_state.filtros_disponibles = None
+    # Inicializar estado de sesión. El DataFrame cargado, sus filtros, índices y facetas y los
+    # resultados no se guardan en session_state sino en el gestor de memoria
+    # (guardar_en_sesion / obtener_de_sesion), que los cuenta en el presupuesto de la sesión
+    if 'id_sesion' not in st.session_state:
+        st.session_state.id_sesion = uuid.uuid4().hex
+    id_sesion = st.session_state.id_sesion
     if 'archivo_nombre' not in st.session_state:
         st.session_state.archivo_nombre = None
+    if 'archivo_hash' not in st.session_state:
+        st.session_state.archivo_hash = None
+    # Hash de los archivos del cargador; archivo_hash cambia además al agregar archivos al estudio
+    if 'archivo_hash_carga' not in st.session_state:
+        st.session_state.archivo_hash_carga = None
+    # Hash de cada archivo del cargador por file_id, para no leerlos enteros en cada recarga
+    if 'hashes_archivos' not in st.session_state:
+        st.session_state.hashes_archivos = {}
     
     # ==================== SECCIÓN 1: CARGAR ARCHIVO ====================
     st.subheader("1. Cargar Archivo")
@@ -75,50 +335,127 @@ def show():
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        uploaded_file = st.file_uploader(
-            "Selecciona un archivo Excel o CSV",
+        uploaded_files = st.file_uploader(
+            "Selecciona uno o varios archivos Excel o CSV",
             type=['xlsx', 'csv'],
-            help="Formatos soportados: .xlsx, .csv"
+            accept_multiple_files=True,
+            help="Formatos soportados: .xlsx, .csv. Varios archivos de un mismo estudio se unen en uno solo"
         )
     
     with col2:
         if st.session_state.archivo_nombre:
             st.info(f"**Archivo cargado:**\n{st.session_state.archivo_nombre}")
             if st.button("Borrar archivo", use_container_width=True):
-                st.session_state.df_original = None
-                st.session_state.filtros_disponibles = None
+                guardar_en_sesion(id_sesion, 'df_original', None)
+                guardar_en_sesion(id_sesion, 'resultados', None)
+                for clave in ('filtros_disponibles', 'indice_filtros', 'facetas', 'indice_registros'):
+                    guardar_en_sesion(id_sesion, clave, None)
                 st.session_state.archivo_nombre = None
+                st.session_state.archivo_hash = None
+                st.session_state.archivo_hash_carga = None
                 st.rerun()
     
-    # Procesar archivo si se cargó uno nuevo
-    if uploaded_file is not None:
-        if st.session_state.archivo_nombre != uploaded_file.name:
+    # Procesar los archivos si se cargaron nuevos
+    if uploaded_files:
+        # Los archivos son nuevos si su contenido cambió, no solo su nombre
+        archivo_hash = calcular_hash_archivos(uploaded_files, st.session_state.hashes_archivos)
+        # (o si sus datos ya no están, por ejemplo porque la sesión estuvo inactiva mucho tiempo)
+        if st.session_state.archivo_hash_carga != archivo_hash or obtener_de_sesion(id_sesion, 'df_original') is None:
             try:
-                with st.spinner('Cargando archivo...'):
-                    df = cargar_archivo_db(uploaded_file)
-                    st.session_state.df_original = df
-                    st.session_state.archivo_nombre = uploaded_file.name
-                    
-                    # Obtener filtros disponibles
-                    filtros = obtener_filtros_disponibles(df)
-                    st.session_state.filtros_disponibles = filtros
+                with st.spinner('Cargando archivos...' if len(uploaded_files) > 1 else 'Cargando archivo...'):
+                    df, duplicados = cargar_archivos_db(uploaded_files, archivo_hash, st.session_state.hashes_archivos)
+                    if len(uploaded_files) == 1:
+                        nombre = uploaded_files[0].name
+                    else:
+                        nombre = f"{len(uploaded_files)} archivos"
+                    registrar_datos(id_sesion, df, nombre, archivo_hash)
+                    st.session_state.archivo_hash_carga = archivo_hash
                     
-                    st.success(f"✅ Archivo cargado exitosamente: {uploaded_file.name}")
+                    st.success(f"✅ Archivo cargado exitosamente: {st.session_state.archivo_nombre}")
                     st.info(f"Total de filas: **{len(df):,}**")
+                    if duplicados:
+                        st.info(f"Registros repetidos entre archivos que se quitaron: **{duplicados:,}**")
                     
             except Exception as e:
                 st.error(f"❌ Error al cargar el archivo: {str(e)}")
+                mostrar_uso_memoria(id_sesion)
                 return
     
+    # Consultas al almacén histórico (particionado por año, mes y estación)
+    with st.expander("Almacén histórico", expanded=False):
+        try:
+            consulta_almacen(id_sesion)
+        except Exception as e:
+            st.error(f"❌ {str(e)}")
+    
     # Si no hay archivo cargado, mostrar mensaje y detener
-    if st.session_state.df_original is None:
+    df_original = obtener_de_sesion(id_sesion, 'df_original')
+    if df_original is None:
+        mostrar_uso_memoria(id_sesion)
         st.warning("Por favor, carga un archivo para continuar")
         return
     
+    # Agregar filas nuevas (por ejemplo, un día más de conteos) sin volver a procesar todo el estudio
+    with st.expander("Agregar archivos al estudio", expanded=False):
+        archivos_anexo = st.file_uploader(
+            "Archivos con registros nuevos del mismo estudio",
+            type=['xlsx', 'csv'],
+            accept_multiple_files=True,
+            key='archivos_anexo',
+            help="Los registros que ya estaban cargados (mismo ID, FOLIO, FECHA y HORA_I) no se repiten"
+        )
+        if archivos_anexo and st.button("Agregar al estudio", use_container_width=True):
+            try:
+                with st.spinner('Agregando archivos...'):
+                    df_original, nuevas, duplicados, registros = anexar_archivos_db(
+                        df_original, archivos_anexo, obtener_de_sesion(id_sesion, 'indice_registros')
+                    )
+                    if not nuevas.empty:
+                        archivo_hash = calcular_hash_anexo(
+                            st.session_state.archivo_hash, calcular_hash_archivos(archivos_anexo)
+                        )
+                        
+                        # Actualizar el análisis mostrado con solo las filas nuevas
+                        resultados = obtener_de_sesion(id_sesion, 'resultados')
+                        if resultados is not None and 'filtros' in resultados:
+                            actualizado = actualizar_analisis_con_cache(
+                                tuple(resultados[clave] for clave in CLAVES_RESULTADO),
+                                nuevas,
+                                resultados['filtros'],
+                                archivo_hash
+                            )
+                            resultados = dict(zip(CLAVES_RESULTADO, actualizado),
+                                              filtros=resultados['filtros'],
+                                              huella=huella_analisis(archivo_hash, resultados['filtros']))
+                        else:
+                            resultados = None
+                        
+                        guardar_en_sesion(id_sesion, 'df_original', df_original)
+                        guardar_en_sesion(id_sesion, 'indice_registros', registros)
+                        guardar_en_sesion(id_sesion, 'resultados', resultados)
+                        st.session_state.archivo_hash = archivo_hash
+                        guardar_en_sesion(id_sesion, 'filtros_disponibles', actualizar_filtros_disponibles(
+                            obtener_de_sesion(id_sesion, 'filtros_disponibles'), nuevas
+                        ))
+                        guardar_en_sesion(id_sesion, 'indice_filtros', actualizar_indice_filtros(
+                            obtener_de_sesion(id_sesion, 'indice_filtros'), nuevas
+                        ))
+                        guardar_en_sesion(id_sesion, 'facetas', actualizar_facetas(
+                            obtener_de_sesion(id_sesion, 'facetas'), nuevas
+                        ))
+                    
+                    st.success(f"✅ Filas agregadas: **{len(nuevas):,}** (total: {len(df_original):,})")
+                    if duplicados:
+                        st.info(f"Registros que ya estaban cargados y no se agregaron: **{duplicados:,}**")
+            except Exception as e:
+                st.error(f"❌ Error al agregar los archivos: {str(e)}")
+    
 
     
     st.markdown("---")
     
+    filtros = obtener_de_sesion(id_sesion, 'filtros_disponibles')
+    
     # ==================== SECCIÓN 2: VISTA PREVIA DE DATOS ====================
     st.subheader("2. Vista Previa de Datos")
     
@@ -126,17 +463,17 @@ def show():
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("Total de Filas", f"{len(st.session_state.df_original):,}")
+            st.metric("Total de Filas", f"{len(df_original):,}")
         
         with col2:
-            st.metric("Total de Columnas", len(st.session_state.df_original.columns))
+            st.metric("Total de Columnas", len(columnas_visibles(df_original).columns))
         
         with col3:
-            fechas_unicas = len(st.session_state.filtros_disponibles.get('FECHA', []))
+            fechas_unicas = len(filtros.get('FECHA', []))
             st.metric("Fechas Únicas", fechas_unicas)
         
         st.dataframe(
-            st.session_state.df_original.head(10),
+            columnas_visibles(df_original.head(10)),
             use_container_width=True,
             height=300
         )
@@ -146,7 +483,8 @@ def show():
     # ==================== SECCIÓN 3: FILTROS ====================
     st.subheader("3. Seleccionar Filtros")
     
-    filtros = st.session_state.filtros_disponibles
+    # Opciones que siguen siendo válidas con lo elegido en los demás filtros, y sus filas
+    conteos = opciones_en_cascada(obtener_de_sesion(id_sesion, 'facetas'))
     
     # Crear tabs para organizar los filtros
     tab1, tab2 = st.tabs(["Filtros Temporales", "Filtros de Categoría"])
@@ -177,19 +515,11 @@ def show():
                     fecha_map[key] = f
                     fechas_display.append(key)
 
-                seleccionar_todas_fechas = st.checkbox("Seleccionar todas las fechas", value=True)
-                if seleccionar_todas_fechas:
-                    # Use raw fecha objects for processing
-                    fechas_seleccionadas = fechas_opciones
-                else:
-                    seleccion_display = st.multiselect(
-                        "Selecciona fechas:",
-                        options=fechas_display,
-                        default=[],
-                        label_visibility="collapsed",
-                    )
-                    # Map back to original objects
-                    fechas_seleccionadas = [fecha_map[s] for s in seleccion_display]
+                seleccion_display = multiselect_filtro(
+                    'FECHA', "Selecciona fechas:", "Seleccionar todas las fechas", fechas_display, conteos
+                )
+                # Volver a los valores originales
+                fechas_seleccionadas = [fecha_map[s] for s in seleccion_display]
             else:
                 fechas_seleccionadas = []
                 st.warning("No hay fechas disponibles")
@@ -231,17 +561,9 @@ def show():
             digitadores = filtros.get('DIGITADOR', [])
             digitadores_str = [str(d) for d in digitadores]
             if digitadores_str:
-                seleccionar_todos_digitadores = st.checkbox("Todos", value=True, key="digitadores")
-                if seleccionar_todos_digitadores:
-                    digitadores_seleccionados = digitadores_str
-                else:
-                    digitadores_seleccionados = st.multiselect(
-                        "Digitadores:",
-                        options=digitadores_str,
-                        default=[],
-                        label_visibility="collapsed",
-                        placeholder="Selecciona opciones"
-                    )
+                digitadores_seleccionados = multiselect_filtro(
+                    'DIGITADOR', "Digitadores:", "Todos", digitadores_str, conteos
+                )
             else:
                 digitadores_seleccionados = []
         
@@ -250,17 +572,9 @@ def show():
             movimientos = filtros.get('MOVIMIENTOS', [])
             movimientos_str = [str(m) for m in movimientos]
             if movimientos_str:
-                seleccionar_todos_movimientos = st.checkbox("Todos", value=True, key="movimientos")
-                if seleccionar_todos_movimientos:
-                    movimientos_seleccionados = movimientos_str
-                else:
-                    movimientos_seleccionados = st.multiselect(
-                        "Movimientos:",
-                        options=movimientos_str,
-                        default=[],
-                        label_visibility="collapsed",
-                        placeholder="Selecciona opciones"
-                    )
+                movimientos_seleccionados = multiselect_filtro(
+                    'MOVIMIENTOS', "Movimientos:", "Todos", movimientos_str, conteos
+                )
             else:
                 movimientos_seleccionados = []
         
@@ -269,17 +583,9 @@ def show():
             id_estaciones = filtros.get('ID_ESTACION', [])
             id_estaciones_str = [str(i) for i in id_estaciones]
             if id_estaciones_str:
-                seleccionar_todas_estaciones = st.checkbox("Todas", value=True, key="estaciones")
-                if seleccionar_todas_estaciones:
-                    estaciones_seleccionadas = id_estaciones_str
-                else:
-                    estaciones_seleccionadas = st.multiselect(
-                        "Estaciones:",
-                        options=id_estaciones_str,
-                        default=[],
-                        label_visibility="collapsed",
-                        placeholder="Selecciona opciones"
-                    )
+                estaciones_seleccionadas = multiselect_filtro(
+                    'ID_ESTACION', "Estaciones:", "Todas", id_estaciones_str, conteos
+                )
             else:
                 estaciones_seleccionadas = []
         
@@ -288,17 +594,9 @@ def show():
             tipos = filtros.get('TIPO', [])
             tipos_str = [str(t) for t in tipos]
             if tipos_str:
-                seleccionar_todos_tipos = st.checkbox("Todos", value=True, key="tipos")
-                if seleccionar_todos_tipos:
-                    tipos_seleccionados = tipos_str
-                else:
-                    tipos_seleccionados = st.multiselect(
-                        "Tipos:",
-                        options=tipos_str,
-                        default=[],
-                        label_visibility="collapsed",
-                        placeholder="Selecciona opciones"
-                    )
+                tipos_seleccionados = multiselect_filtro(
+                    'TIPO', "Tipos:", "Todos", tipos_str, conteos
+                )
             else:
                 tipos_seleccionados = []
         
@@ -307,17 +605,9 @@ def show():
         intersecciones = filtros.get('INTERSECCION', [])
         intersecciones_str = [str(i) for i in intersecciones]
         if intersecciones_str:
-            seleccionar_todas_intersecciones = st.checkbox("Todas", value=True, key="intersecciones")
-            if seleccionar_todas_intersecciones:
-                intersecciones_seleccionadas = intersecciones_str
-            else:
-                intersecciones_seleccionadas = st.multiselect(
-                    "Intersecciones:",
-                    options=intersecciones_str,
-                    default=[],
-                    label_visibility="collapsed",
-                    placeholder="Selecciona opciones"
-                )
+            intersecciones_seleccionadas = multiselect_filtro(
+                'INTERSECCION', "Intersecciones:", "Todas", intersecciones_str, conteos
+            )
         else:
             intersecciones_seleccionadas = []
     
@@ -351,36 +641,49 @@ def show():
         
         try:
             with st.spinner('🔄 Aplicando filtros y generando análisis...'):
-                df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico = aplicar_filtros_seleccionados(
-                    st.session_state.df_original.copy(),
-                    filtros_seleccionados
+                # Sin copia: el análisis no modifica el DataFrame de la sesión (Copy-on-Write)
+                df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico = aplicar_filtros_con_cache(
+                    df_original,
+                    filtros_seleccionados,
+                    st.session_state.archivo_hash,
+                    obtener_de_sesion(id_sesion, 'indice_filtros')
                 )
             
             st.success("✅ Análisis completado exitosamente!")
+            estadisticas = estadisticas_cache_resultados()
+            st.caption(
+                f"Caché de análisis: {estadisticas['aciertos']} aciertos, {estadisticas['fallos']} fallos, "
+                f"{estadisticas['entradas']} resultados ({estadisticas['bytes'] / 1024 ** 2:.1f} MB)"
+            )
             
-            # Guardar resultados en session_state
-            st.session_state.resultados = {
+            # Guardar resultados en la sesión (bajo su presupuesto de memoria)
+            guardar_en_sesion(id_sesion, 'resultados', {
                 'df_filtrado': df_filtrado,
                 'df_suma_hora': df_suma_hora,
                 'df_rango_hora': df_rango_hora,
                 'graficos': graficos,
-                'hora_pico': hora_pico
-            }
+                'hora_pico': hora_pico,
+                'filtros': filtros_seleccionados,
+                'huella': huella_analisis(st.session_state.archivo_hash, filtros_seleccionados)
+            })
             
         except ValueError as e:
             st.warning(f"⚠️ {str(e)}")
+            mostrar_uso_memoria(id_sesion)
             return
         except Exception as e:
             st.error(f"❌ Error durante el análisis: {str(e)}")
+            mostrar_uso_memoria(id_sesion)
             return
     
+    mostrar_uso_memoria(id_sesion)
+    
     # ==================== SECCIÓN 5: RESULTADOS ====================
-    if 'resultados' in st.session_state:
+    resultados = obtener_de_sesion(id_sesion, 'resultados')
+    if resultados is not None:
         st.markdown("---")
         st.subheader("5. Resultados del Análisis")
         
-        resultados = st.session_state.resultados
-        
         # Mostrar hora pico destacada
         st.info(f"**{resultados['hora_pico']}**")
         
@@ -407,7 +710,7 @@ def show():
         with tab2:
             st.markdown("### Datos Filtrados")
             st.dataframe(
-                resultados['df_filtrado'],
+                columnas_visibles(resultados['df_filtrado']),
                 use_container_width=True,
                 height=400
             )
@@ -444,27 +747,19 @@ def show():
             
             nombre_archivo_zip = f"Analisis-{st.session_state.archivo_nombre.replace('.xlsx', '').replace('.csv', '')}.zip"
             
-            zip_completo = crear_zip_completo(
-                resultados['df_filtrado'],
-                resultados['df_suma_hora'],
-                resultados['df_rango_hora'],
-                resultados['graficos'],
-                resultados['hora_pico'],
-                st.session_state.archivo_nombre
-            )
-            
-            safe_download_button(
+            boton_descarga_diferida(
+                resultados,
+                'zip',
                 label="DESCARGAR TODO (ZIP)",
-                data=zip_completo,
                 file_name=nombre_archivo_zip,
-                mime="application/zip",
-                use_container_width=True
+                mime="application/zip"
             )
             
             st.markdown("**Contenido del ZIP:**")
             st.markdown("""
             - 3 archivos Excel (datos filtrados, suma 15min, rango hora)
-            - 3 gráficos interactivos HTML (hora pico, barras apiladas, composición)
+            - 3 gráficos interactivos HTML (hora pico, barras apiladas, composición), que se abren sin internet
+            - plotly.min.js, la librería que usan los gráficos
             - Archivo TXT con hora pico
             - Archivo LEEME.txt con instrucciones
             """)
@@ -477,35 +772,41 @@ def show():
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                excel_filtrado = exportar_a_excel(resultados['df_filtrado'], "datos_filtrados")
-                safe_download_button(
+                boton_descarga_diferida(
+                    resultados,
+                    'excel_filtrado',
                     label="Datos Filtrados",
-                    data=excel_filtrado,
                     file_name="datos_filtrados.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
             
             with col2:
-                excel_suma = exportar_a_excel(resultados['df_suma_hora'], "suma_15min")
-                safe_download_button(
+                boton_descarga_diferida(
+                    resultados,
+                    'excel_suma',
                     label="Suma 15 min",
-                    data=excel_suma,
                     file_name="suma_15min.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
             
             with col3:
-                excel_rango = exportar_a_excel(resultados['df_rango_hora'], "rango_hora")
-                safe_download_button(
+                boton_descarga_diferida(
+                    resultados,
+                    'excel_rango',
                     label="Rango Hora",
-                    data=excel_rango,
                     file_name="rango_hora.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
             
+            # Las tres tablas en un solo libro, una por hoja
+            boton_descarga_diferida(
+                resultados,
+                'excel_tablas',
+                label="Las tres tablas en un solo Excel",
+                file_name="tablas_analisis.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+            
             st.markdown("---")
             
             # Sección 3: Descargar Gráficos (HTML)
@@ -515,33 +816,30 @@ def show():
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                html_barras = exportar_grafico_html(resultados['graficos']['barras'])
-                safe_download_button(
+                boton_descarga_diferida(
+                    resultados,
+                    'html_barras',
                     label="Hora Pico (HTML)",
-                    data=html_barras,
                     file_name="grafico_hora_pico.html",
-                    mime="text/html",
-                    use_container_width=True
+                    mime="text/html"
                 )
             
             with col2:
-                html_apiladas = exportar_grafico_html(resultados['graficos']['barras_apiladas'])
-                safe_download_button(
+                boton_descarga_diferida(
+                    resultados,
+                    'html_barras_apiladas',
                     label="Barras Apiladas (HTML)",
-                    data=html_apiladas,
                     file_name="grafico_barras_apiladas.html",
-                    mime="text/html",
-                    use_container_width=True
+                    mime="text/html"
                 )
             
             with col3:
-                html_torta = exportar_grafico_html(resultados['graficos']['torta'])
-                safe_download_button(
+                boton_descarga_diferida(
+                    resultados,
+                    'html_torta',
                     label="Composición (HTML)",
-                    data=html_torta,
                     file_name="grafico_composicion.html",
-                    mime="text/html",
-                    use_container_width=True
+                    mime="text/html"
                 )
             
             st.markdown("---")
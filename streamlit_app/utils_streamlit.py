@@ -3,6 +3,11 @@ Funciones adaptadoras para usar la lógica existente con Streamlit
 Este archivo hace de puente entre Streamlit y el código original
 """
 
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 import sys
 import os
@@ -12,35 +17,325 @@ current_path = os.path.dirname(os.path.abspath(__file__))
 parent_path = os.path.dirname(current_path)
 sys.path.append(parent_path)
 
+from conteo import analyzer
 from conteo import database_reader
 from conteo import data_filter
-from conteo import df_generator
-from conteo import graph_generator
 from conteo import config
+from conteo import exporter
+from conteo import file_cache
+from conteo import profiler
+from conteo import session_memory
+from conteo import warehouse
+from conteo.exporter import (
+    ARTEFACTOS,
+    exportar_a_excel,
+    exportar_grafico_html,
+    exportar_grafico_png
+)
+
+
+def _nueva_cache_lru(nombre):
+    """Crea una caché LRU en memoria limitada por bytes, segura entre hilos"""
+    return {'nombre': nombre, 'entradas': OrderedDict(), 'bytes': 0, 'aciertos': 0, 'fallos': 0,
+            'lock': threading.Lock()}
+
+
+def _cache_lru_obtener(cache, clave, contar=True):
+    """Devuelve el valor guardado para la clave (o None) y lo marca como usado"""
+    with cache['lock']:
+        if clave in cache['entradas']:
+            cache['entradas'].move_to_end(clave)
+            if contar:
+                cache['aciertos'] += 1
+            return cache['entradas'][clave][0]
+        if contar:
+            cache['fallos'] += 1
+        return None
+
+
+def _cache_lru_guardar(cache, clave, valor, tamano, max_bytes):
+    """Guarda un valor y expulsa los usados hace más tiempo hasta quedar bajo el límite
+
+    Los bytes de la caché se informan al gestor de memoria de las sesiones, que los
+    cuenta en el presupuesto de todo el servidor.
+    """
+    with cache['lock']:
+        if tamano > max_bytes or clave in cache['entradas']:
+            return
+        cache['entradas'][clave] = (valor, tamano)
+        cache['bytes'] += tamano
+        while cache['bytes'] > max_bytes:
+            _, (_, tamano_expulsado) = cache['entradas'].popitem(last=False)
+            cache['bytes'] -= tamano_expulsado
+        total = cache['bytes']
+    session_memory.registrar_uso_externo(cache['nombre'], total)
+
+
+# Cachés compartidas por todas las sesiones: resultados de análisis y archivos de descarga
+_cache_resultados = _nueva_cache_lru('resultados')
+_cache_artefactos = _nueva_cache_lru('artefactos')
+
+
+def calcular_hash_archivo(uploaded_file, conocidos=None):
+    """
+    Calcula el hash del contenido de un archivo cargado en Streamlit
+    
+    Streamlit le da a cada archivo subido un file_id propio (volver a subirlo da
+    otro), así que con `conocidos` el contenido se lee una sola vez por archivo y
+    no en cada recarga de la página.
+    
+    Args:
+        uploaded_file: Objeto UploadedFile de Streamlit
+        conocidos: Diccionario {file_id: hash} que se consulta y se completa (opcional)
+        
+    Returns:
+        String hexadecimal que identifica el contenido del archivo
+    """
+    if conocidos is None:
+        return file_cache.calcular_hash(uploaded_file.getvalue())
+    if uploaded_file.file_id not in conocidos:
+        conocidos[uploaded_file.file_id] = file_cache.calcular_hash(uploaded_file.getvalue())
+    return conocidos[uploaded_file.file_id]
 
 
-def cargar_archivo_db(uploaded_file):
+def cargar_archivo_db(uploaded_file, archivo_hash=None):
     """
     Carga un archivo Excel o CSV desde Streamlit
     
+    Si el mismo contenido ya se cargó antes, se lee desde la caché en Parquet
+    en lugar de volver a procesar el archivo original. Los Excel se leen en modo
+    de solo lectura conservando solo config.lista_columnas. Los CSV más grandes que
+    config.csv_umbral_agregado_bytes se leen por bloques y quedan sumados por
+    combinación de filtros (ver database_reader.leer_csv_agregado).
+    
     Args:
         uploaded_file: Objeto UploadedFile de Streamlit
+        archivo_hash: Hash del contenido (opcional, se calcula si no se entrega)
         
     Returns:
         DataFrame con los datos cargados
     """
     try:
-        if uploaded_file.name.endswith('.xlsx'):
-            df = pd.read_excel(uploaded_file)
-        elif uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:
-            raise ValueError("Formato de archivo no soportado")
+        if archivo_hash is None:
+            archivo_hash = calcular_hash_archivo(uploaded_file)
+        
+        with profiler.etapa('lectura desde caché') as e:
+            df = file_cache.leer_cache(archivo_hash)
+            if df is not None:
+                df = database_reader.aplicar_esquema(df)
+                e.salida(len(df))
+        if df is not None:
+            return df
+        
+        with profiler.etapa(f"lectura {uploaded_file.name}") as e:
+            if uploaded_file.name.endswith('.xlsx'):
+                # Lectura en streaming de solo las columnas que usa el análisis
+                df = database_reader.leer_xlsx_columnas(io.BytesIO(uploaded_file.getvalue()))
+            elif uploaded_file.name.endswith('.csv'):
+                if uploaded_file.size > config.csv_umbral_agregado_bytes:
+                    # CSV muy grande: leer por bloques y sumar por combinación de filtros
+                    df = database_reader.leer_csv_agregado(io.BytesIO(uploaded_file.getvalue()))
+                else:
+                    df = pd.read_csv(io.BytesIO(uploaded_file.getvalue()))
+            else:
+                raise ValueError("Formato de archivo no soportado")
+            e.salida(len(df))
+        
+        # Aplicar el esquema compacto una sola vez, antes de guardarlo en la caché
+        with profiler.etapa('aplicar_esquema', len(df)):
+            df = database_reader.aplicar_esquema(df)
+        with profiler.etapa('guardar en caché', len(df)):
+            file_cache.guardar_cache(archivo_hash, df)
         return df
     except Exception as e:
         raise Exception(f"Error al cargar archivo: {str(e)}")
 
 
+def calcular_hash_archivos(uploaded_files, conocidos=None):
+    """
+    Calcula el hash del contenido de varios archivos cargados juntos
+    
+    Con un solo archivo es el mismo hash de calcular_hash_archivo, así que la
+    caché de un archivo suelto se reutiliza. Con varios no depende del orden en
+    que se seleccionaron.
+    
+    Args:
+        uploaded_files: Lista de objetos UploadedFile de Streamlit
+        conocidos: Diccionario {file_id: hash} del cargador (ver calcular_hash_archivo);
+            se olvidan los archivos que ya no están en la lista
+        
+    Returns:
+        String hexadecimal que identifica el conjunto de archivos
+    """
+    hashes = [calcular_hash_archivo(archivo, conocidos) for archivo in uploaded_files]
+    if conocidos is not None:
+        for file_id in set(conocidos) - {archivo.file_id for archivo in uploaded_files}:
+            del conocidos[file_id]
+    if len(hashes) == 1:
+        return hashes[0]
+    return file_cache.calcular_hash('\n'.join(sorted(hashes)).encode())
+
+
+def cargar_archivos_db(uploaded_files, archivo_hash=None, conocidos=None):
+    """
+    Carga varios archivos Excel o CSV de un mismo estudio como un solo DataFrame
+    
+    Cada archivo usa su propia entrada de la caché en Parquet; los que no están
+    se leen a la vez (los Excel en varios procesos, ver database_reader.leer_archivos).
+    Después se alinean a config.lista_columnas y se quitan los registros repetidos
+    por (ID, FOLIO, FECHA, HORA_I) de los archivos que se solapan.
+    
+    Args:
+        uploaded_files: Lista de objetos UploadedFile de Streamlit
+        archivo_hash: Hash del conjunto (con un solo archivo se usa para su caché)
+        conocidos: Diccionario {file_id: hash} ya calculado (ver calcular_hash_archivo)
+        
+    Returns:
+        Tupla (DataFrame combinado, número de filas repetidas que se quitaron)
+    """
+    try:
+        if len(uploaded_files) == 1:
+            return cargar_archivo_db(uploaded_files[0], archivo_hash), 0
+        
+        hashes = [calcular_hash_archivo(archivo, conocidos) for archivo in uploaded_files]
+        partes = [file_cache.leer_cache(h) for h in hashes]
+        faltantes = [i for i, df in enumerate(partes) if df is None]
+        for archivo in (uploaded_files[i] for i in faltantes):
+            if not archivo.name.endswith(('.xlsx', '.csv')):
+                raise ValueError(f"Formato de archivo no soportado: {archivo.name}")
+        
+        with profiler.etapa(f"lectura de {len(faltantes)} archivos") as e:
+            leidas = database_reader.leer_archivos(
+                [(uploaded_files[i].name, uploaded_files[i].getvalue()) for i in faltantes]
+            )
+            e.salida(sum(len(df) for df in leidas))
+        for i, df in zip(faltantes, leidas):
+            file_cache.guardar_cache(hashes[i], df)
+            partes[i] = df
+        
+        with profiler.etapa('combinar_datos', sum(len(p) for p in partes)) as e:
+            df = database_reader.combinar_datos([database_reader.aplicar_esquema(p) for p in partes])
+            e.salida(len(df))
+        with profiler.etapa('quitar_duplicados', len(df)) as e:
+            df, quitadas = database_reader.quitar_duplicados(df)
+            e.salida(len(df))
+        return df, quitadas
+    except Exception as e:
+        raise Exception(f"Error al cargar archivos: {str(e)}")
+
+
+def calcular_hash_anexo(archivo_hash, anexo_hash):
+    """
+    Calcula el hash de un conjunto de datos después de agregarle archivos
+    
+    Args:
+        archivo_hash: Hash del conjunto cargado
+        anexo_hash: Hash de los archivos agregados (ver calcular_hash_archivos)
+        
+    Returns:
+        String hexadecimal que identifica el conjunto combinado
+    """
+    return file_cache.calcular_hash(f'{archivo_hash}+{anexo_hash}'.encode())
+
+
+def obtener_indice_registros(df):
+    """
+    Construye el índice de hashes de los registros del conjunto cargado
+    
+    Args:
+        df: DataFrame con los datos
+        
+    Returns:
+        Índice para anexar_archivos_db (ver database_reader.indice_registros)
+    """
+    try:
+        with profiler.etapa('índice de registros', len(df)):
+            return database_reader.indice_registros(df)
+    except Exception as e:
+        raise Exception(f"Error al construir índice de registros: {str(e)}")
+
+
+def anexar_archivos_db(df, uploaded_files, registros=None):
+    """
+    Agrega uno o varios archivos (por ejemplo, un día más de conteos) al conjunto cargado
+    
+    Los archivos se cargan igual que en cargar_archivos_db y solo sus filas se
+    comparan contra el índice de registros del conjunto para descartar los que
+    ya estaban.
+    
+    Args:
+        df: DataFrame cargado
+        uploaded_files: Lista de objetos UploadedFile de Streamlit
+        registros: Índice de obtener_indice_registros (o de la llamada anterior);
+            si es None se calcula recorriendo el conjunto
+        
+    Returns:
+        Tupla (DataFrame combinado, filas agregadas, número de filas repetidas que se
+        quitaron, índice de registros del conjunto combinado)
+    """
+    nuevas, duplicados = cargar_archivos_db(uploaded_files)
+    try:
+        df, agregadas, repetidas, registros = database_reader.anexar_datos(df, nuevas, registros=registros)
+        return df, agregadas, duplicados + repetidas, registros
+    except Exception as e:
+        raise Exception(f"Error al agregar archivos: {str(e)}")
+
+
+def guardar_en_almacen(df, archivo_hash=None):
+    """
+    Guarda el conjunto cargado en el almacén histórico (Parquet particionado por año, mes y estación)
+    
+    Args:
+        df: DataFrame cargado
+        archivo_hash: Hash del conjunto; los registros que ya están en el almacén no se duplican
+        
+    Returns:
+        Número de filas guardadas
+    """
+    try:
+        return warehouse.guardar_en_almacen(df, archivo_hash)
+    except Exception as e:
+        raise Exception(f"Error al guardar en el almacén: {str(e)}")
+
+
+def obtener_estaciones_almacen():
+    """
+    Lista las estaciones que tiene el almacén histórico
+    
+    Returns:
+        Lista de ID_ESTACION (vacía si el almacén no existe)
+    """
+    try:
+        return warehouse.estaciones_almacen()
+    except Exception as e:
+        raise Exception(f"Error al leer el almacén: {str(e)}")
+
+
+def cargar_desde_almacen(filtros_seleccionados, fechas=None):
+    """
+    Carga del almacén histórico solo las filas que cumplen los filtros
+    
+    Solo se abren las particiones de los meses y estaciones pedidos y, dentro de
+    ellas, los grupos de filas con las fechas y horas pedidas.
+    
+    Args:
+        filtros_seleccionados: Diccionario de filtros (mismas claves que la página)
+        fechas: Tupla (inicio, fin) de FECHA, inclusive (opcional)
+        
+    Returns:
+        Tupla (DataFrame, plan de lectura de warehouse.plan_consulta, hash de la consulta)
+    """
+    try:
+        plan = warehouse.plan_consulta(filtros_seleccionados, fechas)
+        df = warehouse.consultar_almacen(filtros_seleccionados, fechas)
+    except Exception as e:
+        raise Exception(f"Error al consultar el almacén: {str(e)}")
+    
+    # La consulta y los archivos que leyó identifican el resultado (cambia si el almacén recibe datos)
+    clave = repr((normalizar_filtros(filtros_seleccionados), [str(f) for f in fechas or ()], plan['firma']))
+    return df, plan, file_cache.calcular_hash(clave.encode('utf-8'))
+
+
 def obtener_filtros_disponibles(df):
     """
     Obtiene los filtros disponibles del DataFrame
@@ -52,7 +347,8 @@ def obtener_filtros_disponibles(df):
         Diccionario con las opciones únicas de cada filtro
     """
     try:
-        filtros = data_filter.cargar_filtros(df)
+        with profiler.etapa('catálogo de filtros', len(df)):
+            filtros = data_filter.cargar_filtros(df)
         
         # Convertir fechas a string
         if 'FECHA' in filtros:
@@ -63,162 +359,321 @@ def obtener_filtros_disponibles(df):
         raise Exception(f"Error al cargar filtros: {str(e)}")
 
 
-def aplicar_filtros_seleccionados(df, filtros_seleccionados):
+def actualizar_filtros_disponibles(filtros, nuevas):
     """
-    Aplica los filtros seleccionados al DataFrame
+    Agrega al catálogo de filtros las opciones de unas filas nuevas
     
     Args:
-        df: DataFrame original
-        filtros_seleccionados: Diccionario con los filtros seleccionados
+        filtros: Diccionario de obtener_filtros_disponibles del conjunto cargado
+        nuevas: DataFrame con las filas agregadas
         
     Returns:
-        Tupla con (df_filtrado, df_suma_por_hora, df_rango_hora, graficos)
+        Diccionario con las opciones únicas de cada filtro del conjunto combinado
     """
-    try:
-        # Convertir columnas del DataFrame a string para comparaciones uniformes
-        df['FECHA'] = df['FECHA'].astype(str)
-        df['HORA_I'] = df['HORA_I'].astype(str)
-        df['HORA_F'] = df['HORA_F'].astype(str)
-        df['DIGITADOR'] = df['DIGITADOR'].astype(str)
-        df['MOVIMIENTOS'] = df['MOVIMIENTOS'].astype(str)
-        df['ID_ESTACION'] = df['ID_ESTACION'].astype(str)
-        df['TIPO'] = df['TIPO'].astype(str)
-        df['INTERSECCION'] = df['INTERSECCION'].astype(str)
-
-        # Aplicar filtros
-        df_filtrado = df.copy()
-        
-        # Filtro por fecha
-        if filtros_seleccionados.get('FECHA'):
-            df_filtrado = df_filtrado[df_filtrado['FECHA'].isin(filtros_seleccionados['FECHA'])]
-        
-        # Filtro por hora inicial
-        if filtros_seleccionados.get('HORA_I'):
-            df_filtrado['HORA_I'] = pd.to_datetime(df_filtrado['HORA_I'], format='%H:%M:%S').dt.time
-            hora_i = pd.to_datetime(filtros_seleccionados['HORA_I'], format='%H:%M:%S').time()
-            df_filtrado = df_filtrado[df_filtrado['HORA_I'] >= hora_i]
-        
-        # Filtro por hora final
-        if filtros_seleccionados.get('HORA_F'):
-            df_filtrado['HORA_F'] = pd.to_datetime(df_filtrado['HORA_F'], format='%H:%M:%S').dt.time
-            hora_f = pd.to_datetime(filtros_seleccionados['HORA_F'], format='%H:%M:%S').time()
-            df_filtrado = df_filtrado[df_filtrado['HORA_F'] <= hora_f]
-        
-        # Filtro por digitador
-        if filtros_seleccionados.get('DIGITADOR'):
-            df_filtrado = df_filtrado[df_filtrado['DIGITADOR'].isin(filtros_seleccionados['DIGITADOR'])]
-        
-        # Filtro por movimientos
-        if filtros_seleccionados.get('MOVIMIENTOS'):
-            df_filtrado = df_filtrado[df_filtrado['MOVIMIENTOS'].isin(filtros_seleccionados['MOVIMIENTOS'])]
-        
-        # Filtro por ID estación
-        if filtros_seleccionados.get('ID_ESTACION'):
-            df_filtrado = df_filtrado[df_filtrado['ID_ESTACION'].isin(filtros_seleccionados['ID_ESTACION'])]
-        
-        # Filtro por tipo
-        if filtros_seleccionados.get('TIPO'):
-            df_filtrado = df_filtrado[df_filtrado['TIPO'].isin(filtros_seleccionados['TIPO'])]
-        
-        # Filtro por intersección
-        if filtros_seleccionados.get('INTERSECCION'):
-            df_filtrado = df_filtrado[df_filtrado['INTERSECCION'].isin(filtros_seleccionados['INTERSECCION'])]
-        
-        # Verificar que no esté vacío
-        if df_filtrado.empty:
-            raise ValueError("Los filtros aplicados no devolvieron ningún resultado")
-        
-        # Generar tablas de análisis
-        df_suma_por_hora = df_generator.crear_tabla_rango_15min(df_filtrado)
-        df_rango_hora = df_generator.crear_tabla_rango_hora(df_suma_por_hora)
-        
-        # Generar gráficos
-        grafico_barras = graph_generator.generar_grafico_barras(df_rango_hora)
-        grafico_barras_apiladas = graph_generator.generar_grafico_barras_apiladas(df_suma_por_hora)
-        
-        # Extraer totales para gráfico de torta
-        total_autos = df_suma_por_hora['AUTOS'].sum()
-        total_motos = df_suma_por_hora['MOTOS'].sum()
-        total_mio = df_suma_por_hora['MIO'].sum()
-        total_tpc = df_suma_por_hora['TPC'].sum()
-        total_camiones = df_suma_por_hora['CAMIONES'].sum()
-        total_mixtos = df_suma_por_hora['MIXTOS'].sum()
-        total_bicicletas = df_suma_por_hora['BICICLETAS'].sum()
-        
-        grafico_torta = graph_generator.generar_grafico_torta(
-            total_autos, total_motos, total_mio, total_tpc, 
-            total_camiones, total_mixtos, total_bicicletas
-        )
+    return data_filter.unir_filtros(filtros, obtener_filtros_disponibles(nuevas))
+
+
+def obtener_indice_filtros(df):
+    """
+    Construye el índice de códigos de los filtros para el DataFrame cargado
+    
+    Args:
+        df: DataFrame con los datos
         
-        graficos = {
-            'barras': grafico_barras,
-            'barras_apiladas': grafico_barras_apiladas,
-            'torta': grafico_torta
-        }
+    Returns:
+        Diccionario con el índice (ver data_filter.construir_indice_filtros)
+    """
+    try:
+        with profiler.etapa('índice de filtros', len(df)):
+            return data_filter.construir_indice_filtros(df)
+    except Exception as e:
+        raise Exception(f"Error al construir índice de filtros: {str(e)}")
+
+
+def actualizar_indice_filtros(indice, nuevas):
+    """
+    Extiende el índice de códigos de los filtros con unas filas agregadas al final del DataFrame
+    
+    Args:
+        indice: Índice de obtener_indice_filtros del conjunto cargado
+        nuevas: DataFrame con las filas agregadas
         
-        # Obtener hora pico
-        hora_pico = config.hora_pico_global
+    Returns:
+        Diccionario con el índice del conjunto combinado
+    """
+    try:
+        return data_filter.actualizar_indice_filtros(indice, nuevas)
+    except Exception as e:
+        raise Exception(f"Error al actualizar índice de filtros: {str(e)}")
+
+
+def obtener_facetas(df):
+    """
+    Construye el índice de facetas (combinaciones de valores de los filtros y sus filas)
+    
+    Args:
+        df: DataFrame con los datos
         
-        return df_filtrado, df_suma_por_hora, df_rango_hora, graficos, hora_pico
+    Returns:
+        Diccionario con el índice (ver data_filter.construir_facetas)
+    """
+    try:
+        with profiler.etapa('facetas de filtros', len(df)):
+            return data_filter.construir_facetas(df)
+    except Exception as e:
+        raise Exception(f"Error al construir facetas de filtros: {str(e)}")
+
+
+def actualizar_facetas(facetas, nuevas):
+    """
+    Suma al índice de facetas las combinaciones de unas filas agregadas
+    
+    Args:
+        facetas: Índice de obtener_facetas del conjunto cargado
+        nuevas: DataFrame con las filas agregadas
         
+    Returns:
+        Diccionario con el índice del conjunto combinado
+    """
+    try:
+        return data_filter.actualizar_facetas(facetas, nuevas)
     except Exception as e:
-        raise Exception(f"Error al aplicar filtros: {str(e)}")
+        raise Exception(f"Error al actualizar facetas de filtros: {str(e)}")
 
 
-def exportar_a_excel(df, nombre_archivo="dataframe"):
+def contar_opciones_filtros(facetas, filtros_seleccionados):
     """
-    Convierte un DataFrame a bytes de Excel para descarga
+    Calcula qué opciones de cada filtro siguen siendo válidas y cuántas filas tienen
     
     Args:
-        df: DataFrame a exportar
-        nombre_archivo: Nombre base del archivo
+        facetas: Índice de obtener_facetas
+        filtros_seleccionados: Selección parcial; los filtros vacíos o None no se aplican
         
     Returns:
-        Bytes del archivo Excel
+        Diccionario {columna: {opción: filas}} solo con las opciones que tienen filas
     """
-    import io
+    try:
+        return data_filter.contar_facetas(facetas, filtros_seleccionados)
+    except Exception as e:
+        raise Exception(f"Error al contar opciones de filtros: {str(e)}")
+
+
+def aplicar_filtros_seleccionados(df, filtros_seleccionados, indice=None, archivo_hash=None):
+    """
+    Aplica los filtros seleccionados al DataFrame
+    
+    Con el motor 'duckdb', si el archivo está en la caché en Parquet las sumas se
+    calculan sobre ese archivo; las filas filtradas se toman del DataFrame en
+    memoria con el índice, sin traerlas de DuckDB.
     
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Datos')
+    Args:
+        df: DataFrame original
+        filtros_seleccionados: Diccionario con los filtros seleccionados
+        indice: Índice de filtros del DataFrame (opcional, ver obtener_indice_filtros)
+        archivo_hash: Hash del contenido del archivo (opcional, para ubicar su caché)
+        
+    Returns:
+        Tupla con (df_filtrado, df_suma_por_hora, df_rango_hora, graficos)
+    """
+    try:
+        if config.motor_consultas == 'duckdb' and archivo_hash is not None:
+            ruta = file_cache.ruta_cache(archivo_hash)
+            if ruta is not None:
+                resultado = analyzer.analizar_con_duckdb(ruta, filtros_seleccionados, incluir_filas=False)
+                return (analyzer.filtrar_filas(df, filtros_seleccionados, indice),) + resultado[1:]
+        return analyzer.analizar(df, filtros_seleccionados, indice)
+    except Exception as e:
+        raise Exception(f"Error al aplicar filtros: {str(e)}")
+
+
+def normalizar_filtros(filtros_seleccionados):
+    """
+    Convierte la selección de filtros a una forma canónica e independiente del orden
     
-    return output.getvalue()
+    Args:
+        filtros_seleccionados: Diccionario con los filtros seleccionados
+        
+    Returns:
+        Tupla ordenada que identifica la selección (los filtros vacíos se omiten)
+    """
+    canonico = []
+    for columna in config.columnas_filtro:
+        seleccion = filtros_seleccionados.get(columna)
+        if not seleccion:
+            continue
+        if columna in ('HORA_I', 'HORA_F'):
+            valor = pd.to_datetime(seleccion, format='%H:%M:%S').strftime('%H:%M:%S')
+        elif columna == 'FECHA':
+            valor = tuple(sorted(set(pd.to_datetime(pd.Series(list(seleccion))).dt.strftime('%Y-%m-%d'))))
+        else:
+            valor = tuple(sorted(set(str(v) for v in seleccion)))
+        canonico.append((columna, valor))
+    return tuple(canonico)
 
 
-def exportar_grafico_html(fig, nombre_archivo="grafico"):
+def huella_analisis(archivo_hash, filtros_seleccionados):
     """
-    Convierte un gráfico de Plotly a HTML para descarga
+    Calcula la huella que identifica un análisis (archivo + selección de filtros)
     
     Args:
-        fig: Figura de Plotly
-        nombre_archivo: Nombre base del archivo
+        archivo_hash: Hash del contenido del archivo
+        filtros_seleccionados: Diccionario con los filtros seleccionados
         
     Returns:
-        Bytes del archivo HTML
+        String hexadecimal, o None si no se conoce el hash del archivo
     """
-    html_string = fig.to_html(include_plotlyjs='cdn')
-    return html_string.encode('utf-8')
+    if archivo_hash is None:
+        return None
+    clave = repr((archivo_hash, normalizar_filtros(filtros_seleccionados)))
+    return hashlib.sha256(clave.encode('utf-8')).hexdigest()
+
 
+def _guardar_resultado(huella, resultado):
+    """Guarda un resultado en la caché, sin sus filas filtradas"""
+    # Las filas filtradas pueden ser el mismo DataFrame de la sesión: guardarlas aquí lo dejaría
+    # fijo en memoria aunque el gestor de memoria lo baje a disco. Al reutilizar el resultado se
+    # vuelven a calcular con la máscara de los filtros
+    entrada = tuple(resultado[1:])
+    _cache_lru_guardar(_cache_resultados, huella, entrada, session_memory.tamano_objeto(entrada),
+                       config.cache_resultados_max_bytes)
 
-def exportar_grafico_png(fig):
+
+def aplicar_filtros_con_cache(df, filtros_seleccionados, archivo_hash, indice=None):
     """
-    Convierte un gráfico de Plotly a PNG para descarga
-    Requiere kaleido instalado
+    Igual que aplicar_filtros_seleccionados, pero reutiliza el resultado si el mismo
+    archivo ya se analizó con la misma selección de filtros
     
     Args:
-        fig: Figura de Plotly
+        df: DataFrame original
+        filtros_seleccionados: Diccionario con los filtros seleccionados
+        archivo_hash: Hash del contenido del archivo (si es None no se usa la caché)
+        indice: Índice de filtros del DataFrame (opcional)
         
     Returns:
-        Bytes del archivo PNG
+        La misma tupla que aplicar_filtros_seleccionados
+    """
+    huella = huella_analisis(archivo_hash, filtros_seleccionados)
+    with profiler.etapa('análisis', len(df)) as e:
+        if huella is None:
+            resultado = aplicar_filtros_seleccionados(df, filtros_seleccionados, indice, archivo_hash)
+        else:
+            entrada = _cache_lru_obtener(_cache_resultados, huella)
+            if entrada is None:
+                resultado = aplicar_filtros_seleccionados(df, filtros_seleccionados, indice, archivo_hash)
+                _guardar_resultado(huella, resultado)
+            else:
+                e.anotar('cache', True)
+                df_filtrado = analyzer.filtrar_filas(database_reader.aplicar_esquema(df), filtros_seleccionados, indice)
+                resultado = (df_filtrado,) + entrada
+        if resultado[0] is not None:
+            e.salida(len(resultado[0]))
+    return resultado
+
+
+def actualizar_analisis_con_cache(resultado, nuevas, filtros_seleccionados, archivo_hash):
+    """
+    Actualiza un análisis con las filas agregadas al conjunto, sin volver a procesarlo todo
+    
+    El resultado actualizado queda en la caché de resultados bajo el hash del
+    conjunto combinado, así volver a analizar con la misma selección lo reutiliza.
+    
+    Args:
+        resultado: Tupla de aplicar_filtros_con_cache del conjunto anterior
+        nuevas: DataFrame con las filas agregadas
+        filtros_seleccionados: Diccionario con los filtros del análisis
+        archivo_hash: Hash del conjunto combinado
+        
+    Returns:
+        La misma tupla que aplicar_filtros_seleccionados
     """
     try:
-        return fig.to_image(format="png", width=1200, height=800)
+        resultado = analyzer.actualizar_analisis(resultado, nuevas, filtros_seleccionados)
     except Exception as e:
-        # Si falla (por falta de kaleido), retornar None
+        raise Exception(f"Error al actualizar el análisis: {str(e)}")
+    
+    huella = huella_analisis(archivo_hash, filtros_seleccionados)
+    if huella is not None:
+        _guardar_resultado(huella, resultado)
+    return resultado
+
+
+def estadisticas_cache_resultados():
+    """
+    Devuelve el estado de la caché de resultados de análisis
+    
+    Returns:
+        Diccionario con aciertos, fallos, entradas, bytes usados y límite en bytes
+    """
+    with _cache_resultados['lock']:
+        return {
+            'aciertos': _cache_resultados['aciertos'],
+            'fallos': _cache_resultados['fallos'],
+            'entradas': len(_cache_resultados['entradas']),
+            'bytes': _cache_resultados['bytes'],
+            'max_bytes': config.cache_resultados_max_bytes
+        }
+
+
+def _clave_artefacto(nombre, nombre_archivo):
+    # El ZIP incluye el nombre del archivo original en su LEEME, por eso forma parte de la clave
+    return f"zip:{nombre_archivo}" if nombre == 'zip' else nombre
+
+
+def _construir_artefacto(huella, nombre, construir):
+    """Devuelve los bytes del artefacto desde la caché, o los genera la primera vez"""
+    datos = None if huella is None else _cache_lru_obtener(_cache_artefactos, (huella, nombre))
+    if datos is None:
+        with profiler.etapa(f"exportación {nombre}") as e:
+            datos = construir()
+            e.anotar('bytes', len(datos))
+        if huella is not None:
+            _cache_lru_guardar(_cache_artefactos, (huella, nombre), datos, len(datos),
+                               config.cache_artefactos_max_bytes)
+    return datos
+
+
+def obtener_artefacto(resultados, nombre, nombre_archivo=None):
+    """
+    Genera (o recupera de la caché) un archivo de descarga del análisis
+    
+    Args:
+        resultados: Diccionario de resultados guardado en la sesión (con su 'huella')
+        nombre: 'zip' o una de las claves de exporter.ARTEFACTOS (p. ej. 'excel_filtrado')
+        nombre_archivo: Nombre del archivo original (solo para el ZIP)
+        
+    Returns:
+        Bytes del archivo
+    """
+    huella = resultados.get('huella')
+    if nombre == 'zip':
+        construir = lambda: crear_zip_completo(
+            resultados['df_filtrado'], resultados['df_suma_hora'], resultados['df_rango_hora'],
+            resultados['graficos'], resultados['hora_pico'], nombre_archivo, huella=huella
+        )
+    else:
+        construir = lambda: ARTEFACTOS[nombre](resultados)
+    return _construir_artefacto(huella, _clave_artefacto(nombre, nombre_archivo), construir)
+
+
+def artefacto_en_cache(resultados, nombre, nombre_archivo=None):
+    """
+    Devuelve los bytes de un archivo de descarga si ya se generó, sin generarlo
+    
+    Args:
+        resultados: Diccionario de resultados guardado en la sesión
+        nombre: Nombre del artefacto (ver obtener_artefacto)
+        nombre_archivo: Nombre del archivo original (solo para el ZIP)
+        
+    Returns:
+        Bytes del archivo o None
+    """
+    huella = resultados.get('huella')
+    if huella is None:
         return None
+    return _cache_lru_obtener(_cache_artefactos, (huella, _clave_artefacto(nombre, nombre_archivo)), contar=False)
 
 
-def crear_zip_completo(df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico, nombre_archivo):
+def crear_zip_completo(df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico, nombre_archivo, huella=None):
     """
     Crea un archivo ZIP con todos los resultados del análisis
     
@@ -229,118 +684,102 @@ def crear_zip_completo(df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_
         graficos: Diccionario con las figuras de Plotly
         hora_pico: String con información de hora pico
         nombre_archivo: Nombre base del archivo original
+        huella: Huella del análisis (opcional); si se entrega, los Excel y HTML
+            ya generados para la descarga individual se reutilizan
         
     Returns:
         Bytes del archivo ZIP
     """
-    import io
-    import zipfile
-    from datetime import datetime
-    
-    # Crear buffer para el ZIP
-    zip_buffer = io.BytesIO()
-    
-    # Obtener nombre limpio del archivo (sin extensión)
-    nombre_base = nombre_archivo.replace('.xlsx', '').replace('.csv', '')
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # 1. Agregar DataFrames como Excel
-        zip_file.writestr(
-            f"01_datos_filtrados.xlsx",
-            exportar_a_excel(df_filtrado, "datos_filtrados")
-        )
-        
-        zip_file.writestr(
-            f"02_suma_15min.xlsx",
-            exportar_a_excel(df_suma_hora, "suma_15min")
-        )
-        
-        zip_file.writestr(
-            f"03_rango_hora.xlsx",
-            exportar_a_excel(df_rango_hora, "rango_hora")
-        )
-        
-        # 2. Agregar gráficos como HTML
-        zip_file.writestr(
-            f"04_grafico_hora_pico.html",
-            exportar_grafico_html(graficos['barras'], "grafico_barras")
-        )
-        
-        zip_file.writestr(
-            f"05_grafico_barras_apiladas.html",
-            exportar_grafico_html(graficos['barras_apiladas'], "grafico_barras_apiladas")
-        )
-        
-        zip_file.writestr(
-            f"06_grafico_composicion.html",
-            exportar_grafico_html(graficos['torta'], "grafico_torta")
-        )
-        
-        # 3. Agregar hora pico como TXT
-        zip_file.writestr(
-            f"00_HORA_PICO.txt",
-            hora_pico.encode('utf-8')
-        )
-        
-        # 4. Agregar README con información
-        readme_content = f"""
-╔════════════════════════════════════════════════════════════╗
-║          ANÁLISIS DE AFOROS VEHICULARES - GRUPOVIAL        ║
-╚════════════════════════════════════════════════════════════╝
+    return exporter.crear_zip_completo(
+        df_filtrado, df_suma_hora, df_rango_hora, graficos, hora_pico, nombre_archivo,
+        obtener_artefacto=lambda nombre, construir: _construir_artefacto(huella, nombre, construir)
+    )
 
-📅 Fecha de generación: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
-📁 Archivo original: {nombre_archivo}
-🕐 {hora_pico}
 
-═══════════════════════════════════════════════════════════════
-
-📋 CONTENIDO DEL ARCHIVO:
-
-1. 📊 DATOS Y TABLAS (Excel):
-   ├─ 01_datos_filtrados.xlsx      - Datos completos después de filtros
-   ├─ 02_suma_15min.xlsx            - Resumen cada 15 minutos
-   └─ 03_rango_hora.xlsx            - Resumen por hora
+def guardar_en_sesion(id_sesion, clave, valor):
+    """
+    Guarda datos o resultados de una sesión bajo el presupuesto de memoria
+    
+    Si la sesión (o el servidor) supera su presupuesto, lo usado hace más tiempo
+    pasa a disco y se vuelve a cargar al pedirlo (ver conteo.session_memory).
+    
+    Args:
+        id_sesion: Identificador de la sesión de Streamlit
+        clave: Nombre del objeto (p. ej. 'df_original' o 'resultados')
+        valor: Objeto a guardar; None lo elimina
+    """
+    try:
+        session_memory.guardar(id_sesion, clave, valor)
+    except Exception as e:
+        raise Exception(f"Error al guardar en la sesión: {str(e)}")
 
-2. 📈 GRÁFICOS INTERACTIVOS (HTML):
-   ├─ 04_grafico_hora_pico.html     - Gráfico de barras con hora pico
-   ├─ 05_grafico_barras_apiladas.html - Distribución por tipo de vehículo
-   └─ 06_grafico_composicion.html   - Composición vehicular (torta)
 
-3. 📝 INFORMACIÓN:
-   └─ 00_HORA_PICO.txt              - Información de hora pico
+def obtener_de_sesion(id_sesion, clave):
+    """
+    Devuelve un objeto guardado con guardar_en_sesion, cargándolo de disco si hace falta
+    
+    Args:
+        id_sesion: Identificador de la sesión de Streamlit
+        clave: Nombre del objeto
+        
+    Returns:
+        El objeto guardado o None
+    """
+    try:
+        return session_memory.obtener(id_sesion, clave)
+    except Exception as e:
+        raise Exception(f"Error al leer de la sesión: {str(e)}")
 
-═══════════════════════════════════════════════════════════════
 
-💡 CÓMO USAR LOS GRÁFICOS HTML:
+def uso_memoria_sesion(id_sesion):
+    """
+    Devuelve el uso de memoria de la sesión y del servidor
+    
+    Args:
+        id_sesion: Identificador de la sesión de Streamlit
+        
+    Returns:
+        Diccionario con los bytes en memoria y en disco de la sesión, la memoria
+        de todas las sesiones y los presupuestos
+    """
+    return session_memory.uso(id_sesion)
 
-1. Abre los archivos .html en cualquier navegador web
-2. Los gráficos son INTERACTIVOS:
-   - Haz zoom con el mouse
-   - Pasa el cursor para ver detalles
-   - Usa los botones en la esquina superior derecha para:
-     * Descargar como PNG
-     * Hacer zoom
-     * Pan
-     * Resetear vista
 
-═══════════════════════════════════════════════════════════════
+def perfilar_ejecucion(memoria=True):
+    """
+    Registra el tiempo, las filas y el pico de memoria de las etapas del análisis
+    que corren dentro del bloque (ver conteo/profiler.py)
+    
+    Args:
+        memoria: Si se mide también el pico de memoria de cada etapa (más lento)
+        
+    Returns:
+        Administrador de contexto que entrega la lista de registros de las etapas
+    """
+    return profiler.perfilar(memoria)
 
-📊 RESUMEN DEL ANÁLISIS:
 
-Total de registros filtrados: {len(df_filtrado):,}
-Periodo analizado: Ver archivos de datos
-{hora_pico}
+def perfil_a_json(etapas):
+    """
+    Serializa los registros de perfilar_ejecucion para descargarlos
+    
+    Args:
+        etapas: Lista de registros de las etapas
+        
+    Returns:
+        Bytes del JSON
+    """
+    return profiler.a_json(etapas).encode('utf-8')
 
-═══════════════════════════════════════════════════════════════
 
-🚗 GRUPOVIALAPP v2.0 - Powered by Streamlit
-        """
-        
-        zip_file.writestr(
-            f"LEEME.txt",
-            readme_content.encode('utf-8')
-        )
+def columnas_visibles(df):
+    """
+    Quita las columnas auxiliares de minutos del día (MINUTO_I, MINUTO_F) para mostrar el DataFrame
     
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+    Args:
+        df: DataFrame con el esquema compacto
+        
+    Returns:
+        DataFrame sin las columnas de config.columnas_minuto
+    """
+    return database_reader.quitar_columnas_minuto(df)